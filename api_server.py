@@ -1,61 +1,236 @@
-from fastapi import FastAPI, HTTPException, Query, Header
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from config import config
 from storage.google_sheets import GoogleSheetsStorage
+from storage.postgres_storage import PostgresNoteStorage
+from storage.note_events import NoteEventBus, RESYNC
+from storage.pg_listener import PgListener
 from services import NoteService
 from services.relation_service import RelationService
 from schemas import (
     StatusUpdate, NotesResponse, RelatedNotesResponse, ReplyChainResponse,
-    FragmentsRequest, FragmentsResponse
+    RelationsRequest, RelationsResponse, FragmentsRequest, FragmentsResponse
 )
 from storage.fragments_db import insert_fragments_batch, get_fragments_count
 from services.normalizer_service import normalize_fragments
 from bot.utils import get_user_spreadsheet
+from telegram import Update
+from storage.db import init_db, listen_for_lookup_invalidations
+from metrics import (
+    HTTP_REQUEST_SECONDS, HTTP_REQUESTS, HTTP_IN_PROGRESS,
+    track, route_label, register_sheets_stats, start_metrics_server,
+)
+from static_assets import Asset, AssetBundle, STATIC_PREFIX
+from storage.parsed_note import parse_fields
 from datetime import datetime
+from typing import Any, Optional
+import asyncio
+import hmac
+import json
 import os
 import logging
 
+try:
+    import orjson
+    _orjson_available = True
+except ImportError:
+    _orjson_available = False
+
 app = FastAPI()
 
+# Upper bound for GET /api/notes?limit=
+MAX_NOTES_PAGE_SIZE = 500
+# Max note IDs per POST /api/notes/relations
+MAX_RELATIONS_BATCH = 50
+# Comment line sent on idle event streams so proxies don't close them (seconds)
+SSE_HEARTBEAT_INTERVAL = 15
+# Reconnect delay EventSource clients are told to use (milliseconds)
+SSE_RETRY_MS = 3000
+# Route Telegram pushes updates to in single-process mode
+WEBHOOK_PATH = '/telegram/webhook'
+# GET /api/notes/{note_id}/related?mode=
+RELATED_MODE_TAGS = 'tags'
+RELATED_MODE_SEMANTIC = 'semantic'
+
 # Initialize storage and services
-storage = GoogleSheetsStorage(credentials_path=config['credentials_path'])
+# Notes are read from Postgres; the bot process pushes changes to Google Sheets
+storage = PostgresNoteStorage(GoogleSheetsStorage(credentials_path=config['credentials_path']))
 note_service = NoteService(storage)
 relation_service = RelationService(storage)
+register_sheets_stats(storage.sheets)
+# NOTIFY channels this process reacts to share one LISTEN connection
+pg_listener = PgListener()
+# Note changes from both processes, pushed to open webapps (GET /api/notes/events)
+note_events = NoteEventBus(pg_listener)
+listen_for_lookup_invalidations(pg_listener)
+
+# Single-process mode (BOT_WEBHOOK_URL set): the bot runs here on the same storage,
+# so both share one DB pool, one Sheets client and the snapshot caches
+bot_application = None
+if config['webhook_url']:
+    # Imported only here: the handlers pull in the clustering/ML dependencies
+    from bot.application import build_application
+    bot_application = build_application(storage, webhook=True)
+
+# Webapp files with content-hashed names, precompressed once at startup
+webapp_assets = AssetBundle("webapp")
+
+async def notes_etag(spreadsheet_id: str) -> str:
+    """ETag of every note response of a spreadsheet: its notes revision."""
+    revision = await storage.get_notes_revision(spreadsheet_id)
+    return f'W/"{revision}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, so W/ prefixes are ignored)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+def encode_json(payload: Any) -> bytes:
+    """Compact UTF-8 JSON (orjson if installed); non-ASCII text is not \\u-escaped."""
+    if _orjson_available:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def json_response(payload: Any, etag: Optional[str] = None) -> Response:
+    """
+    Serialize a payload we built ourselves, skipping response_model validation
+    (the declared models still document the endpoints).
+    """
+    response = Response(content=encode_json(payload), media_type='application/json')
+    if etag:
+        set_cache_headers(response, etag)
+    return response
+
+def fields_param(fields: Optional[str]) -> Optional[tuple]:
+    """Parse ?fields=, answering 400 on unknown names."""
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def set_cache_headers(response: Response, etag: str):
+    # no-cache: the browser keeps the body but revalidates it with If-None-Match every time
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+
+def not_modified(etag: str) -> Response:
+    response = Response(status_code=304)
+    set_cache_headers(response, etag)
+    return response
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Latency, status and in-flight count per route template (served on METRICS_PORT)."""
+    method, route = request.method, route_label(app, request.scope)
+    try:
+        with track(HTTP_REQUEST_SECONDS, None, HTTP_IN_PROGRESS, method, route):
+            response = await call_next(request)
+    except Exception:
+        HTTP_REQUESTS.labels(method, route, '500').inc()
+        raise
+    HTTP_REQUESTS.labels(method, route, str(response.status_code)).inc()
+    return response
+
+@app.on_event("startup")
+async def serve_metrics():
+    # On their own port, never on this public app (it also receives the Telegram webhook)
+    if config['metrics_port']:
+        start_metrics_server(config['metrics_port'])
+        logging.info(f"Serving metrics on port {config['metrics_port']}")
+
+@app.on_event("startup")
+async def start_note_events():
+    note_events.start()
+    pg_listener.start()
+
+@app.on_event("startup")
+async def start_bot():
+    """In single-process mode: start the bot and point Telegram at the webhook route."""
+    if bot_application is None:
+        return
+    # No separate bot process to do it
+    init_db()
+    await bot_application.initialize()
+    await bot_application.start()
+    storage.start_sheet_sync()
+    # Pending updates are kept: Telegram delivers what arrived during the restart
+    await bot_application.bot.set_webhook(
+        url=config['webhook_url'].rstrip('/') + WEBHOOK_PATH,
+        secret_token=config['webhook_secret'],
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logging.info(f"Bot is running on webhook {WEBHOOK_PATH}")
+
+@app.on_event("shutdown")
+async def drain_storage():
+    """Flush queued Sheets writes before the server exits."""
+    pg_listener.stop()
+    if bot_application is not None:
+        # Let handlers in progress finish their writes before the storage is drained
+        await bot_application.stop()
+        await bot_application.shutdown()
+    await storage.close()
+
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None),
+):
+    """Receive a Telegram update (single-process mode). Acknowledged as soon as it is queued."""
+    if bot_application is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not hmac.compare_digest(x_telegram_bot_api_secret_token or '', config['webhook_secret']):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+
+    update = Update.de_json(await request.json(), bot_application.bot)
+    await bot_application.update_queue.put(update)
+    return Response(status_code=200)
+
+def sse_message(event: dict) -> bytes:
+    """One Server-Sent Events message; the id is the notes revision after the change."""
+    lines = f"event: {event['type']}\n"
+    if event.get('revision') is not None:
+        lines = f"id: {event['revision']}\n" + lines
+    return lines.encode('utf-8') + b"data: " + encode_json(event) + b"\n\n"
+
+def serve_asset(asset: Asset, accept_encoding: Optional[str], if_none_match: Optional[str]) -> Response:
+    """Precompressed asset body matching Accept-Encoding, or 304 if the client has it."""
+    headers = {
+        'Cache-Control': asset.cache_control,
+        'ETag': asset.etag,
+        'Vary': 'Accept-Encoding',
+    }
+    if etag_matches(if_none_match, asset.etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding, body = asset.select(accept_encoding)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type=asset.content_type, headers=headers)
 
 @app.get("/")
-async def root():
-    """Serve the main webapp page"""
-    return FileResponse("webapp/index.html")
-
-@app.get("/styles.css")
-async def get_styles():
-    """Serve CSS file"""
-    return FileResponse("webapp/styles.css")
-
-@app.get("/app.js")
-async def get_app_js():
-    """Serve JS file"""
-    return FileResponse("webapp/app.js")
-
-@app.get("/api.js")
-async def get_api_js():
-    """Serve API JS file"""
-    return FileResponse("webapp/api.js")
-
-@app.get("/state.js")
-async def get_state_js():
-    """Serve State JS file"""
-    return FileResponse("webapp/state.js")
-
-@app.get("/ui.js")
-async def get_ui_js():
-    """Serve UI JS file"""
-    return FileResponse("webapp/ui.js")
-
-@app.get("/gestures.js")
-async def get_gestures_js():
-    """Serve Gestures JS file"""
-    return FileResponse("webapp/gestures.js")
+async def root(
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Serve the main webapp page (revalidated on every open, points to the current asset names)"""
+    return serve_asset(webapp_assets.index, accept_encoding, if_none_match)
+
+@app.get(f"/{STATIC_PREFIX}/{{name}}")
+async def get_static_asset(
+    name: str,
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    """Serve a content-hashed JS/CSS file (cached by the browser for a year)"""
+    asset = webapp_assets.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return serve_asset(asset, accept_encoding, if_none_match)
 
 @app.post("/api/notes/{note_id}/status")
 async def update_note_status(note_id: str, update: StatusUpdate):
@@ -78,24 +253,59 @@ async def update_note_status(note_id: str, update: StatusUpdate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/notes")
-async def get_notes(user_id: int = Query(None)):
+@app.get("/api/notes", response_model=NotesResponse)
+async def get_notes(
+    user_id: int = Query(None),
+    limit: int = Query(None, ge=1, le=MAX_NOTES_PAGE_SIZE),
+    cursor: str = Query(None),
+    status: str = Query(None),
+    fields: str = Query(None),
+    since: str = Query(None),
+    if_none_match: Optional[str] = Header(None),
+):
     """
-    Get all notes for a user from their Google Sheet.
-    Filters out 'archived' and 'done'.
-    Sorts 'focus' to the top.
+    Get notes for a user: 'focus' first, then newest first.
+
+    Args:
+        user_id: The Telegram user ID (demo data if omitted)
+        limit: Page size; without it all notes are returned
+        cursor: next_cursor from the previous page
+        status: Comma-separated statuses to include, e.g. "new,focus"
+            ('new' also matches notes without a status). All statuses if omitted.
+        fields: Comma-separated note fields to return, e.g. "id,created_at,content_preview"
+            (content_preview = first characters of the content). All fields if omitted.
+        since: `revision` of an earlier response. Returns only notes created or
+            changed after it (delta=true), plus `removed` for changed notes that
+            no longer match `status`. Falls back to the full list (delta=false)
+            if the revision can't be used. Not combinable with limit/cursor.
+
+    Answers 304 Not Modified when If-None-Match carries the current ETag.
     """
     try:
         # If no user_id provided, return demo data
         if user_id is None:
             return note_service.get_demo_notes()
 
-        response = await note_service.get_user_notes(user_id)
+        spreadsheet_id = get_user_spreadsheet(user_id)
+        if not spreadsheet_id:
+            raise HTTPException(status_code=404, detail="User not registered")
+
+        projection = fields_param(fields)
+        etag = await notes_etag(spreadsheet_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        statuses = [s.strip() for s in status.split(',') if s.strip()] if status else None
+
+        try:
+            notes = await note_service.get_user_notes(user_id, limit, cursor, statuses, projection, since)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        if response is None:
+        if notes is None:
              raise HTTPException(status_code=404, detail="User not registered")
 
-        return response
+        return json_response(notes, etag)
 
     except HTTPException:
         raise
@@ -103,22 +313,124 @@ async def get_notes(user_id: int = Query(None)):
         print(f"Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/notes/events")
+async def stream_note_events(
+    user_id: int = Query(...),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events stream of the user's note changes, so the webapp can
+    patch its notes in place instead of reloading them.
+
+    Events (data is JSON):
+        note_created / note_updated: {type, note_id, revision, note}
+        status_changed: {type, note_id, revision, status}
+        resync: the client fell behind and should reload GET /api/notes
+
+    An EventSource reconnecting sends Last-Event-ID (the revision of the last
+    event it got); if notes changed since, the stream starts with resync.
+    """
+    spreadsheet_id = get_user_spreadsheet(user_id)
+    if not spreadsheet_id:
+        raise HTTPException(status_code=404, detail="User not registered")
+
+    async def stream():
+        subscription = note_events.subscribe(spreadsheet_id)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n".encode('utf-8')
+            # Checked after subscribing: a change committed in between is both resynced and streamed
+            if last_event_id is not None:
+                revision = await storage.get_notes_revision(spreadsheet_id)
+                if last_event_id != str(revision):
+                    yield sse_message({'type': RESYNC})
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield sse_message(event)
+        finally:
+            # Runs when the client disconnects and the response task is cancelled
+            note_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.post("/api/notes/relations", response_model=RelationsResponse)
+async def get_relations_batch(request: RelationsRequest):
+    """
+    Related notes and reply stats for several notes in one round trip
+    (lets the webapp prefetch the cards around the visible one).
+
+    Args:
+        request: user_id, note_ids (up to MAX_RELATIONS_BATCH), optional related_limit
+            and fields (note fields of the related notes, as in GET /api/notes)
+
+    Returns:
+        RelationsResponse keyed by note ID; unknown IDs are listed in `missing`
+    """
+    if len(request.note_ids) > MAX_RELATIONS_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RELATIONS_BATCH} note IDs per request")
+    if request.related_limit is not None and request.related_limit < 1:
+        raise HTTPException(status_code=400, detail="related_limit must be positive")
+    projection = fields_param(request.fields)
+
+    try:
+        spreadsheet_id = get_user_spreadsheet(request.user_id)
+        if not spreadsheet_id:
+            raise HTTPException(status_code=404, detail="User not registered")
+
+        relations = await relation_service.get_relations(
+            note_ids=request.note_ids,
+            spreadsheet_id=spreadsheet_id,
+            related_limit=request.related_limit,
+            fields=projection
+        )
+
+        return json_response({
+            'relations': relations,
+            'missing': [note_id for note_id in dict.fromkeys(request.note_ids) if note_id not in relations],
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error fetching batch relations: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/notes/{note_id}/related", response_model=RelatedNotesResponse)
-async def get_related_notes(note_id: str, user_id: int = Query(...)):
+async def get_related_notes(
+    note_id: str,
+    user_id: int = Query(...),
+    fields: str = Query(None),
+    limit: int = Query(None, ge=1),
+    mode: str = Query(RELATED_MODE_TAGS, pattern=f"^({RELATED_MODE_TAGS}|{RELATED_MODE_SEMANTIC})$"),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Get notes related to the specified note based on common tags.
 
     Args:
         note_id: The ID of the note to find relations for (Column A in Google Sheets)
         user_id: The Telegram user ID
+        fields: Comma-separated note fields to return (as in GET /api/notes)
+        limit: Return only the top N related notes (all if omitted; 20 in semantic mode)
+        mode: 'tags' (common tags) or 'semantic' (embedding similarity, tags as a bonus)
 
     Returns:
-        RelatedNotesResponse with sorted list of related notes
+        RelatedNotesResponse with sorted list of related notes and the mode used
+        (304 Not Modified if If-None-Match carries the current ETag)
 
-    Algorithm:
+    Algorithm (tags):
         1. Finds all notes with at least one common tag
         2. Sorts by: common_tags_count DESC, created_at DESC
         3. Includes all statuses (new, focus, done, archived)
+
+    Semantic mode falls back to tags while the note has no embedding.
     """
     try:
         # Get user's spreadsheet ID
@@ -126,17 +438,43 @@ async def get_related_notes(note_id: str, user_id: int = Query(...)):
         if not spreadsheet_id:
             raise HTTPException(status_code=404, detail="User not registered")
 
+        projection = fields_param(fields)
+
+        if mode == RELATED_MODE_SEMANTIC:
+            # Not cacheable by the notes ETag: embeddings are added after the note is saved
+            related_notes = await relation_service.get_semantic_related_notes(
+                note_id=note_id,
+                spreadsheet_id=spreadsheet_id,
+                user_id=user_id,
+                fields=projection,
+                limit=limit
+            )
+            if related_notes is not None:
+                return json_response({
+                    'related': related_notes,
+                    'total': len(related_notes),
+                    'note_id': note_id,
+                    'mode': RELATED_MODE_SEMANTIC,
+                })
+
+        etag = await notes_etag(spreadsheet_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
         # Compute related notes
         related_notes = await relation_service.get_related_notes(
             note_id=note_id,
-            spreadsheet_id=spreadsheet_id
+            spreadsheet_id=spreadsheet_id,
+            fields=projection,
+            limit=limit
         )
 
-        return RelatedNotesResponse(
-            related=related_notes,
-            total=len(related_notes),
-            note_id=note_id
-        )
+        return json_response({
+            'related': related_notes,
+            'total': len(related_notes),
+            'note_id': note_id,
+            'mode': RELATED_MODE_TAGS,
+        }, etag)
 
     except HTTPException:
         raise
@@ -146,16 +484,23 @@ async def get_related_notes(note_id: str, user_id: int = Query(...)):
 
 
 @app.get("/api/notes/{note_id}/replies", response_model=ReplyChainResponse)
-async def get_reply_chain(note_id: str, user_id: int = Query(...)):
+async def get_reply_chain(
+    note_id: str,
+    user_id: int = Query(...),
+    fields: str = Query(None),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Get reply chain for the specified note.
 
     Args:
         note_id: The ID of the note to build chain for
         user_id: The Telegram user ID
+        fields: Comma-separated note fields to return (as in GET /api/notes)
 
     Returns:
         ReplyChainResponse with chain, stats, and navigation info
+        (304 Not Modified if If-None-Match carries the current ETag)
 
     Algorithm:
         1. Finds ancestors (path up to root)
@@ -168,19 +513,19 @@ async def get_reply_chain(note_id: str, user_id: int = Query(...)):
         if not spreadsheet_id:
             raise HTTPException(status_code=404, detail="User not registered")
 
+        projection = fields_param(fields)
+        etag = await notes_etag(spreadsheet_id)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
         # Build reply chain
         result = await relation_service.get_reply_chain(
             note_id=note_id,
-            spreadsheet_id=spreadsheet_id
+            spreadsheet_id=spreadsheet_id,
+            fields=projection
         )
 
-        return ReplyChainResponse(
-            chain=result['chain'],
-            current_index=result['current_index'],
-            stats=result['stats'],
-            branches=result['branches'],
-            note_id=note_id
-        )
+        return json_response({**result, 'note_id': note_id}, etag)
 
     except HTTPException:
         raise
@@ -0,0 +1,65 @@
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, filters
+from config import config
+from bot.handlers import start, handle_message, handle_edited_message
+from bot.channel_integration import link_channel_handler, channel_post_handler, edited_channel_post_handler
+from bot.tag_handler import tag_command
+from bot.brain_handler import search_command, normalize_command, cluster_command, artifact_command
+from metrics import instrument_handler
+
+
+def build_application(storage, webhook: bool = False, post_init=None, post_shutdown=None) -> Application:
+    """
+    Build the bot with all handlers registered.
+
+    Args:
+        storage: Note storage handlers read from bot_data['storage']
+        webhook: Updates are pushed to the API server's webhook route instead of
+            long-polled, so no Updater is created
+        post_init, post_shutdown: Lifecycle hooks, called by run_polling
+    """
+    builder = ApplicationBuilder().token(config['bot_token'])
+    if webhook:
+        builder = builder.updater(None)
+    if post_init:
+        builder = builder.post_init(post_init)
+    if post_shutdown:
+        builder = builder.post_shutdown(post_shutdown)
+    application = builder.build()
+
+    # Store storage in bot_data so handlers can access it
+    application.bot_data['storage'] = storage
+
+    # Register handlers (each timed for /metrics under the command or update type)
+    application.add_handler(CommandHandler("start", instrument_handler("/start", start)))
+    application.add_handler(CommandHandler("link_channel", instrument_handler("/link_channel", link_channel_handler)))
+    application.add_handler(CommandHandler("tag", instrument_handler("/tag", tag_command)))
+    application.add_handler(CommandHandler("search", instrument_handler("/search", search_command)))
+    application.add_handler(CommandHandler("normalize", instrument_handler("/normalize", normalize_command)))
+    application.add_handler(CommandHandler("cluster", instrument_handler("/cluster", cluster_command)))
+    application.add_handler(CommandHandler("artifact", instrument_handler("/artifact", artifact_command)))
+
+    # Handle channel posts
+    application.add_handler(MessageHandler(
+        filters.UpdateType.CHANNEL_POST,
+        instrument_handler("channel_post", channel_post_handler)
+    ))
+
+    # Handle edited channel posts
+    application.add_handler(MessageHandler(
+        filters.UpdateType.EDITED_CHANNEL_POST,
+        instrument_handler("edited_channel_post", edited_channel_post_handler)
+    ))
+
+    # Handle all messages (text, forwards, media with captions, voice/audio) - but NOT edited
+    application.add_handler(MessageHandler(
+        (filters.TEXT | filters.CAPTION | filters.FORWARDED | filters.VOICE | filters.AUDIO) & ~filters.COMMAND & ~filters.UpdateType.EDITED_MESSAGE,
+        instrument_handler("message", handle_message)
+    ))
+
+    # Handle edited messages separately
+    application.add_handler(MessageHandler(
+        (filters.TEXT | filters.CAPTION) & filters.UpdateType.EDITED_MESSAGE,
+        instrument_handler("edited_message", handle_edited_message)
+    ))
+
+    return application
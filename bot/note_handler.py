@@ -180,6 +180,8 @@ async def save_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.info(f"Saving {len(messages_to_save)} messages")
         for i, note in enumerate(messages_to_save):
             logging.info(f"Message {i+1}: type={note.get('message_type')}")
+            # Notes of one message are saved within the same second: keep their IDs apart
+            note['part'] = i
             await storage.save_note(spreadsheet_id, note)
             _save_to_fragments(note, user_id)
         await update.message.set_reaction(reaction=ReactionTypeEmoji(emoji="✍️"))
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import sys
 from dotenv import load_dotenv
@@ -36,10 +37,23 @@ def load_config():
     # OpenAI API key (optional - for voice transcription)
     openai_api_key = os.getenv("OPENAI_API_KEY")
 
+    # Public base URL of the API server (optional). When set, the bot runs inside
+    # api_server.py and receives updates on a webhook instead of long polling.
+    webhook_url = os.getenv("BOT_WEBHOOK_URL")
+    # Telegram echoes it in a header on every webhook call; derived from the token if unset
+    webhook_secret = os.getenv("BOT_WEBHOOK_SECRET") or hashlib.sha256(bot_token.encode()).hexdigest()[:32]
+
+    # Port for this process's Prometheus metrics (optional; API and bot processes on one
+    # host need different values)
+    metrics_port = os.getenv("METRICS_PORT")
+
     return {
         "bot_token": bot_token,
         "credentials_path": credentials_path,
-        "openai_api_key": openai_api_key
+        "openai_api_key": openai_api_key,
+        "webhook_url": webhook_url,
+        "webhook_secret": webhook_secret,
+        "metrics_port": int(metrics_port) if metrics_port else None
     }
 
 # Load config on import to fail fast
@@ -1,14 +1,12 @@
 import logging
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 from storage.google_sheets import GoogleSheetsStorage
-from storage.db import init_db
+from storage.postgres_storage import PostgresNoteStorage
+from storage.db import init_db, listen_for_lookup_invalidations
+from storage.pg_listener import PgListener
 from config import config
-from bot.handlers import start, handle_message, handle_edited_message
-
-from bot.channel_integration import link_channel_handler, channel_post_handler, edited_channel_post_handler
-from bot.tag_handler import tag_command
-from bot.brain_handler import search_command, normalize_command, cluster_command, artifact_command
+from bot.application import build_application
+from metrics import register_sheets_stats, start_metrics_server
 
 # Configure logging
 logging.basicConfig(
@@ -16,47 +14,36 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+async def start_sheet_sync(application):
+    """Start pushing notes from Postgres to Google Sheets (the bot process owns the sync job)."""
+    application.bot_data['storage'].start_sheet_sync()
+
+async def drain_storage(application):
+    """Flush queued Sheets writes before the bot exits."""
+    await application.bot_data['storage'].close()
+
 def main():
     # Initialize database
     logging.info("Initializing database...")
     init_db()
-    
+
+    # Drop cached user/channel lookups when the API process changes them
+    pg_listener = PgListener()
+    listen_for_lookup_invalidations(pg_listener)
+    pg_listener.start()
+
     # Initialize storage
-    storage = GoogleSheetsStorage(credentials_path=config['credentials_path'])
-    
-    # Initialize Application
-    application = ApplicationBuilder().token(config['bot_token']).build()
-    
-    # Store storage in bot_data so handlers can access it
-    application.bot_data['storage'] = storage
-    
-    # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("link_channel", link_channel_handler))
-    application.add_handler(CommandHandler("tag", tag_command))
-    application.add_handler(CommandHandler("search", search_command))
-    application.add_handler(CommandHandler("normalize", normalize_command))
-    application.add_handler(CommandHandler("cluster", cluster_command))
-    application.add_handler(CommandHandler("artifact", artifact_command))
-    
-    # Handle channel posts
-    application.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, channel_post_handler))
-    
-    # Handle edited channel posts
-    application.add_handler(MessageHandler(filters.UpdateType.EDITED_CHANNEL_POST, edited_channel_post_handler))
-    
-    # Handle all messages (text, forwards, media with captions, voice/audio) - but NOT edited
-    application.add_handler(MessageHandler(
-        (filters.TEXT | filters.CAPTION | filters.FORWARDED | filters.VOICE | filters.AUDIO) & ~filters.COMMAND & ~filters.UpdateType.EDITED_MESSAGE,
-        handle_message
-    ))
-    
-    # Handle edited messages separately
-    application.add_handler(MessageHandler(
-        (filters.TEXT | filters.CAPTION) & filters.UpdateType.EDITED_MESSAGE,
-        handle_edited_message
-    ))
-    
+    storage = PostgresNoteStorage(GoogleSheetsStorage(credentials_path=config['credentials_path']))
+
+    # Metrics of this process (handlers, Sheets, SQL, OpenAI)
+    register_sheets_stats(storage.sheets)
+    if config['metrics_port']:
+        start_metrics_server(config['metrics_port'])
+        logging.info(f"Serving metrics on port {config['metrics_port']}")
+
+    # Initialize Application with all handlers
+    application = build_application(storage, post_init=start_sheet_sync, post_shutdown=drain_storage)
+
     print("Bot is running (python-telegram-bot)...")
     # Explicitly allow channel_post updates
     # Drop pending updates to avoid conflicts with other instances
@@ -0,0 +1,214 @@
+"""
+Prometheus metrics: latency histograms, error counts and in-flight gauges of
+API routes, bot handlers, Google Sheets calls, SQL queries and OpenAI requests.
+
+Each process serves its own metrics on METRICS_PORT (if set): the API server
+(with the bot inside it in webhook mode) and, with long polling, the bot process.
+They are not exposed on the public API app.
+"""
+
+import functools
+import re
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Seconds; spans a cached API read (ms) to a Whisper transcription (tens of seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ayda_http_request_duration_seconds', 'API request latency until the response starts',
+    ['method', 'route'], buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS = Counter('ayda_http_requests_total', 'API responses by status', ['method', 'route', 'status'])
+HTTP_IN_PROGRESS = Gauge('ayda_http_requests_in_progress', 'API requests being handled', ['method', 'route'])
+
+BOT_HANDLER_SECONDS = Histogram(
+    'ayda_bot_handler_duration_seconds', 'Bot handler latency', ['handler'], buckets=LATENCY_BUCKETS,
+)
+BOT_HANDLER_ERRORS = Counter('ayda_bot_handler_errors_total', 'Bot handlers that raised', ['handler'])
+BOT_HANDLER_IN_PROGRESS = Gauge('ayda_bot_handlers_in_progress', 'Bot handlers running', ['handler'])
+
+SHEETS_CALL_SECONDS = Histogram(
+    'ayda_sheets_call_duration_seconds', 'Sheets API round trip, including quota waits and retries',
+    ['operation'], buckets=LATENCY_BUCKETS,
+)
+SHEETS_CALL_ERRORS = Counter('ayda_sheets_call_errors_total', 'Sheets API calls that failed', ['operation'])
+
+SQL_QUERY_SECONDS = Histogram(
+    'ayda_sql_query_duration_seconds', 'SQL statement execution time', ['statement'], buckets=LATENCY_BUCKETS,
+)
+SQL_QUERY_ERRORS = Counter('ayda_sql_query_errors_total', 'SQL statements that failed', ['statement'])
+
+OPENAI_REQUEST_SECONDS = Histogram(
+    'ayda_openai_request_duration_seconds', 'OpenAI API latency until the response headers',
+    ['endpoint'], buckets=LATENCY_BUCKETS,
+)
+OPENAI_REQUEST_ERRORS = Counter('ayda_openai_request_errors_total', 'OpenAI API error responses', ['endpoint', 'status'])
+
+# "SELECT ... FROM notes", "INSERT INTO fragments", "UPDATE notes" -> verb and first table
+_STATEMENT_RE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+
+@contextmanager
+def track(histogram: Histogram, errors: Optional[Counter], in_progress: Optional[Gauge], *labels: str):
+    """Time the block into `histogram`; count it in `errors` if it raises."""
+    if in_progress is not None:
+        in_progress.labels(*labels).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.labels(*labels).inc()
+        raise
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+        if in_progress is not None:
+            in_progress.labels(*labels).dec()
+
+
+# ==================== API routes ====================
+
+def route_label(app, scope) -> str:
+    """Path template of the route a request goes to ("/api/notes/{note_id}/related"), not the raw path."""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+
+# ==================== Bot handlers ====================
+
+def instrument_handler(name: str, callback):
+    """Wrap a python-telegram-bot callback so each call is timed under `name`."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with track(BOT_HANDLER_SECONDS, BOT_HANDLER_ERRORS, BOT_HANDLER_IN_PROGRESS, name):
+            return await callback(update, context)
+    return wrapper
+
+
+def start_metrics_server(port: int):
+    """Serve this process's metrics on their own port, apart from any public web server."""
+    start_http_server(port)
+
+
+# ==================== SQL ====================
+
+def statement_label(statement: str) -> str:
+    match = _STATEMENT_RE.match(statement)
+    if not match:
+        return 'other'
+    verb = match.group(1).lower()
+    table = _TABLE_RE.search(statement)
+    return f"{verb} {table.group(1).lower()}" if table else verb
+
+
+def instrument_engine(engine):
+    """Time every statement run through a SQLAlchemy engine."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _finish(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_started'].pop()
+        SQL_QUERY_SECONDS.labels(statement_label(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        started = context.connection.info.get('metrics_started') if context.connection is not None else None
+        if started:
+            started.pop()
+        SQL_QUERY_ERRORS.labels(statement_label(context.statement or '')).inc()
+
+
+# ==================== OpenAI ====================
+
+def _openai_endpoint(request) -> str:
+    # /v1/chat/completions -> chat/completions
+    return request.url.path.removeprefix('/v1/')
+
+
+def _openai_request_started(request):
+    request.extensions['metrics_started'] = time.perf_counter()
+
+
+def _openai_response_received(response):
+    request = response.request
+    endpoint = _openai_endpoint(request)
+    started = request.extensions.get('metrics_started')
+    if started is not None:
+        OPENAI_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    if response.status_code >= 400:
+        OPENAI_REQUEST_ERRORS.labels(endpoint, str(response.status_code)).inc()
+
+
+# httpx event hooks for the OpenAI client (see services/transcription_service.py)
+OPENAI_EVENT_HOOKS = {
+    'request': [_openai_request_started],
+    'response': [_openai_response_received],
+}
+
+
+# ==================== Sheets usage stats ====================
+
+class SheetsStatsCollector:
+    """
+    Exposes GoogleSheetsStorage.get_api_call_stats() and get_scheduler_metrics()
+    (counted by the storage itself) at scrape time.
+    """
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def collect(self):
+        operations = CounterMetricFamily(
+            'ayda_sheets_operations', 'Storage operations that used the Sheets API', labels=['operation'])
+        api_calls = CounterMetricFamily(
+            'ayda_sheets_api_calls', 'Sheets API calls by storage operation', labels=['operation'])
+        for operation, stats in self.sheets.get_api_call_stats().items():
+            operations.add_metric([operation], stats['operations'])
+            api_calls.add_metric([operation], stats['api_calls'])
+        yield operations
+        yield api_calls
+
+        scheduler = self.sheets.get_scheduler_metrics()
+        queue_depth = GaugeMetricFamily(
+            'ayda_sheets_queue_depth', 'Sheets jobs waiting for a worker', labels=['priority'])
+        for priority, depth in scheduler['queue_depth'].items():
+            queue_depth.add_metric([priority], depth)
+        running = GaugeMetricFamily('ayda_sheets_jobs_running', 'Sheets jobs running', labels=['priority'])
+        for priority, count in scheduler['running'].items():
+            running.add_metric([priority], count)
+        slot_wait = GaugeMetricFamily(
+            'ayda_sheets_slot_wait_max_seconds', 'Longest wait for a Sheets worker', labels=['priority'])
+        for priority, stats in scheduler['slot_wait'].items():
+            slot_wait.add_metric([priority], stats['max_seconds'])
+        quota_wait = GaugeMetricFamily(
+            'ayda_sheets_quota_wait_max_seconds', 'Longest wait for Sheets API quota')
+        quota_wait.add_metric([], scheduler['quota_wait']['max_seconds'])
+        retries = CounterMetricFamily(
+            'ayda_sheets_retries', 'Sheets API calls retried, by response status', labels=['status'])
+        for status, count in scheduler['retries'].items():
+            retries.add_metric([str(status)], count)
+        yield from (queue_depth, running, slot_wait, quota_wait, retries)
+
+
+_sheets_collector_registered = False
+
+
+def register_sheets_stats(sheets):
+    """Add a storage's Sheets stats to this process's metrics (once per process)."""
+    global _sheets_collector_registered
+    if not _sheets_collector_registered:
+        REGISTRY.register(SheetsStatsCollector(sheets))
+        _sheets_collector_registered = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class Note(BaseModel):
     id: str
@@ -16,7 +16,11 @@ class Note(BaseModel):
 
 class NotesResponse(BaseModel):
     notes: List[Note]
-    total: int
+    total: int  # Notes in this response
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next page; None on the last page
+    revision: Optional[str] = None  # Pass as `since` later to get only the notes changed meanwhile
+    delta: bool = False  # True: only changed notes, merge them into the cached list
+    removed: List[str] = []  # Delta only: IDs of changed notes that no longer match `status`
 
 class StatusUpdate(BaseModel):
     status: str
@@ -36,12 +40,14 @@ class RelatedNote(BaseModel):
     telegram_username: Optional[str] = None
     status: Optional[str] = ""
     common_tags_count: int  # Number of tags in common with the target note
+    similarity: Optional[float] = None  # Semantic mode: cosine similarity of the embeddings
 
 class RelatedNotesResponse(BaseModel):
     """Response containing related notes."""
     related: List[RelatedNote]
     total: int
     note_id: str  # ID of the note these are related to
+    mode: str = 'tags'  # Ranking used: 'tags' or 'semantic'
 
 
 # Reply chain schemas
@@ -75,6 +81,24 @@ class ReplyChainResponse(BaseModel):
     note_id: str  # ID of the note this chain is built for
 
 
+# Batch relations schemas (for POST /api/notes/relations)
+
+class RelationsRequest(BaseModel):
+    user_id: int
+    note_ids: List[str]
+    related_limit: Optional[int] = None  # Top N related notes per note (all if omitted)
+    fields: Optional[str] = None         # Note fields of related notes, e.g. "id,content_preview"
+
+class NoteRelations(BaseModel):
+    """Related notes and reply stats of one note."""
+    related: List[RelatedNote]
+    reply_stats: ReplyChainStats
+
+class RelationsResponse(BaseModel):
+    relations: Dict[str, NoteRelations]  # note_id -> relations
+    missing: List[str]                   # Requested IDs not found
+
+
 # Fragment schemas (for POST /api/fragments)
 
 class FragmentInput(BaseModel):
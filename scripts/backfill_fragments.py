@@ -0,0 +1,67 @@
+"""
+Backfill the fragments table from registered users' spreadsheets.
+Resumable: progress is checkpointed per spreadsheet (fragment_backfills table).
+
+Usage: python scripts/backfill_fragments.py [user_id] [--restart] [--embed] [--chunk=500]
+  user_id    only this user (default: all registered users)
+  --restart  ignore checkpoints and rescan from the first row
+  --embed    embed inserted fragments right away (default: left for /normalize)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+from config import config
+from storage.db import init_db, get_all_users
+from storage.google_sheets import GoogleSheetsStorage
+from services.backfill_service import backfill_spreadsheet, DEFAULT_CHUNK_SIZE
+
+# Parse args
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+only_user = int(args[0]) if args else None
+restart = '--restart' in sys.argv
+embed = '--embed' in sys.argv
+chunk_size = next(
+    (int(a.split('=', 1)[1]) for a in sys.argv if a.startswith('--chunk=')),
+    DEFAULT_CHUNK_SIZE
+)
+
+init_db()
+sheets = GoogleSheetsStorage(credentials_path=config['credentials_path'])
+
+users = get_all_users()
+if only_user is not None:
+    users = [(uid, sid) for uid, sid in users if uid == only_user]
+    if not users:
+        print(f"User {only_user} is not registered")
+        sys.exit(1)
+
+totals = {'rows_scanned': 0, 'inserted': 0, 'skipped': 0}
+failed = []
+for user_id, spreadsheet_id in users:
+    print(f"\nUser {user_id}: spreadsheet {spreadsheet_id}")
+    try:
+        result = backfill_spreadsheet(
+            sheets, user_id, spreadsheet_id,
+            chunk_size=chunk_size, restart=restart, embed=embed,
+        )
+    except Exception as e:
+        # Checkpoint keeps the progress; rerun to resume
+        print(f"  FAILED: {e}")
+        failed.append(user_id)
+        continue
+
+    print(f"  {result['rows_scanned']} rows scanned, {result['inserted']} new fragments, "
+          f"{result['skipped']} already present "
+          f"(next row: {result['next_row']} of {result['worksheet'] or 'first sheet'})")
+    for key in totals:
+        totals[key] += result[key]
+
+print(f"\n{'='*60}")
+print(f"Users: {len(users)}, failed: {len(failed)} {failed if failed else ''}")
+print(f"Rows scanned: {totals['rows_scanned']}, new fragments: {totals['inserted']}, "
+      f"already present: {totals['skipped']}")
@@ -0,0 +1,159 @@
+"""
+Backfill Service — copy notes from users' spreadsheets into the fragments table.
+
+Covers notes saved before fragments existed and rows edited directly in Sheets.
+Each sheet is read in row ranges, worksheet by worksheet; progress is
+checkpointed per spreadsheet so a large sheet resumes where it stopped.
+Inserts are idempotent by external_id.
+"""
+import logging
+from datetime import datetime, timezone
+
+from storage.fragments_db import (
+    insert_fragments_batch,
+    get_backfill_checkpoint,
+    save_backfill_checkpoint,
+)
+from storage.parsed_note import split_tags
+from services.normalizer_service import normalize_fragments
+
+logger = logging.getLogger(__name__)
+
+# Sheet rows read (and inserted) per step
+DEFAULT_CHUNK_SIZE = 500
+
+
+def row_to_fragment(row: list, user_id: int, spreadsheet_id: str) -> dict | None:
+    """Map a sheet row to an insert_fragments_batch dict. None for rows without text.
+
+    external_id matches what the bot writes for new notes (bot_{user_id}_{message_id}),
+    so notes already in fragments are skipped. Rows without a message ID fall back
+    to the note ID.
+    """
+    note_id, message_id, created_at, content = row[0], row[1], row[2], row[3]
+    if not note_id or not content or content == '[Media]':
+        return None
+
+    try:
+        created = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        created = datetime.now(timezone.utc)
+
+    message_type = row[6] or 'general'
+    if message_id:
+        external_id = f"bot_{user_id}_{message_id}"
+    else:
+        external_id = f"sheet_{spreadsheet_id}_{note_id}"
+
+    return {
+        'external_id': external_id,
+        'source': 'telegram',
+        'text': content,
+        'created_at': created,
+        'tags': split_tags(row[4]),
+        'content_type': 'repost' if message_type == 'forwarded' else 'note',
+        'metadata': {
+            'telegram_msg_id': int(message_id) if message_id.isdigit() else message_id or None,
+            'user_id': user_id,
+            'message_type': message_type,
+            'note_id': note_id,
+            'backfill': True,
+        },
+    }
+
+
+def backfill_spreadsheet(
+    sheets,
+    user_id: int,
+    spreadsheet_id: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    restart: bool = False,
+    embed: bool = False,
+) -> dict:
+    """Stream one spreadsheet into fragments, resuming from its checkpoint.
+
+    Args:
+        sheets: GoogleSheetsStorage used to read row ranges
+        user_id: Owner of the spreadsheet
+        spreadsheet_id: Spreadsheet to read
+        chunk_size: Rows per read / insert
+        restart: Ignore the checkpoint and start from the first note row
+        embed: Normalize inserted fragments right away instead of leaving them for /normalize
+
+    Returns: {rows_scanned: N, inserted: N, skipped: N, worksheet: str, next_row: N}
+    """
+    checkpoint = None if restart else get_backfill_checkpoint(spreadsheet_id)
+    worksheet = checkpoint['worksheet'] if checkpoint else ''
+    next_row = checkpoint['next_row'] if checkpoint else 2  # row 1 is the header
+    rows_scanned = checkpoint['rows_scanned'] if checkpoint else 0
+    inserted_total = checkpoint['fragments_inserted'] if checkpoint else 0
+
+    # Rotated sheets keep older notes in earlier worksheets: walk them oldest first
+    shards = sheets.list_shards(spreadsheet_id)
+    if worksheet not in shards:
+        logger.warning(f"Backfill {spreadsheet_id}: worksheet {worksheet!r} is gone, starting over")
+        worksheet, next_row = shards[0], 2
+    remaining = shards[shards.index(worksheet) + 1:]
+    row_count = sheets.shard_row_count(spreadsheet_id, worksheet)
+    # Row after the last one with data: where a later run picks up new rows
+    data_end = next_row
+
+    inserted = 0
+    skipped = 0
+    scanned = 0
+
+    while True:
+        rows = sheets.read_row_range(spreadsheet_id, next_row, chunk_size, worksheet)
+
+        fragments = [
+            f for f in (row_to_fragment(row, user_id, spreadsheet_id) for row in rows)
+            if f is not None
+        ]
+        result = insert_fragments_batch(fragments) if fragments else {
+            'indexed': 0, 'duplicates_skipped': 0, 'inserted_ids': []
+        }
+
+        if embed and result['inserted_ids']:
+            try:
+                normalize_fragments(result['inserted_ids'])
+            except Exception as e:
+                logger.error(f"Embedding failed (fragments saved, left for /normalize): {e}")
+
+        # Sheets drops trailing blank rows, so a short read says nothing about where
+        # the worksheet ends: always step a whole chunk
+        first_row = next_row
+        next_row += chunk_size
+        if rows:
+            data_end = first_row + len(rows)
+        scanned += len(rows)
+        inserted += result['indexed']
+        skipped += result['duplicates_skipped']
+
+        # End of this worksheet (nothing left past its row count): continue with the next shard, if any
+        worksheet_done = not rows and first_row > row_count
+        done = worksheet_done and not remaining
+        if done:
+            next_row = data_end
+        elif worksheet_done:
+            worksheet, next_row = remaining.pop(0), 2
+            row_count = sheets.shard_row_count(spreadsheet_id, worksheet)
+            data_end = next_row
+
+        # Checkpoint after the insert: a crash in between only repeats an idempotent chunk
+        save_backfill_checkpoint(
+            spreadsheet_id, user_id, worksheet, next_row,
+            rows_scanned + scanned, inserted_total + inserted,
+        )
+        logger.info(f"Backfill {spreadsheet_id}: {worksheet or 'first sheet'} up to row {next_row - 1}, "
+                    f"+{result['indexed']} new, {result['duplicates_skipped']} skipped")
+
+        if done:
+            break
+
+    return {
+        'rows_scanned': scanned,
+        'inserted': inserted,
+        'skipped': skipped,
+        'worksheet': worksheet,
+        'next_row': next_row,
+    }
@@ -1,54 +1,128 @@
-import asyncio
-from typing import List, Optional
-from storage.google_sheets import GoogleSheetsStorage
+import base64
+import json
+from typing import Any, Dict, List, Optional, Sequence
+from storage.base import BaseStorage
+from storage.parsed_note import feed_key
 from bot.utils import get_user_spreadsheet
 from schemas import Note, NotesResponse
 
+def encode_cursor(key: tuple) -> str:
+    """Opaque page cursor from a feed_key."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """feed_key from a page cursor. Raises ValueError if it is malformed."""
+    try:
+        focus, created_ts, note_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if (
+        not isinstance(focus, bool)
+        or isinstance(created_ts, bool) or not isinstance(created_ts, (int, float))
+        or not isinstance(note_id, str)
+    ):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (focus, float(created_ts), note_id)
+
+
 class NoteService:
-    def __init__(self, storage: GoogleSheetsStorage):
+    def __init__(self, storage: BaseStorage):
         self.storage = storage
 
-    async def get_user_notes(self, user_id: int) -> NotesResponse:
+    async def get_user_notes(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        statuses: Optional[List[str]] = None,
+        fields: Optional[Sequence[str]] = None,
+        since: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
-        Fetches notes for a user, parses them, and sorts them.
+        Fetches a page of a user's notes: 'focus' first, then newest first.
+
+        Args:
+            user_id: Telegram user ID
+            limit: Page size (None = all remaining notes)
+            cursor: next_cursor of the previous page
+            statuses: Only notes with these statuses ('new' includes notes without a status)
+            fields: Note fields to include (None = all, see ParsedNote.to_dict)
+            since: `revision` of an earlier response: return only the notes
+                changed after it (a delta), if the storage can tell
+
+        Returns:
+            NotesResponse-shaped dict, built directly from the parsed notes
+
+        Raises:
+            ValueError: If the cursor is malformed, or since is combined with limit/cursor
         """
         # Get user's spreadsheet ID
         spreadsheet_id = get_user_spreadsheet(user_id)
         if not spreadsheet_id:
             return None # Or raise exception, handled in controller
 
-        # Fetch notes from Google Sheets
-        # Using the sync method wrapped in thread as per original implementation
-        notes_data = await asyncio.to_thread(
-            self.storage._get_all_notes_sync, 
-            spreadsheet_id
+        if since is not None and (limit is not None or cursor is not None):
+            raise ValueError("since can't be combined with limit or cursor")
+
+        after = decode_cursor(cursor) if cursor else None
+        if statuses is not None and 'new' in statuses:
+            statuses = list(statuses) + ['']
+
+        # Read before the notes: a change racing with this request is sent again next time, never lost
+        revision = await self.storage.get_notes_revision(spreadsheet_id)
+
+        if since is not None:
+            changed = await self.storage.get_note_changes(spreadsheet_id, since)
+            if changed is not None:
+                return self._delta(changed, statuses, fields, revision)
+
+        # One extra note tells whether there is a next page
+        page = await self.storage.get_notes_page(
+            spreadsheet_id,
+            limit + 1 if limit is not None else None,
+            after,
+            statuses
         )
-        
-        notes = []
-        for row in notes_data:
-            if len(row) >= 9:
-                status = row[10] if len(row) > 10 else ""
-                
-                note = Note(
-                    id=row[0],
-                    telegram_message_id=row[1],
-                    created_at=row[2],
-                    content=row[3],
-                    tags=row[4],
-                    reply_to_message_id=row[5] if row[5] else None,
-                    message_type=row[6],
-                    source_chat_id=row[7] if row[7] else None,
-                    source_chat_link=row[8] if row[8] else None,
-                    telegram_username=row[9] if len(row) > 9 and row[9] else None,
-                    status=status
-                )
-                notes.append(note)
-        
-        # Sort: 'focus' first, then others by date (newest first)
-        notes.reverse() # Newest first (assuming append order)
-        notes.sort(key=lambda x: 0 if x.status == "focus" else 1)
-        
-        return NotesResponse(notes=notes, total=len(notes))
+
+        next_cursor = None
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(feed_key(page[-1]))
+
+        notes = [note.to_dict(fields) for note in page]
+        return {
+            'notes': notes,
+            'total': len(notes),
+            'next_cursor': next_cursor,
+            'revision': revision,
+            'delta': False,
+            'removed': [],
+        }
+
+    @staticmethod
+    def _delta(changed: list, statuses: Optional[List[str]], fields: Optional[Sequence[str]], revision: str) -> Dict[str, Any]:
+        """
+        Response for a delta: changed notes that pass the status filter, in feed
+        order, and tombstones (`removed`) for changed notes that no longer pass it.
+        """
+        if statuses is not None:
+            wanted = set(statuses)
+            removed = [note.id for note in changed if note.status not in wanted]
+            changed = [note for note in changed if note.status in wanted]
+        else:
+            removed = []
+        changed.sort(key=feed_key, reverse=True)
+
+        notes = [note.to_dict(fields) for note in changed]
+        return {
+            'notes': notes,
+            'total': len(notes),
+            'next_cursor': None,
+            'revision': revision,
+            'delta': True,
+            'removed': removed,
+        }
 
     async def update_note_status(self, user_id: int, note_id: str, status: str) -> bool:
         """
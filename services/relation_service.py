@@ -4,40 +4,67 @@ RelationService - Service for computing thought chains (related notes).
 This service finds related notes based on common tags and sorts them by:
 1. Number of common tags (descending)
 2. Date created (newest first)
+
+The semantic mode ranks notes by embedding similarity of their fragments
+instead (pgvector), with common tags as a bonus.
 """
 
 import asyncio
+import heapq
 import logging
 import time
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-from storage.google_sheets import GoogleSheetsStorage
+from typing import List, Dict, Any, Optional, Sequence
+from storage.base import BaseStorage
+from storage.cache import TTLCache
+from storage.fragments_db import search_related_notes
+from storage.notes_snapshot import NotesSnapshot
+from storage.parsed_note import ParsedNote, split_tags
+from storage.reply_index import ReplyIndex
+from services.reply_threads import ReplyThread, ReplyThreads
+
+# Spreadsheets whose reply threads are kept in memory, and for how long after the last use (seconds)
+REPLY_THREADS_CACHE_SIZE = 256
+REPLY_THREADS_TTL = 3600
+
+# Semantic related notes: how many when no limit is given (nearest neighbours can't be "all"),
+# how many neighbours are fetched per note returned (so tag bonuses can reorder them),
+# and the score bonus of sharing all of the target's tags (similarity is 0..1)
+SEMANTIC_RELATED_LIMIT = 20
+SEMANTIC_CANDIDATES_FACTOR = 3
+SEMANTIC_TAG_WEIGHT = 0.3
 
 
 class RelationService:
     """Service for computing relationships between notes based on tags."""
 
-    def __init__(self, storage: GoogleSheetsStorage):
+    def __init__(self, storage: BaseStorage):
         """
         Initialize the relation service.
 
         Args:
-            storage: GoogleSheetsStorage instance for data access
+            storage: BaseStorage instance for data access
         """
         self.storage = storage
         self.logger = logging.getLogger(__name__)
 
+        # Spreadsheet ID -> ReplyThreads (materialized threads by root ID, with their lock)
+        self._reply_threads = TTLCache(maxsize=REPLY_THREADS_CACHE_SIZE, ttl=REPLY_THREADS_TTL)
+
     async def get_related_notes(
         self,
         note_id: str,
-        spreadsheet_id: str
+        spreadsheet_id: str,
+        fields: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
-        Get all notes related to the given note through common tags.
+        Get notes related to the given note through common tags.
 
         Args:
             note_id: The ID of the target note (Column A in Google Sheets)
             spreadsheet_id: The user's spreadsheet ID
+            fields: Note fields to include (None = all, see ParsedNote.to_dict)
+            limit: Keep only the top N related notes (None = all)
 
         Returns:
             List of related notes with additional 'common_tags_count' field,
@@ -46,28 +73,24 @@ class RelationService:
         start_time = time.time()
 
         try:
-            # Fetch all notes using thread pool (sync method)
-            all_notes = await asyncio.to_thread(
-                self.storage._get_all_notes_sync,
-                spreadsheet_id
-            )
+            # Shared snapshot (cached, same one NoteService reads)
+            snapshot = await self.storage.get_notes_snapshot(spreadsheet_id)
 
-            # Parse notes and find target
-            parsed_notes = self._parse_notes(all_notes)
-            target_note = self._find_note_by_id(note_id, parsed_notes)
+            # Notes are parsed (and indexed) once per snapshot
+            parsed_notes = snapshot.notes
+            target_note = snapshot.by_id.get(note_id)
 
             if not target_note:
                 self.logger.warning(f"Note {note_id} not found in spreadsheet {spreadsheet_id}")
                 return []
 
             # If target has no tags, no relations possible
-            target_tags = self._parse_tags(target_note.get('tags', ''))
-            if not target_tags:
+            if not target_note.tag_set:
                 self.logger.info(f"Note {note_id} has no tags, no relations")
                 return []
 
             # Compute related notes
-            related = self._compute_related_notes(target_note, parsed_notes)
+            related = self._compute_related_notes(target_note, snapshot, fields, limit)
 
             elapsed = time.time() - start_time
             self.logger.info(
@@ -81,156 +104,215 @@ class RelationService:
             self.logger.error(f"Error computing related notes: {e}", exc_info=True)
             raise
 
-    def _parse_notes(self, raw_notes: List[List[str]]) -> List[Dict[str, Any]]:
+    async def get_semantic_related_notes(
+        self,
+        note_id: str,
+        spreadsheet_id: str,
+        user_id: int,
+        fields: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> Optional[List[Dict[str, Any]]]:
         """
-        Parse raw Google Sheets rows into structured note dictionaries.
+        Get notes related to the given note by meaning: nearest neighbours of its
+        fragment embedding among the user's fragments, with common tags as a bonus.
+        One indexed DB query; the notes snapshot is not needed.
 
         Args:
-            raw_notes: List of rows from Google Sheets
+            note_id: The ID of the target note
+            spreadsheet_id: The user's spreadsheet ID
+            user_id: Owner of the notes (fragments are keyed by it)
+            fields: Note fields to include (None = all)
+            limit: Top N related notes (None = SEMANTIC_RELATED_LIMIT)
 
         Returns:
-            List of parsed note dictionaries
+            Related notes with 'common_tags_count' and 'similarity' fields, best
+            first; None if there is nothing to rank by (no pgvector, or the note
+            has no embedding yet) and the tags mode should be used instead
         """
-        notes = []
-        for row in raw_notes:
-            if len(row) >= 9:
-                note = {
-                    'id': row[0],
-                    'telegram_message_id': row[1],
-                    'created_at': row[2],
-                    'content': row[3],
-                    'tags': row[4],
-                    'reply_to_message_id': row[5] if row[5] else None,
-                    'message_type': row[6],
-                    'source_chat_id': row[7] if row[7] else None,
-                    'source_chat_link': row[8] if row[8] else None,
-                    'telegram_username': row[9] if len(row) > 9 and row[9] else None,
-                    'status': row[10] if len(row) > 10 else ''
-                }
-                notes.append(note)
-        return notes
+        start_time = time.time()
+        limit = limit or SEMANTIC_RELATED_LIMIT
+
+        try:
+            found = await asyncio.to_thread(
+                search_related_notes,
+                spreadsheet_id,
+                user_id,
+                note_id,
+                limit * SEMANTIC_CANDIDATES_FACTOR
+            )
+            if not found or not found[1]:
+                return None
+
+            target_tags, matches = found
+            target_tag_set = frozenset(split_tags(target_tags))
+
+            scored = {}
+            for row, distance in matches:
+                note = ParsedNote(row)
+                if note.id == note_id or note.id in scored:
+                    continue  # Closest match first: keep the best one per note
+                common_count = len(target_tag_set & note.tag_set)
+                similarity = 1.0 - distance
+                score = similarity
+                if target_tag_set:
+                    score += SEMANTIC_TAG_WEIGHT * common_count / len(target_tag_set)
+                scored[note.id] = (score, note, common_count, similarity)
+
+            top = heapq.nlargest(limit, scored.values(), key=lambda item: (item[0], item[1].created_ts))
+            related = [
+                {**note.to_dict(fields), 'common_tags_count': common_count, 'similarity': round(similarity, 4)}
+                for _, note, common_count, similarity in top
+            ]
+
+            elapsed = time.time() - start_time
+            self.logger.info(
+                f"Semantic related notes: {elapsed:.3f}s for {len(related)} related notes "
+                f"({len(matches)} neighbours)"
+            )
+
+            return related
+
+        except Exception as e:
+            self.logger.error(f"Error computing semantic related notes: {e}", exc_info=True)
+            raise
 
-    def _find_note_by_id(
+    async def get_relations(
         self,
-        note_id: str,
-        notes: List[Dict[str, Any]]
-    ) -> Optional[Dict[str, Any]]:
+        note_ids: List[str],
+        spreadsheet_id: str,
+        related_limit: Optional[int] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        Find a note by its ID.
+        Related notes and reply stats for several notes at once, from one snapshot.
 
         Args:
-            note_id: The note ID to search for
-            notes: List of parsed notes
+            note_ids: IDs of the target notes
+            spreadsheet_id: The user's spreadsheet ID
+            related_limit: Keep only the top N related notes per target (None = all)
+            fields: Note fields to include (None = all)
 
         Returns:
-            Note dictionary or None if not found
+            {note_id: {'related': [...], 'reply_stats': {...}}} for the notes
+            that exist; unknown IDs are left out
         """
-        for note in notes:
-            if note['id'] == note_id:
-                return note
-        return None
+        start_time = time.time()
 
-    def _parse_tags(self, tags_str: str) -> List[str]:
-        """
-        Parse tags string into list of individual tags.
+        try:
+            snapshot = await self.storage.get_notes_snapshot(spreadsheet_id)
+            parsed_notes = snapshot.notes
 
-        Args:
-            tags_str: Comma-separated tags string (e.g., "#tag1, #tag2")
+            by_id = snapshot.by_id
+            targets = [by_id[note_id] for note_id in dict.fromkeys(note_ids) if note_id in by_id]
 
-        Returns:
-            List of normalized tags
-        """
-        if not tags_str:
-            return []
+            related = self._compute_related_for_many(targets, snapshot, fields, related_limit)
+            result = {
+                target.id: {
+                    'related': related[target.id],
+                    'reply_stats': self._calculate_reply_stats(target, snapshot.reply_index),
+                }
+                for target in targets
+            }
 
-        # Split by comma and strip whitespace
-        tags = [tag.strip() for tag in tags_str.split(',')]
-        # Filter empty strings
-        tags = [tag for tag in tags if tag]
-        return tags
+            elapsed = time.time() - start_time
+            self.logger.info(
+                f"Batch relations: {elapsed:.3f}s for {len(targets)} notes "
+                f"(out of {len(parsed_notes)} total)"
+            )
+
+            return result
+
+        except Exception as e:
+            self.logger.error(f"Error computing batch relations: {e}", exc_info=True)
+            raise
 
     def _compute_related_notes(
         self,
-        target_note: Dict[str, Any],
-        all_notes: List[Dict[str, Any]]
+        target_note: ParsedNote,
+        snapshot: NotesSnapshot,
+        fields: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Compute related notes for the target note.
 
         Algorithm:
-        1. Parse target note tags
-        2. For each other note, count common tags
-        3. Filter notes with at least 1 common tag
-        4. Sort by: common_tags_count DESC, created_at DESC
+        1. Walk the snapshot's tag index for each of the target's tags
+        2. Count common tags per note seen (only those notes share a tag)
+        3. Keep the top `limit` by: common_tags_count DESC, created_at DESC
 
         Args:
             target_note: The note to find relations for
-            all_notes: All notes in the spreadsheet
+            snapshot: Snapshot the target belongs to
+            limit: Max notes to return (None = all)
 
         Returns:
             Sorted list of related notes with 'common_tags_count' field
         """
-        target_tags = set(self._parse_tags(target_note['tags']))
-        related_notes = []
-
-        for note in all_notes:
-            # Skip the target note itself
-            if note['id'] == target_note['id']:
-                continue
-
-            # Parse note tags
-            note_tags = set(self._parse_tags(note['tags']))
-
-            # Count common tags
-            common_tags = target_tags & note_tags
-            common_count = len(common_tags)
-
-            # Only include notes with at least 1 common tag
-            if common_count > 0:
-                # Add common_tags_count to the note
-                note_with_count = {**note, 'common_tags_count': common_count}
-                related_notes.append(note_with_count)
-
-        # Sort: more common tags first, then newer first
-        related_notes.sort(
-            key=lambda x: (
-                -x['common_tags_count'],  # More tags = higher priority (negative for DESC)
-                -self._parse_timestamp(x['created_at'])  # Newer = higher priority
-            )
-        )
+        return self._compute_related_for_many([target_note], snapshot, fields, limit)[target_note.id]
 
-        return related_notes
-
-    def _parse_timestamp(self, timestamp_str: str) -> float:
+    def _compute_related_for_many(
+        self,
+        targets: List[ParsedNote],
+        snapshot: NotesSnapshot,
+        fields: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
         """
-        Parse ISO 8601 timestamp string to Unix timestamp.
-
-        Args:
-            timestamp_str: ISO 8601 formatted timestamp
+        Related notes of several targets from the snapshot's inverted tag index.
+        Cost per target is the length of its tags' postings plus k log k for the top k,
+        independent of the number of notes without those tags.
 
         Returns:
-            Unix timestamp (float) or 0 if parsing fails
+            {target_id: sorted related notes with 'common_tags_count'}
         """
-        try:
-            dt = datetime.fromisoformat(timestamp_str)
-            return dt.timestamp()
-        except (ValueError, AttributeError):
-            self.logger.warning(f"Failed to parse timestamp: {timestamp_str}")
-            return 0.0
+        notes = snapshot.notes
+        index = snapshot.tag_index
+
+        # More common tags first, then newer first; ties keep sheet order
+        def rank(item):
+            position, common_count = item
+            return (common_count, notes[position].created_ts, -position)
+
+        result = {}
+        for target in targets:
+            # Position in notes -> number of tags shared with the target
+            common: Dict[int, int] = {}
+            for tag in target.tag_set:
+                for position in index.get(tag, ()):
+                    common[position] = common.get(position, 0) + 1
+
+            candidates = (item for item in common.items() if notes[item[0]].id != target.id)
+            if limit is None:
+                top = sorted(candidates, key=rank, reverse=True)
+            else:
+                top = heapq.nlargest(limit, candidates, key=rank)
+
+            # Only the notes that are returned get serialized
+            result[target.id] = [
+                {**notes[position].to_dict(fields), 'common_tags_count': common_count}
+                for position, common_count in top
+            ]
+        return result
 
     # ==================== Reply Chain Methods ====================
 
     async def get_reply_chain(
         self,
         note_id: str,
-        spreadsheet_id: str
+        spreadsheet_id: str,
+        fields: Optional[Sequence[str]] = None
     ) -> Dict[str, Any]:
         """
         Build reply chain for a note.
 
+        Threads are materialized once and cached by root ID; navigating within
+        a thread is served from memory, and notes saved since are patched in.
+
         Args:
             note_id: The ID of the target note
             spreadsheet_id: The user's spreadsheet ID
+            fields: Note fields to include (None = all)
 
         Returns:
             {
@@ -243,193 +325,83 @@ class RelationService:
         start_time = time.time()
 
         try:
-            # Fetch all notes
-            all_notes = await asyncio.to_thread(
-                self.storage._get_all_notes_sync,
-                spreadsheet_id
-            )
-
-            parsed_notes = self._parse_notes(all_notes)
-            target_note = self._find_note_by_id(note_id, parsed_notes)
-
-            if not target_note:
-                self.logger.warning(f"Note {note_id} not found")
-                return {
-                    'chain': [],
-                    'current_index': 0,
-                    'stats': {'up': 0, 'down': 0, 'branches': 0, 'total': 0},
-                    'branches': []
-                }
-
-            # Build chain
-            chain = self._build_reply_chain(target_note, parsed_notes)
-            current_index = next(
-                (i for i, n in enumerate(chain) if n['id'] == note_id),
-                0
-            )
-
-            # Calculate stats
-            stats = self._calculate_reply_stats(target_note, parsed_notes)
-
-            # Get siblings for branch navigation
-            branches = self._get_siblings(target_note, parsed_notes)
+            # One request per spreadsheet at a time: threads are patched and built in place
+            threads = self._get_reply_threads(spreadsheet_id)
+            async with threads.lock:
+                await self._refresh_reply_threads(spreadsheet_id, threads)
+                thread = threads.get(note_id)
+
+                if thread is None:
+                    # Shared snapshot: notes parsed and reply structure indexed once
+                    snapshot = await self.storage.get_notes_snapshot(spreadsheet_id)
+                    target_note = snapshot.by_id.get(note_id)
+
+                    if not target_note:
+                        self.logger.warning(f"Note {note_id} not found")
+                        return {
+                            'chain': [],
+                            'current_index': 0,
+                            'stats': {'up': 0, 'down': 0, 'branches': 0, 'total': 0},
+                            'branches': []
+                        }
+
+                    thread = self._build_reply_thread(target_note, snapshot.reply_index)
+                    threads.add(thread)
+
+            result = thread.view(note_id, fields)
 
             elapsed = time.time() - start_time
             self.logger.info(
-                f"Reply chain built: {elapsed:.3f}s, chain={len(chain)}, "
-                f"stats={stats}"
+                f"Reply chain built: {elapsed:.3f}s, chain={len(result['chain'])}, "
+                f"stats={result['stats']}"
             )
 
-            return {
-                'chain': chain,
-                'current_index': current_index,
-                'stats': stats,
-                'branches': branches
-            }
+            return result
 
         except Exception as e:
             self.logger.error(f"Error building reply chain: {e}", exc_info=True)
             raise
 
-    def _find_note_by_telegram_id(
-        self,
-        telegram_message_id: str,
-        notes: List[Dict[str, Any]]
-    ) -> Optional[Dict[str, Any]]:
-        """Find note by Telegram message ID."""
-        if not telegram_message_id:
-            return None
-        for note in notes:
-            if note.get('telegram_message_id') == telegram_message_id:
-                return note
-        return None
-
-    def _get_parent(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> Optional[Dict[str, Any]]:
-        """Get parent note (the one this note replies to)."""
-        reply_to = note.get('reply_to_message_id')
-        if not reply_to:
-            return None
-        return self._find_note_by_telegram_id(reply_to, notes)
-
-    def _get_ancestors(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """Get all ancestors (path up to root)."""
-        ancestors = []
-        current = note
-
-        while True:
-            parent = self._get_parent(current, notes)
-            if not parent:
-                break
-            ancestors.append(parent)
-            current = parent
-
-        return ancestors  # [parent, grandparent, ...]
-
-    def _get_replies(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """Get direct replies to this note."""
-        msg_id = note.get('telegram_message_id')
-        if not msg_id:
-            return []
-
-        # Convert to string for comparison (Google Sheets may return numbers)
-        msg_id_str = str(msg_id)
-
-        replies = [
-            n for n in notes
-            if str(n.get('reply_to_message_id', '')) == msg_id_str
-        ]
-
-        # Sort by date (newest first)
-        replies.sort(
-            key=lambda x: -self._parse_timestamp(x.get('created_at', ''))
-        )
-        return replies
-
-    def _get_descendants(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """Get all descendants (full tree below this note)."""
-        descendants = []
-        replies = self._get_replies(note, notes)
-
-        # Add all replies and their descendants
-        for reply in replies:
-            descendants.append(reply)
-            descendants.extend(self._get_descendants(reply, notes))
-
-        return descendants
-
-    def _get_siblings(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
-        """Get siblings (notes at the same level, same parent)."""
-        reply_to = note.get('reply_to_message_id')
-        if not reply_to:
-            return []  # Root note has no siblings
-
-        # Convert to string for comparison (Google Sheets may return numbers)
-        reply_to_str = str(reply_to)
-
-        siblings = [
-            n for n in notes
-            if str(n.get('reply_to_message_id', '')) == reply_to_str
-            and n['id'] != note['id']
-        ]
-
-        # Sort by date
-        siblings.sort(
-            key=lambda x: -self._parse_timestamp(x.get('created_at', ''))
-        )
-        return siblings
-
-    def _build_reply_chain(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> List[Dict[str, Any]]:
+    def _get_reply_threads(self, spreadsheet_id: str) -> ReplyThreads:
+        """Cached threads of a spreadsheet (an empty entry on a miss)."""
+        threads = self._reply_threads.get(spreadsheet_id)
+        if threads is None:
+            threads = ReplyThreads()
+            self._reply_threads.set(spreadsheet_id, threads)
+        return threads
+
+    async def _refresh_reply_threads(self, spreadsheet_id: str, threads: ReplyThreads):
+        """Bring cached threads up to the storage's current revision. Call with threads.lock held."""
+        revision = await self.storage.get_notes_revision(spreadsheet_id)
+        if threads.revision == revision:
+            return
+
+        changed = None
+        if threads.revision is not None:
+            changed = await self.storage.get_note_changes(spreadsheet_id, threads.revision)
+        if changed is None:
+            # Nothing cached yet, or the storage can't tell what changed: start over
+            threads.clear()
+        else:
+            threads.apply(changed)
+        threads.revision = revision
+
+    def _build_reply_thread(self, note: ParsedNote, index: ReplyIndex) -> ReplyThread:
         """
-        Build complete chain: all notes in the tree (from root down).
+        Materialize the whole thread of a note: all notes in the tree (from root down).
         This includes ALL branches, not just the path to the current note.
         """
-        ancestors = self._get_ancestors(note, notes)
-
-        # Find root of the tree
-        root = ancestors[-1] if ancestors else note
-
-        # Build full tree from root (includes all branches)
-        full_tree = [root] + self._get_descendants(root, notes)
-
-        return full_tree
+        root = index.root(note)
+        return ReplyThread(index.walk(root), index.siblings(root))
 
-    def _calculate_reply_stats(
-        self,
-        note: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> Dict[str, int]:
+    def _calculate_reply_stats(self, note: ParsedNote, index: ReplyIndex) -> Dict[str, int]:
         """Calculate navigation stats for a note."""
-        ancestors = self._get_ancestors(note, notes)
-        replies = self._get_replies(note, notes)
-        siblings = self._get_siblings(note, notes)
+        ancestors = index.ancestors(note)
+        replies = index.replies(note)
 
         # Total tree size
         root = ancestors[-1] if ancestors else note
-        total = self._count_tree_size(root, notes)
+        total = index.subtree_size(root)
 
         return {
             'up': len(ancestors),
@@ -437,17 +409,3 @@ class RelationService:
             'branches': len(replies),  # Number of branches (children) from this note
             'total': total
         }
-
-    def _count_tree_size(
-        self,
-        root: Dict[str, Any],
-        notes: List[Dict[str, Any]]
-    ) -> int:
-        """Count total nodes in the tree starting from root."""
-        count = 1  # Count self
-        replies = self._get_replies(root, notes)
-
-        for reply in replies:
-            count += self._count_tree_size(reply, notes)
-
-        return count
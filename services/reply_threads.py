@@ -0,0 +1,228 @@
+"""
+Reply threads materialized for reply-chain navigation (cached by RelationService).
+
+A ReplyThread is one whole thread - the root and every reply below it - with
+what the reply-chain endpoint returns for any of its notes: the chain in
+display order, navigation stats and sibling lists. Threads are built once
+from a snapshot's ReplyIndex and then kept current from the storage's change
+feed: a new reply is inserted next to its siblings and its ancestors' counts
+are bumped, an edited note is swapped in place. A growing thread is never
+rebuilt.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from storage.parsed_note import ParsedNote
+
+
+class ReplyThread:
+    """One thread in depth-first order, each level newest first."""
+
+    def __init__(self, walk: List[tuple], root_siblings: List[ParsedNote]):
+        """
+        Args:
+            walk: ReplyIndex.walk() of the root: [(note, index of its parent in the walk)]
+            root_siblings: Other notes replying to the same message as the root
+                (only when the root replies to a message that isn't a note)
+        """
+        root = walk[0][0]
+        self.root_id = root.id
+        self.root_reply_to = str(root.reply_to_message_id or '')
+        self.root_siblings = root_siblings
+        self.chain: List[ParsedNote] = [note for note, _ in walk]
+
+        # All keyed by note ID
+        self._position: Dict[str, int] = {}
+        self._parent: Dict[str, str] = {}
+        self._children: Dict[str, List[str]] = {}
+        self._depth: Dict[str, int] = {}
+        self._size: Dict[str, int] = {}
+        # Telegram message ID -> note ID
+        self._by_message_id: Dict[str, str] = {}
+        # Serialized chain per field projection, dropped on every patch
+        self._serialized: Dict[Optional[tuple], List[Dict[str, Any]]] = {}
+
+        for position, (note, parent) in enumerate(walk):
+            self._position.setdefault(note.id, position)
+            self._children.setdefault(note.id, [])
+            if note.telegram_message_id:
+                self._by_message_id.setdefault(str(note.telegram_message_id), note.id)
+            if parent < 0:
+                self._depth[note.id] = 0
+            else:
+                parent_id = walk[parent][0].id
+                self._parent[note.id] = parent_id
+                self._depth[note.id] = self._depth[parent_id] + 1
+                # The walk visits each note's replies newest first
+                self._children[parent_id].append(note.id)
+
+        sizes = [1] * len(walk)
+        for i in range(len(walk) - 1, 0, -1):
+            sizes[walk[i][1]] += sizes[i]
+        for (note, _), size in zip(walk, sizes):
+            self._size.setdefault(note.id, size)
+
+    @property
+    def message_ids(self) -> List[str]:
+        return list(self._by_message_id)
+
+    def _note(self, note_id: str) -> ParsedNote:
+        return self.chain[self._position[note_id]]
+
+    def view(self, note_id: str, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Reply chain response for one note of the thread (see RelationService.get_reply_chain)."""
+        key = tuple(fields) if fields is not None else None
+        chain = self._serialized.get(key)
+        if chain is None:
+            chain = [note.to_dict(fields) for note in self.chain]
+            self._serialized[key] = chain
+
+        children = self._children[note_id]
+        parent_id = self._parent.get(note_id)
+        if parent_id is not None:
+            siblings = [self._note(i) for i in self._children[parent_id] if i != note_id]
+        else:
+            siblings = self.root_siblings
+
+        return {
+            'chain': chain,
+            'current_index': self._position[note_id],
+            'stats': {
+                'up': self._depth[note_id],
+                'down': len(children),
+                'branches': len(children),  # Number of branches (children) from this note
+                'total': len(self.chain)
+            },
+            'branches': [note.to_dict(fields) for note in siblings]
+        }
+
+    def add_reply(self, note: ParsedNote):
+        """
+        Insert a new reply to a note of this thread. A new note has no replies
+        of its own yet (Telegram only lets you reply to an existing message).
+        """
+        parent_id = self._by_message_id[str(note.reply_to_message_id)]
+        siblings = self._children[parent_id]
+
+        # Newest first; a reply as old as an existing sibling goes after it
+        k = 0
+        while k < len(siblings) and self._note(siblings[k]).created_ts >= note.created_ts:
+            k += 1
+        if k == 0:
+            position = self._position[parent_id] + 1
+        else:
+            # Right after the subtree of the next newer sibling
+            previous = siblings[k - 1]
+            position = self._position[previous] + self._size[previous]
+
+        siblings.insert(k, note.id)
+        self.chain.insert(position, note)
+        for i in range(position, len(self.chain)):
+            self._position[self.chain[i].id] = i
+
+        self._parent[note.id] = parent_id
+        self._children[note.id] = []
+        self._depth[note.id] = self._depth[parent_id] + 1
+        self._size[note.id] = 1
+        ancestor = parent_id
+        while ancestor is not None:
+            self._size[ancestor] += 1
+            ancestor = self._parent.get(ancestor)
+
+        if note.telegram_message_id:
+            self._by_message_id.setdefault(str(note.telegram_message_id), note.id)
+        self._serialized.clear()
+
+    def replace(self, note: ParsedNote):
+        """Swap in an edited note (content, tags or status; its place in the thread can't change)."""
+        self.chain[self._position[note.id]] = note
+        self._serialized.clear()
+
+
+class ReplyThreads:
+    """
+    Cached threads of one spreadsheet, by root ID, as of a storage revision
+    (None until first brought up to date). Threads are patched and built in
+    place, so callers hold `lock` while using them; it lives and expires
+    with the cache entry.
+    """
+
+    def __init__(self, revision: Optional[str] = None):
+        self.revision = revision
+        self.lock = asyncio.Lock()
+        self._threads: Dict[str, ReplyThread] = {}
+        # Note ID / Telegram message ID -> root ID of the cached thread holding it
+        self._root_of: Dict[str, str] = {}
+        self._root_of_message: Dict[str, str] = {}
+        # Replied-to message that isn't a note -> roots of cached threads replying to it
+        self._orphans: Dict[str, Set[str]] = {}
+
+    def clear(self):
+        """Forget every thread (when the storage can't tell what changed)."""
+        self._threads.clear()
+        self._root_of.clear()
+        self._root_of_message.clear()
+        self._orphans.clear()
+
+    def get(self, note_id: str) -> Optional[ReplyThread]:
+        root_id = self._root_of.get(note_id)
+        return self._threads[root_id] if root_id is not None else None
+
+    def add(self, thread: ReplyThread):
+        # Threads this one now covers were cached before their notes were linked up
+        for note in thread.chain:
+            other = self._root_of.get(note.id)
+            if other is not None:
+                self.drop(other)
+
+        self._threads[thread.root_id] = thread
+        for note in thread.chain:
+            self._root_of[note.id] = thread.root_id
+        for message_id in thread.message_ids:
+            self._root_of_message[message_id] = thread.root_id
+        if thread.root_reply_to:
+            self._orphans.setdefault(thread.root_reply_to, set()).add(thread.root_id)
+
+    def drop(self, root_id: str):
+        thread = self._threads.pop(root_id, None)
+        if thread is None:
+            return
+        for note in thread.chain:
+            if self._root_of.get(note.id) == root_id:
+                del self._root_of[note.id]
+        for message_id in thread.message_ids:
+            if self._root_of_message.get(message_id) == root_id:
+                del self._root_of_message[message_id]
+        orphans = self._orphans.get(thread.root_reply_to)
+        if orphans is not None:
+            orphans.discard(root_id)
+            if not orphans:
+                del self._orphans[thread.root_reply_to]
+
+    def apply(self, changed: List[ParsedNote]):
+        """
+        Bring the cached threads up to date with notes created or edited since
+        `revision` (in revision order). Safe to apply a change twice.
+        """
+        for note in changed:
+            root_id = self._root_of.get(note.id)
+            if root_id is not None:
+                self._threads[root_id].replace(note)
+                continue
+
+            # Cached roots whose missing parent just arrived, or whose root siblings changed
+            for message_id in (note.telegram_message_id, note.reply_to_message_id):
+                if message_id:
+                    for orphan_root in list(self._orphans.get(str(message_id), ())):
+                        self.drop(orphan_root)
+
+            reply_to = str(note.reply_to_message_id or '')
+            root_id = self._root_of_message.get(reply_to) if reply_to else None
+            if root_id is None:
+                continue  # New root, or a reply in a thread that isn't cached
+            thread = self._threads[root_id]
+            thread.add_reply(note)
+            self._root_of[note.id] = root_id
+            if note.telegram_message_id:
+                self._root_of_message.setdefault(str(note.telegram_message_id), root_id)
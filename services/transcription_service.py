@@ -3,8 +3,9 @@ Transcription Service - OpenAI Whisper API integration
 Handles voice message transcription with optional GPT post-processing
 """
 import logging
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 from config import config
+from metrics import OPENAI_EVENT_HOOKS
 
 # Initialize OpenAI client (lazy - only if key exists)
 _client = None
@@ -16,7 +17,8 @@ def get_openai_client() -> OpenAI:
         api_key = config.get("openai_api_key")
         if not api_key:
             raise ValueError("OPENAI_API_KEY not configured. Add it to .env file.")
-        _client = OpenAI(api_key=api_key)
+        # Event hooks time every request for /metrics
+        _client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(event_hooks=OPENAI_EVENT_HOOKS))
     return _client
 
 
@@ -1,3 +1,7 @@
 #!/bin/bash
+# With BOT_WEBHOOK_URL set the bot runs inside the API server (one process, webhook updates)
+if [ -n "$BOT_WEBHOOK_URL" ]; then
+    exec python api_server.py
+fi
 python api_server.py &
 python main.py
@@ -0,0 +1,150 @@
+"""
+Static assets of the webapp: content-hashed names, precompressed bodies.
+
+Built once when the API server starts. Every script and stylesheet reachable
+from webapp/index.html gets a name containing a hash of its content
+(app.3f9a1c2e.js); ES module imports and the references in index.html are
+rewritten to those names, and each body is gzip- and, if the brotli package
+is installed, brotli-compressed up front. A hashed name never changes content, so those files are cached by
+the browser for a year; index.html is revalidated on every open and points to
+the current names.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+try:
+    import brotli
+    _brotli_available = True
+except ImportError:
+    _brotli_available = False
+
+logger = logging.getLogger(__name__)
+
+# URL prefix the hashed assets are served under
+STATIC_PREFIX = 'static'
+# Hex digits of the content hash kept in file names
+HASH_LENGTH = 10
+
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+# Quoted references to sibling files: "app.js", './ui.js', "styles.css?v=21"
+_REFERENCE_RE = re.compile(r'''(["'])(?:\./)?([\w\-]+\.(?:js|css))(?:\?[^"']*)?\1''')
+
+
+class Asset:
+    """One file ready to serve: the body in every available encoding."""
+
+    __slots__ = ('name', 'content_type', 'cache_control', 'etag', 'bodies')
+
+    def __init__(self, name: str, content: bytes, cache_control: str):
+        self.name = name
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type.endswith('javascript'):
+            self.content_type += '; charset=utf-8'
+        self.cache_control = cache_control
+        # Weak: the same tag covers every encoding of the body
+        self.etag = f'W/"{hashlib.sha256(content).hexdigest()[:HASH_LENGTH * 2]}"'
+
+        # Content-Encoding -> body ('identity' is the uncompressed body)
+        self.bodies: Dict[str, bytes] = {'identity': content}
+        if len(content) >= MIN_COMPRESS_SIZE:
+            self.bodies['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if _brotli_available:
+                self.bodies['br'] = brotli.compress(content, quality=11)
+
+    def select(self, accept_encoding: Optional[str]) -> tuple[str, bytes]:
+        """Best body for an Accept-Encoding header. Returns (encoding, body)."""
+        accepted = {
+            part.split(';')[0].strip().lower()
+            for part in (accept_encoding or '').split(',')
+            if not part.strip().endswith(';q=0')
+        }
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.bodies:
+                return encoding, self.bodies[encoding]
+        return 'identity', self.bodies['identity']
+
+
+class AssetBundle:
+    """The built webapp: hashed assets by name plus the rewritten index page."""
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Folder with index.html and the assets it references
+        """
+        self.directory = directory
+        self.assets: Dict[str, Asset] = {}
+        # Original file name -> hashed file name
+        self.names: Dict[str, str] = {}
+
+        # Only files reachable from index.html are bundled
+        index = self._read('index.html')
+        for name in self._references(index):
+            self._hash(name, visiting=set())
+
+        index = self._rewrite(index, prefix=f'{STATIC_PREFIX}/')
+        self.index = Asset('index.html', index, CACHE_REVALIDATE)
+
+        logger.info(
+            f"Built {len(self.assets)} webapp assets "
+            f"({'gzip+brotli' if _brotli_available else 'gzip only, brotli not installed'})"
+        )
+
+    def get(self, name: str) -> Optional[Asset]:
+        """Hashed asset by file name, or None."""
+        return self.assets.get(name)
+
+    def _read(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def _hash(self, name: str, visiting: set) -> Optional[str]:
+        """
+        Hashed name of a file (None if it is missing). Files it references are
+        hashed first, since their hashed names are part of its content.
+        """
+        if name in self.names:
+            return self.names[name]
+        if name in visiting:
+            raise ValueError(f"Import cycle through {name}")
+        if not os.path.isfile(os.path.join(self.directory, name)):
+            logger.warning(f"Webapp asset {name} is referenced but missing")
+            return None
+        visiting.add(name)
+
+        source = self._read(name)
+        for dependency in self._references(source):
+            self._hash(dependency, visiting)
+        content = self._rewrite(source, prefix='./')
+
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+        self.names[name] = hashed
+        self.assets[hashed] = Asset(hashed, content, CACHE_IMMUTABLE)
+        return hashed
+
+    def _references(self, content: bytes) -> list:
+        text = content.decode('utf-8')
+        return [match.group(2) for match in _REFERENCE_RE.finditer(text)]
+
+    def _rewrite(self, content: bytes, prefix: str) -> bytes:
+        """Point quoted references to already hashed files at their hashed names."""
+        def replace(match: re.Match) -> str:
+            hashed = self.names.get(match.group(2))
+            if hashed is None:
+                return match.group(0)
+            return f"{match.group(1)}{prefix}{hashed}{match.group(1)}"
+
+        text = content.decode('utf-8')
+        return _REFERENCE_RE.sub(replace, text).encode('utf-8')
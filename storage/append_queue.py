@@ -0,0 +1,103 @@
+"""
+AppendQueue - write-behind batching of rows bound for one spreadsheet.
+
+Bursts of save_note calls (albums, busy channels) are coalesced into a single
+append_rows request instead of one append_row per note, which keeps us under
+the per-user Sheets write quota.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+# Flush as soon as this many rows are pending...
+DEFAULT_MAX_BATCH = 50
+# ...or this many seconds after the first pending row arrived
+DEFAULT_MAX_DELAY = 0.5
+
+
+class AppendQueue:
+    """Collects rows and appends them in batches, preserving arrival order."""
+
+    def __init__(
+        self,
+        flush_fn: Callable[[List[list]], Awaitable[None]],
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_delay: float = DEFAULT_MAX_DELAY
+    ):
+        """
+        Args:
+            flush_fn: Coroutine function that writes a list of rows in one call
+            max_batch: Pending row count that triggers an immediate flush
+            max_delay: Seconds to wait for more rows before flushing
+        """
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.logger = logging.getLogger(__name__)
+
+        self._pending: List[Tuple[list, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        # Serializes flushes so batches land in the sheet in arrival order
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def put(self, row: list) -> None:
+        """
+        Queue a row and wait until the batch containing it has been written.
+        Raises the flush error if the batch failed.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+
+        await future
+
+    def _start_flush(self):
+        """Cancel the deadline timer and flush in a background task."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        """Write every pending row now."""
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+
+            rows = [row for row, _ in batch]
+            try:
+                await self.flush_fn(rows)
+            except Exception as e:
+                self.logger.error(f"Batched append of {len(rows)} rows failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def drain(self) -> None:
+        """Flush pending rows and wait for in-flight batches (used on shutdown)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
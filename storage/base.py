@@ -19,3 +19,73 @@ class BaseStorage(ABC):
             The ID of the saved record.
         """
         pass
+
+    @abstractmethod
+    async def update_note(self, destination_id: str, message_id: int, updated_content: str, updated_tags: list) -> bool:
+        """
+        Updates content and tags of the note saved from a Telegram message.
+
+        Returns:
+            True if the note was found and updated.
+        """
+        pass
+
+    @abstractmethod
+    async def update_note_status(self, destination_id: str, note_id: str, new_status: str) -> bool:
+        """
+        Updates the status of a note by its ID.
+
+        Returns:
+            True if the note was found and updated.
+        """
+        pass
+
+    @abstractmethod
+    async def get_notes_snapshot(self, destination_id: str):
+        """
+        Returns a NotesSnapshot with all notes of the destination, oldest first.
+        """
+        pass
+
+    async def get_note_shards(self, destination_id: str) -> list:
+        """
+        Returns the names of the shards notes are split into, newest first.
+        Backends that keep notes in one place have a single shard ''.
+        """
+        return ['']
+
+    async def get_shard_snapshot(self, destination_id: str, shard: str):
+        """
+        Returns a NotesSnapshot with the notes of one shard, oldest first.
+        """
+        return await self.get_notes_snapshot(destination_id)
+
+    async def get_notes_page(self, destination_id: str, limit: int = None, after: tuple = None, statuses=None) -> list:
+        """
+        Returns ParsedNotes in feed order (focus first, then newest first).
+
+        Args:
+            limit: Max notes to return (None = all)
+            after: feed_key of the last note of the previous page
+            statuses: Only notes with one of these statuses (None = any)
+
+        Backends that can filter and order at the source should override this.
+        """
+        snapshot = await self.get_notes_snapshot(destination_id)
+        return snapshot.page(limit, after, statuses)
+
+    async def get_notes_revision(self, destination_id: str) -> str:
+        """
+        Returns an opaque token that changes whenever a note of the destination
+        is saved or updated (used as the ETag of note responses).
+        """
+        snapshot = await self.get_notes_snapshot(destination_id)
+        return snapshot.revision
+
+    async def get_note_changes(self, destination_id: str, since: str):
+        """
+        Returns ParsedNotes created or changed after the revision `since`
+        (a get_notes_revision token), or None if the backend can't tell which
+        notes changed since then (callers fall back to the full list).
+        """
+        return None
@@ -3,9 +3,13 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from typing import Optional
+import json
 import logging
 import os
 
+from metrics import instrument_engine
+from storage.cache import TTLCache
+
 # Base class for models
 Base = declarative_base()
 
@@ -51,6 +55,7 @@ if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
 engine = create_engine(DATABASE_URL, echo=False)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Flag: is pgvector available on this PostgreSQL instance?
@@ -74,6 +79,8 @@ def init_db():
     # Import fragment models so they are registered with Base.metadata
     # Must happen AFTER pgvector_available is set
     import storage.fragments_db  # noqa: F401
+    import storage.sheet_index_db  # noqa: F401
+    import storage.notes_db  # noqa: F401
 
     Base.metadata.create_all(bind=engine)
 
@@ -113,6 +120,76 @@ def init_db():
     except Exception as e:
         logging.warning(f"Could not add sender/channel columns to fragments: {e}")
 
+    # Add 'worksheet' columns for sheet sharding (row index + backfill checkpoints)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(
+                "ALTER TABLE sheet_row_index "
+                "ADD COLUMN IF NOT EXISTS worksheet VARCHAR NOT NULL DEFAULT ''"
+            ))
+            conn.execute(text(
+                "ALTER TABLE fragment_backfills "
+                "ADD COLUMN IF NOT EXISTS worksheet VARCHAR NOT NULL DEFAULT ''"
+            ))
+            conn.commit()
+    except Exception as e:
+        logging.warning(f"Could not add 'worksheet' columns: {e}")
+
+    # Parsed creation time of notes: the feed is ordered by it, not by the created_at text
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(
+                "ALTER TABLE notes ADD COLUMN IF NOT EXISTS created_ts DOUBLE PRECISION"
+            ))
+            conn.commit()
+        filled = storage.notes_db.fill_created_ts()
+        if filled:
+            logging.info(f"Filled created_ts of {filled} notes")
+    except Exception as e:
+        logging.warning(f"Could not add 'created_ts' column to notes: {e}")
+
+    # Feed order index for paged note lists (focus first, then newest first)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_notes_spreadsheet_feed_ts "
+                "ON notes (spreadsheet_id, (status = 'focus'), created_ts, note_id)"
+            ))
+            conn.execute(text("DROP INDEX IF EXISTS idx_notes_spreadsheet_feed"))
+            conn.commit()
+    except Exception as e:
+        logging.warning(f"Could not create notes feed index: {e}")
+
+    # Note IDs are not unique (caption + [Media] pairs share one). Spreadsheets imported
+    # while they were lost one note of each pair: import them again
+    try:
+        with engine.connect() as conn:
+            unique_ids = conn.execute(text(
+                "SELECT 1 FROM pg_constraint WHERE conname = 'uq_notes_spreadsheet_note'"
+            )).first()
+            if unique_ids:
+                conn.execute(text("ALTER TABLE notes DROP CONSTRAINT uq_notes_spreadsheet_note"))
+                conn.execute(text("DELETE FROM notes_imports"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS idx_notes_spreadsheet_note ON notes (spreadsheet_id, note_id)"
+            ))
+            conn.commit()
+    except Exception as e:
+        logging.warning(f"Could not drop unique note IDs: {e}")
+
+    # Seed per-spreadsheet revision counters from notes stamped before they existed
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(
+                "INSERT INTO notes_revisions (spreadsheet_id, revision) "
+                "SELECT spreadsheet_id, max(revision) FROM notes GROUP BY spreadsheet_id "
+                "ON CONFLICT (spreadsheet_id) DO UPDATE "
+                "SET revision = GREATEST(notes_revisions.revision, EXCLUDED.revision)"
+            ))
+            conn.commit()
+    except Exception as e:
+        logging.warning(f"Could not seed notes revision counters: {e}")
+
     # Fix NULL booleans: set default values for is_duplicate/is_outdated
     try:
         with engine.connect() as conn:
@@ -139,9 +216,82 @@ def init_db():
         except Exception as e:
             logging.warning(f"Could not create HNSW index: {e}")
 
+# ---------------------------------------------------------------------------
+# Lookup caches: user -> spreadsheet and channel -> user are read for every
+# incoming message and API request but almost never change. save_user and
+# save_channel_mapping invalidate them here and, through NOTIFY, in every
+# other process listening (see listen_for_lookup_invalidations).
+# ---------------------------------------------------------------------------
+
+LOOKUP_CACHE_SIZE = 10000
+# Backstop for an invalidation lost while a process was not listening (seconds)
+LOOKUP_CACHE_TTL = 3600
+# "Not registered" answers expire sooner (seconds)
+LOOKUP_NEGATIVE_TTL = 60
+LOOKUP_INVALIDATION_CHANNEL = 'lookup_invalidation'
+
+_lookup_caches = {
+    'user': TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL),
+    'channel': TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL),
+}
+# Bumped by every invalidation, so a lookup that raced with one doesn't cache the old value
+_lookup_generation = 0
+_NOT_CACHED = object()
+
+
+def _cached_lookup(kind: str, key: int, query):
+    cache = _lookup_caches[kind]
+    value = cache.get(key, _NOT_CACHED)
+    if value is not _NOT_CACHED:
+        return value
+
+    generation = _lookup_generation
+    value = query()
+    if generation == _lookup_generation:
+        cache.set(key, value, ttl=None if value is not None else LOOKUP_NEGATIVE_TTL)
+    return value
+
+
+def _invalidate_lookup(kind: str, key: int):
+    global _lookup_generation
+    _lookup_generation += 1
+    _lookup_caches[kind].pop(key)
+
+
+def _clear_lookup_caches():
+    global _lookup_generation
+    _lookup_generation += 1
+    for cache in _lookup_caches.values():
+        cache.clear()
+
+
+def _notify_lookup_change(session, kind: str, key: int):
+    """Tell other processes to drop a cached lookup (delivered when the session commits)."""
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {'channel': LOOKUP_INVALIDATION_CHANNEL, 'payload': json.dumps({'kind': kind, 'key': key})}
+    )
+
+
+def _on_lookup_invalidation(payload: str):
+    message = json.loads(payload)
+    _invalidate_lookup(message['kind'], message['key'])
+
+
+def listen_for_lookup_invalidations(listener):
+    """
+    Drop cached lookups changed by other processes.
+
+    Args:
+        listener: The process's PgListener. On (re)connect the caches are
+            cleared, since invalidations may have been missed meanwhile.
+    """
+    listener.subscribe(LOOKUP_INVALIDATION_CHANNEL, _on_lookup_invalidation, on_connect=_clear_lookup_caches)
+
+
 def get_user_spreadsheet(user_id: int) -> Optional[str]:
     """
-    Get spreadsheet ID for a user.
+    Get spreadsheet ID for a user (cached, see LOOKUP_CACHE_TTL).
     
     Args:
         user_id: Telegram user ID
@@ -149,23 +299,38 @@ def get_user_spreadsheet(user_id: int) -> Optional[str]:
     Returns:
         Spreadsheet ID if user exists, None otherwise
     """
+    def query():
+        session = SessionLocal()
+        try:
+            user = session.query(User).filter(User.user_id == user_id).first()
+            return user.spreadsheet_id if user else None
+        finally:
+            session.close()
+
+    return _cached_lookup('user', user_id, query)
+
+def get_all_users() -> list[tuple[int, str]]:
+    """All registered users as (user_id, spreadsheet_id), oldest first."""
     session = SessionLocal()
     try:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        return user.spreadsheet_id if user else None
+        users = session.query(User.user_id, User.spreadsheet_id).order_by(User.id).all()
+        return [(u.user_id, u.spreadsheet_id) for u in users]
     finally:
         session.close()
 
 def get_channel_user(channel_id: int) -> Optional[int]:
-    """Get user_id mapped to a channel."""
-    session = SessionLocal()
-    try:
-        mapping = session.query(ChannelMapping).filter(
-            ChannelMapping.channel_id == channel_id
-        ).first()
-        return mapping.user_id if mapping else None
-    finally:
-        session.close()
+    """Get user_id mapped to a channel (cached, see LOOKUP_CACHE_TTL)."""
+    def query():
+        session = SessionLocal()
+        try:
+            mapping = session.query(ChannelMapping).filter(
+                ChannelMapping.channel_id == channel_id
+            ).first()
+            return mapping.user_id if mapping else None
+        finally:
+            session.close()
+
+    return _cached_lookup('channel', channel_id, query)
 
 
 def save_channel_mapping(channel_id: int, user_id: int) -> None:
@@ -180,9 +345,11 @@ def save_channel_mapping(channel_id: int, user_id: int) -> None:
         else:
             mapping = ChannelMapping(channel_id=channel_id, user_id=user_id)
             session.add(mapping)
+        _notify_lookup_change(session, 'channel', channel_id)
         session.commit()
     finally:
         session.close()
+    _invalidate_lookup('channel', channel_id)
 
 
 def get_cloned_message_id(channel_id: int, post_id: int) -> Optional[int]:
@@ -228,6 +395,8 @@ def save_user(user_id: int, spreadsheet_id: str) -> None:
         else:
             user = User(user_id=user_id, spreadsheet_id=spreadsheet_id)
             session.add(user)
+        _notify_lookup_change(session, 'user', user_id)
         session.commit()
     finally:
         session.close()
+    _invalidate_lookup('user', user_id)
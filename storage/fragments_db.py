@@ -5,15 +5,24 @@ Uses pgvector for embedding storage and similarity search when available.
 
 from sqlalchemy import (
     Column, Integer, BigInteger, String, Text, Boolean, DateTime, ForeignKey,
-    UniqueConstraint, func, or_, cast
+    UniqueConstraint, func, or_, and_, cast, case, literal, select
 )
-from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, insert as pg_insert
 from datetime import datetime
 from typing import Optional
 import logging
 
 import storage.db as _db
 from storage.db import Base, SessionLocal
+from storage.notes_db import NOTE_FIELDS, NoteRecord
+
+# HNSW candidate list size for note neighbours. The user filter is applied to
+# the index scan's output, so it has to look further than the default (40) to
+# still find enough of one user's fragments among everyone's.
+RELATED_EF_SEARCH = 400
+
+# Rows per INSERT in insert_fragments_batch (10 bind parameters each, Postgres allows 65535)
+FRAGMENTS_INSERT_CHUNK = 1000
 
 # ---------------------------------------------------------------------------
 # Conditional pgvector import
@@ -81,6 +90,19 @@ class FragmentCluster(Base):
     version = Column(Integer, primary_key=True)
 
 
+class FragmentBackfill(Base):
+    """Checkpoint of the sheet -> fragments backfill, one row per spreadsheet."""
+    __tablename__ = 'fragment_backfills'
+
+    spreadsheet_id = Column(String, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    worksheet = Column(String, nullable=False, default='', server_default='')  # Shard being read, '' = first sheet
+    next_row = Column(Integer, nullable=False, default=2)   # 1-based row of `worksheet` to read next
+    rows_scanned = Column(Integer, default=0)
+    fragments_inserted = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Artifact(Base):
     __tablename__ = 'artifacts'
 
@@ -133,36 +155,36 @@ def insert_fragments_batch(fragments: list[dict]) -> dict:
     """
     Insert multiple fragments. Skips duplicates by external_id.
     Returns {'indexed': N, 'duplicates_skipped': N, 'inserted_ids': [int]}.
+
+    One multi-row INSERT ... ON CONFLICT (external_id) DO NOTHING per
+    FRAGMENTS_INSERT_CHUNK fragments, all in one transaction: duplicates (in
+    the table or earlier in the batch) are left out by the database, and
+    RETURNING tells which rows went in.
     """
+    values = [
+        {
+            'external_id': f.get('external_id'),
+            'source': f['source'],
+            'text': f['text'],
+            'created_at': f['created_at'],
+            'tags': f.get('tags', []),
+            'content_type': f.get('content_type', 'note'),
+            'metadata_': f.get('metadata', {}),
+        }
+        for f in fragments
+    ]
+
     session = SessionLocal()
-    indexed = 0
-    skipped = 0
     inserted_ids = []
     try:
-        for f in fragments:
-            # Check duplicate by external_id
-            if f.get('external_id'):
-                exists = session.query(Fragment.id).filter(
-                    Fragment.external_id == f['external_id']
-                ).first()
-                if exists:
-                    skipped += 1
-                    continue
-
-            frag = Fragment(
-                external_id=f.get('external_id'),
-                source=f['source'],
-                text=f['text'],
-                created_at=f['created_at'],
-                tags=f.get('tags', []),
-                content_type=f.get('content_type', 'note'),
-                metadata_=f.get('metadata', {}),
+        for i in range(0, len(values), FRAGMENTS_INSERT_CHUNK):
+            result = session.execute(
+                pg_insert(Fragment)
+                .values(values[i:i + FRAGMENTS_INSERT_CHUNK])
+                .on_conflict_do_nothing(index_elements=['external_id'])
+                .returning(Fragment.id)
             )
-            session.add(frag)
-            session.flush()  # get frag.id before commit
-            inserted_ids.append(frag.id)
-            indexed += 1
-
+            inserted_ids.extend(row.id for row in result)
         session.commit()
     except Exception:
         session.rollback()
@@ -170,7 +192,10 @@ def insert_fragments_batch(fragments: list[dict]) -> dict:
     finally:
         session.close()
 
-    return {'indexed': indexed, 'duplicates_skipped': skipped, 'inserted_ids': inserted_ids}
+    # Ids come from the sequence in VALUES order: sorted, they follow the input
+    inserted_ids.sort()
+    indexed = len(inserted_ids)
+    return {'indexed': indexed, 'duplicates_skipped': len(fragments) - indexed, 'inserted_ids': inserted_ids}
 
 
 def get_fragments_count() -> int:
@@ -345,6 +370,93 @@ def search_hybrid(
     return [r for _, r in scored[:limit]]
 
 
+def search_related_notes(
+    spreadsheet_id: str,
+    user_id: int,
+    note_id: str,
+    limit: int = 20,
+) -> tuple[str, list[tuple[list, float]]] | None:
+    """
+    Notes of a user closest to one of their notes by embedding, in one query:
+    note -> its fragment (by the external_id the bot and the backfill write),
+    HNSW nearest neighbours among the user's fragments, fragments -> notes.
+
+    Returns:
+        (tags of the target note, [(sheet-format note row, cosine distance)] closest first),
+        or None if pgvector is not available. No neighbours if the note has no
+        embedded fragment (yet).
+    """
+    if not _pgvector_available():
+        logging.warning("search_related_notes called but pgvector is not available")
+        return None
+
+    # external_id formats, see bot/note_handler.py and services/backfill_service.py
+    bot_prefix = f"bot_{user_id}_"
+    sheet_prefix = f"sheet_{spreadsheet_id}_"
+
+    target = (
+        select(Fragment.id, Fragment.embedding, NoteRecord.tags)
+        .join(NoteRecord, Fragment.external_id == case(
+            (NoteRecord.telegram_message_id != '', literal(bot_prefix) + NoteRecord.telegram_message_id),
+            else_=literal(sheet_prefix) + NoteRecord.note_id,
+        ))
+        .where(
+            NoteRecord.spreadsheet_id == spreadsheet_id,
+            NoteRecord.note_id == note_id,
+            Fragment.embedding.isnot(None),
+        )
+        .limit(1)
+        .cte('target')
+    )
+    distance = Fragment.embedding.cosine_distance(select(target.c.embedding).scalar_subquery())
+    nearest = (
+        select(Fragment.external_id, distance.label('distance'))
+        .where(
+            Fragment.embedding.isnot(None),
+            Fragment.is_duplicate.isnot(True),
+            Fragment.id != select(target.c.id).scalar_subquery(),
+            or_(
+                Fragment.external_id.startswith(bot_prefix, autoescape=True),
+                Fragment.external_id.startswith(sheet_prefix, autoescape=True),
+            ),
+        )
+        .order_by(distance)
+        .limit(limit)
+        .cte('nearest')
+    )
+    # Back to notes through idx_notes_spreadsheet_message / idx_notes_spreadsheet_note
+    query = (
+        select(NoteRecord, nearest.c.distance, select(target.c.tags).scalar_subquery())
+        .join(nearest, and_(
+            NoteRecord.spreadsheet_id == spreadsheet_id,
+            or_(
+                and_(
+                    nearest.c.external_id.startswith(bot_prefix, autoescape=True),
+                    NoteRecord.telegram_message_id == func.substr(nearest.c.external_id, len(bot_prefix) + 1),
+                ),
+                and_(
+                    nearest.c.external_id.startswith(sheet_prefix, autoescape=True),
+                    NoteRecord.note_id == func.substr(nearest.c.external_id, len(sheet_prefix) + 1),
+                ),
+            ),
+        ))
+        .order_by(nearest.c.distance)
+    )
+
+    session = SessionLocal()
+    try:
+        session.execute(select(func.set_config('hnsw.ef_search', str(RELATED_EF_SEARCH), True)))
+        results = session.execute(query).all()
+        target_tags = results[0][2] if results else ''
+        matches = [
+            ([getattr(record, field) or '' for field in NOTE_FIELDS], float(d))
+            for record, d, _ in results
+        ]
+        return target_tags or '', matches
+    finally:
+        session.close()
+
+
 def get_unembedded_fragments(limit: int = 100) -> list[dict]:
     """Get fragments without embeddings (embedding IS NULL, is_duplicate=False)."""
     if not _pgvector_available():
@@ -447,6 +559,59 @@ def get_fragments_by_ids(fragment_ids: list[int]) -> list[dict]:
         session.close()
 
 
+# ---------------------------------------------------------------------------
+# Backfill checkpoints
+# ---------------------------------------------------------------------------
+
+def get_backfill_checkpoint(spreadsheet_id: str) -> dict | None:
+    """Backfill progress for a spreadsheet, or None if it was never started."""
+    session = SessionLocal()
+    try:
+        cp = session.query(FragmentBackfill).filter(
+            FragmentBackfill.spreadsheet_id == spreadsheet_id
+        ).first()
+        if not cp:
+            return None
+        return {
+            'worksheet': cp.worksheet or '',
+            'next_row': cp.next_row,
+            'rows_scanned': cp.rows_scanned or 0,
+            'fragments_inserted': cp.fragments_inserted or 0,
+        }
+    finally:
+        session.close()
+
+
+def save_backfill_checkpoint(
+    spreadsheet_id: str,
+    user_id: int,
+    worksheet: str,
+    next_row: int,
+    rows_scanned: int,
+    fragments_inserted: int,
+) -> None:
+    """Create or update the backfill checkpoint of a spreadsheet."""
+    session = SessionLocal()
+    try:
+        cp = session.query(FragmentBackfill).filter(
+            FragmentBackfill.spreadsheet_id == spreadsheet_id
+        ).first()
+        if not cp:
+            cp = FragmentBackfill(spreadsheet_id=spreadsheet_id, user_id=user_id)
+            session.add(cp)
+        cp.worksheet = worksheet
+        cp.next_row = next_row
+        cp.rows_scanned = rows_scanned
+        cp.fragments_inserted = fragments_inserted
+        cp.updated_at = datetime.utcnow()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
 # ---------------------------------------------------------------------------
 # Cluster CRUD
 # ---------------------------------------------------------------------------
@@ -1,9 +1,55 @@
 import asyncio
 import gspread
 import logging
+import re
+import threading
+import time
+import zlib
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional
+from metrics import track, SHEETS_CALL_SECONDS, SHEETS_CALL_ERRORS
 from .base import BaseStorage
+from .cache import TTLCache
+from .append_queue import AppendQueue
+from .sheets_scheduler import SheetsScheduler, PRIORITY_BACKGROUND
+from .notes_snapshot import NotesSnapshot, SnapshotCache
+from .note_rows import build_note_row, escape_formula
+from .sheet_index_db import (
+    save_row_numbers,
+    replace_sheet_index,
+    find_row_by_note_id,
+    find_row_by_message_id,
+)
+
+# Opened worksheet handles are reused for this long (seconds)
+HANDLE_CACHE_TTL = 600
+HANDLE_CACHE_MAX_SIZE = 256
+
+# Note columns A..K
+NOTE_COLUMNS = 11
+# Expired snapshots are refreshed by reading only the rows appended since;
+# the whole sheet is re-downloaded this often to pick up edits made elsewhere (seconds)
+FULL_RESYNC_INTERVAL = 600
+
+# New notes move to a per-month worksheet ("Notes 2026-10") once the current one
+# holds this many rows, so no single worksheet grows without bound
+ROTATE_AT_ROWS = 20000
+SHARD_TITLE_PREFIX = 'Notes '
+SHARD_TITLE_RE = re.compile(r'^Notes (\d{4})-(\d{2})(?: \((\d+)\))?$')
+
+NOTE_HEADERS = [
+    'ID', 
+    'Telegram Message ID', 
+    'Created At', 
+    'Content', 
+    'Tags', 
+    'Reply To Message ID',
+    'Message Type',
+    'Source Chat ID',
+    'Source Chat Link',
+    'Telegram Username',
+    'Status'
+]
 
 class GoogleSheetsStorage(BaseStorage):
     def __init__(self, credentials_path: str):
@@ -29,6 +75,32 @@ class GoogleSheetsStorage(BaseStorage):
             # Assume it's a file path
             self.gc = gspread.service_account(filename=credentials_path)
 
+        # spreadsheet_id -> (Spreadsheet, [(shard name, Worksheet), ...] oldest first)
+        # (skips open_by_key + metadata fetch)
+        self._worksheets = TTLCache(maxsize=HANDLE_CACHE_MAX_SIZE, ttl=HANDLE_CACHE_TTL)
+        # (spreadsheet_id, shard name) -> last used row, learned from appends and full reads
+        self._shard_rows: Dict[tuple, int] = {}
+        # Spreadsheets whose header row was already checked in this process
+        self._headers_verified = set()
+
+        # spreadsheet_id -> AppendQueue coalescing concurrent save_note calls
+        self._append_queues: Dict[str, AppendQueue] = {}
+
+        # (spreadsheet_id, shard name) -> NotesSnapshot shared by all read paths
+        self._snapshots = SnapshotCache()
+        # (spreadsheet_id, shard name) -> asyncio.Lock, so concurrent cold reads download a shard once.
+        # Refreshed on use, so locks of idle (or rotated-away) shards expire.
+        self._snapshot_locks = TTLCache(maxsize=HANDLE_CACHE_MAX_SIZE, ttl=HANDLE_CACHE_TTL)
+        # spreadsheet_id -> (shard versions, NotesSnapshot) for spreadsheets with several shards
+        self._combined_snapshots = TTLCache(maxsize=HANDLE_CACHE_MAX_SIZE, ttl=HANDLE_CACHE_TTL)
+
+        # operation -> {'operations': N, 'api_calls': N}
+        self._api_stats: Dict[str, Dict[str, int]] = {}
+        self._api_stats_lock = threading.Lock()
+
+        # Bounded, quota-aware pool running all gspread work
+        self._scheduler = SheetsScheduler()
+
     def get_service_account_email(self) -> str:
         """Returns the client_email from the credentials."""
         import json
@@ -42,17 +114,135 @@ class GoogleSheetsStorage(BaseStorage):
         except Exception:
             return 'Unknown'
 
+    # ==================== Handle cache & API accounting ====================
+
+    def _begin_operation(self, operation: str):
+        """Count one logical storage operation (save, update, read...)."""
+        with self._api_stats_lock:
+            stats = self._api_stats.setdefault(operation, {'operations': 0, 'api_calls': 0})
+            stats['operations'] += 1
+
+    def _api_call(self, operation: str, fn: Callable, *args, **kwargs):
+        """Perform one Sheets API round trip (quota-throttled, retried), attributing it to `operation`."""
+        with self._api_stats_lock:
+            stats = self._api_stats.setdefault(operation, {'operations': 0, 'api_calls': 0})
+            stats['api_calls'] += 1
+        with track(SHEETS_CALL_SECONDS, SHEETS_CALL_ERRORS, None, operation):
+            return self._scheduler.call(fn, *args, **kwargs)
+
+    def get_api_call_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns Sheets API usage per operation since startup.
+
+        Example: {'save_note': {'operations': 10, 'api_calls': 12, 'calls_per_operation': 1.2}}
+        """
+        with self._api_stats_lock:
+            return {
+                op: {
+                    **stats,
+                    'calls_per_operation': round(stats['api_calls'] / stats['operations'], 2)
+                    if stats['operations'] else 0.0,
+                }
+                for op, stats in self._api_stats.items()
+            }
+
+    def get_scheduler_metrics(self) -> Dict[str, Any]:
+        """Queue depth, wait times and retries of the Sheets scheduler."""
+        return self._scheduler.get_metrics()
+
+    def _open_spreadsheet(self, spreadsheet_id: str, operation: str, refresh: bool = False) -> tuple:
+        """
+        Return (spreadsheet, shards), opening the spreadsheet only on a cache miss.
+        Opening costs two API calls (open_by_key + worksheet list).
+
+        Shards are [(name, worksheet), ...] oldest first: the first worksheet
+        (name '') followed by the rotated "Notes YYYY-MM" worksheets.
+        """
+        if not refresh:
+            cached = self._worksheets.get(spreadsheet_id)
+            if cached is not None:
+                return cached
+
+        sh = self._api_call(operation, self.gc.open_by_key, spreadsheet_id)
+        worksheets = self._api_call(operation, sh.worksheets)
+
+        rotated = []
+        for worksheet in worksheets[1:]:
+            match = SHARD_TITLE_RE.match(worksheet.title)
+            if match:
+                order = (int(match.group(1)), int(match.group(2)), int(match.group(3) or 1))
+                rotated.append((order, worksheet))
+        shards = [('', worksheets[0])] + [(ws.title, ws) for _, ws in sorted(rotated, key=lambda item: item[0])]
+
+        self._worksheets.set(spreadsheet_id, (sh, shards))
+        return sh, shards
+
+    def _get_shards(self, spreadsheet_id: str, operation: str, refresh: bool = False) -> list:
+        """Note worksheets of a spreadsheet as [(name, worksheet), ...], oldest first."""
+        return self._open_spreadsheet(spreadsheet_id, operation, refresh)[1]
+
+    def _get_worksheet(self, spreadsheet_id: str, operation: str, refresh: bool = False):
+        """Return the first worksheet of a spreadsheet (it holds the header check)."""
+        return self._get_shards(spreadsheet_id, operation, refresh)[0][1]
+
+    def _get_shard(self, spreadsheet_id: str, shard: str, operation: str):
+        """Worksheet of a shard by name, or None if the spreadsheet has no such shard."""
+        return dict(self._get_shards(spreadsheet_id, operation)).get(shard)
+
+    def list_shards(self, spreadsheet_id: str) -> list:
+        """Shard names oldest first ('' = first worksheet). Blocking, for scripts."""
+        return [name for name, _ in self._get_shards(spreadsheet_id, 'list_shards')]
+
+    def _invalidate_handle(self, spreadsheet_id: str):
+        """Forget the cached handle and header memo (e.g. after an API error)."""
+        self._worksheets.pop(spreadsheet_id)
+        self._headers_verified.discard(spreadsheet_id)
+
+    # ==================== Write-behind append queue ====================
+
+    def _get_append_queue(self, spreadsheet_id: str) -> AppendQueue:
+        queue = self._append_queues.get(spreadsheet_id)
+        if queue is None:
+            async def flush(rows: list):
+                await self._scheduler.run(spreadsheet_id, self._append_rows_sync, spreadsheet_id, rows)
+
+            queue = AppendQueue(flush)
+            self._append_queues[spreadsheet_id] = queue
+        return queue
+
+    async def flush_pending(self, spreadsheet_id: str):
+        """Write queued notes for a spreadsheet now (before edits that look them up)."""
+        queue = self._append_queues.get(spreadsheet_id)
+        if queue and queue.pending_count:
+            await queue.flush()
+
+    async def close(self):
+        """Drain all append queues. Call on shutdown so queued notes are not lost."""
+        for spreadsheet_id, queue in list(self._append_queues.items()):
+            try:
+                await queue.drain()
+            except Exception as e:
+                logging.error(f"Error draining append queue for {spreadsheet_id}: {e}")
+
     async def save_note(self, spreadsheet_id: str, note_data: Dict[str, Any]) -> str:
-        """Asynchronously save a note to Google Sheets."""
-        return await asyncio.to_thread(self._save_note_sync, spreadsheet_id, note_data)
+        """
+        Asynchronously save a note to Google Sheets.
+        The row goes through the per-spreadsheet append queue, so concurrent saves
+        share one append_rows call. Returns once the row has been written.
+        """
+        record_id, row = build_note_row(note_data)
+        await self._get_append_queue(spreadsheet_id).put(row)
+        return record_id
 
     async def update_note(self, spreadsheet_id: str, message_id: int, updated_content: str, updated_tags: list) -> bool:
         """Asynchronously update a note in Google Sheets by message_id."""
-        return await asyncio.to_thread(self._update_note_sync, spreadsheet_id, message_id, updated_content, updated_tags)
+        await self.flush_pending(spreadsheet_id)
+        return await self._scheduler.run(spreadsheet_id, self._update_note_sync, spreadsheet_id, message_id, updated_content, updated_tags)
 
     async def update_note_status(self, spreadsheet_id: str, note_id: str, new_status: str) -> bool:
         """Asynchronously update a note's status in Google Sheets by note_id (Column A)."""
-        return await asyncio.to_thread(self._update_note_status_sync, spreadsheet_id, note_id, new_status)
+        await self.flush_pending(spreadsheet_id)
+        return await self._scheduler.run(spreadsheet_id, self._update_note_status_sync, spreadsheet_id, note_id, new_status)
 
     async def check_access(self, spreadsheet_id: str) -> tuple[bool, str]:
         """
@@ -61,7 +251,7 @@ class GoogleSheetsStorage(BaseStorage):
         """
         import traceback
         try:
-            await asyncio.to_thread(self.gc.open_by_key, spreadsheet_id)
+            await self._scheduler.run(spreadsheet_id, self._get_worksheet, spreadsheet_id, 'check_access', True)
             return True, ""
         except Exception:
             error_details = traceback.format_exc()
@@ -72,154 +262,452 @@ class GoogleSheetsStorage(BaseStorage):
         """
         Checks if the first row is empty and adds headers if needed.
         """
-        await asyncio.to_thread(self._ensure_headers_sync, spreadsheet_id)
+        self._headers_verified.discard(spreadsheet_id)
+        await self._scheduler.run(spreadsheet_id, self._ensure_headers_sync, spreadsheet_id)
 
     def _update_note_sync(self, spreadsheet_id: str, message_id: int, updated_content: str, updated_tags: list) -> bool:
         """Find and update a note by Telegram message_id."""
+        self._begin_operation('update_note')
         try:
-            sh = self.gc.open_by_key(spreadsheet_id)
-            worksheet = sh.sheet1
-            
             # Find the row with matching Telegram Message ID (column B)
-            all_values = worksheet.get_all_values()
+            located = self._locate_row(spreadsheet_id, 'update_note', message_id=str(message_id))
+            if located is None:
+                logging.warning(f"Message {message_id} not found in spreadsheet")
+                return False
+            shard, worksheet, row_idx = located
+
+            updated_content = escape_formula(updated_content)
             
-            for row_idx, row in enumerate(all_values[1:], start=2):  # Skip header, start from row 2
-                if len(row) > 1 and row[1] == str(message_id):  # Column B (index 1)
-                    # Formula Injection Protection
-                    if updated_content and updated_content.startswith(('=', '+', '-', '@')):
-                        updated_content = "'" + updated_content
-                    
-                    tags_str = ", ".join(updated_tags)
-                    
-                    # Update Content (column D) and Tags (column E)
-                    worksheet.update_cell(row_idx, 4, updated_content)  # Column D
-                    worksheet.update_cell(row_idx, 5, tags_str)  # Column E
-                    
-                    logging.info(f"Updated message {message_id} in row {row_idx}")
-                    return True
+            tags_str = ", ".join(updated_tags)
             
-            logging.warning(f"Message {message_id} not found in spreadsheet")
-            return False
+            # Update Content (column D) and Tags (column E) in one request
+            self._api_call('update_note', worksheet.batch_update, [{
+                'range': f'D{row_idx}:E{row_idx}',
+                'values': [[updated_content, tags_str]]
+            }])
+            self._patch_snapshot_row(spreadsheet_id, shard, row_idx, {3: updated_content, 4: tags_str})
+            
+            logging.info(f"Updated message {message_id} in row {row_idx}")
+            return True
             
         except Exception as e:
             logging.error(f"Error updating note: {e}")
+            self._invalidate_handle(spreadsheet_id)
             return False
 
     def _update_note_status_sync(self, spreadsheet_id: str, note_id: str, new_status: str) -> bool:
         """Find and update a note's status by note_id."""
+        self._begin_operation('update_note_status')
         try:
-            sh = self.gc.open_by_key(spreadsheet_id)
-            worksheet = sh.sheet1
+            # Find the row with the note_id (Column A)
+            located = self._locate_row(spreadsheet_id, 'update_note_status', note_id=note_id)
             
-            # Find the cell with the note_id (Column A)
-            cell = worksheet.find(note_id)
-            
-            if cell:
+            if located:
+                shard, worksheet, row_idx = located
                 # Status is in column 11 (K)
-                # cell.row gives the row number
-                worksheet.update_cell(cell.row, 11, new_status)
+                self._api_call('update_note_status', worksheet.batch_update, [{
+                    'range': f'K{row_idx}',
+                    'values': [[new_status]]
+                }])
+                self._patch_snapshot_row(spreadsheet_id, shard, row_idx, {10: new_status}, note_id)
                 return True
             return False
             
         except Exception as e:
             logging.error(f"Error updating note status in sheet {spreadsheet_id}: {e}")
+            self._invalidate_handle(spreadsheet_id)
             return False
 
+    async def write_note_fields(self, spreadsheet_id: str, note_id: str, content: str, tags: str, status: str) -> bool:
+        """Overwrite the editable cells (content, tags, status) of a note by note_id. Runs as background work."""
+        await self.flush_pending(spreadsheet_id)
+        return await self._scheduler.run(
+            spreadsheet_id, self._write_note_fields_sync, spreadsheet_id, note_id, content, tags, status,
+            priority=PRIORITY_BACKGROUND
+        )
+
+    async def append_rows(self, spreadsheet_id: str, rows: list):
+        """Append prepared rows in one call as background work (sheet export)."""
+        await self.flush_pending(spreadsheet_id)
+        await self._scheduler.run(spreadsheet_id, self._append_rows_sync, spreadsheet_id, rows, priority=PRIORITY_BACKGROUND)
+
+    async def fetch_rows(self, spreadsheet_id: str) -> list:
+        """All note rows of a spreadsheet, bypassing the snapshot cache. Raises on API errors."""
+        await self.flush_pending(spreadsheet_id)
+        return await self._scheduler.run(spreadsheet_id, self._fetch_rows_sync, spreadsheet_id)
+
+    def _write_note_fields_sync(self, spreadsheet_id: str, note_id: str, content: str, tags: str, status: str) -> bool:
+        """Synchronous implementation of write_note_fields. Returns False if the note is not in the sheet."""
+        self._begin_operation('write_note_fields')
+        try:
+            located = self._locate_row(spreadsheet_id, 'write_note_fields', note_id=note_id)
+            if located is None:
+                return False
+            shard, worksheet, row_idx = located
+
+            self._api_call('write_note_fields', worksheet.batch_update, [
+                {'range': f'D{row_idx}:E{row_idx}', 'values': [[content, tags]]},
+                {'range': f'K{row_idx}', 'values': [[status]]},
+            ])
+            self._patch_snapshot_row(spreadsheet_id, shard, row_idx, {3: content, 4: tags, 10: status}, note_id)
+            return True
+
+        except Exception as e:
+            logging.error(f"Error writing note {note_id} to sheet {spreadsheet_id}: {e}")
+            self._invalidate_handle(spreadsheet_id)
+            raise
+
+    # ==================== Row index ====================
+
+    def _locate_row(self, spreadsheet_id: str, operation: str, note_id: str = None, message_id: str = None) -> Optional[tuple]:
+        """
+        Find the sheet row of a note by note_id (column A) or Telegram message_id (column B).
+
+        Uses the Postgres row index and verifies the hit with one small read.
+        On a miss or a stale entry (rows moved or deleted by hand) the index is
+        rebuilt from a read of columns A:B of every shard.
+
+        Returns:
+            (shard name, worksheet, 1-based row number) or None if the note is not in the sheet
+        """
+        expected_note_id = note_id
+        shard = None
+        row_number = None
+        try:
+            if note_id:
+                hit = find_row_by_note_id(spreadsheet_id, note_id)
+                if hit:
+                    shard, row_number = hit
+            else:
+                hit = find_row_by_message_id(spreadsheet_id, message_id)
+                if hit:
+                    expected_note_id, shard, row_number = hit
+        except Exception as e:
+            logging.warning(f"Sheet row index lookup failed: {e}")
+
+        shards = self._get_shards(spreadsheet_id, operation)
+        worksheets = dict(shards)
+
+        if row_number and shard in worksheets:
+            worksheet = worksheets[shard]
+            cells = self._api_call(operation, worksheet.get, f'A{row_number}:B{row_number}')
+            found = cells[0] if cells else []
+            if (len(found) >= 2 and found[0] == expected_note_id
+                    and (message_id is None or found[1] == message_id)):
+                return shard, worksheet, row_number
+        if row_number:
+            logging.info(f"Row index stale for {spreadsheet_id} (row {row_number} of {shard!r}), rebuilding")
+
+        # Rebuild from the ID columns only (one call per shard, independent of sheet width)
+        entries = []
+        for name, worksheet in shards:
+            columns = self._api_call(operation, worksheet.get, 'A:B')
+            entries.extend(
+                (row[0], row[1] if len(row) > 1 else '', row_idx, name)
+                for row_idx, row in enumerate(columns[1:], start=2)  # Skip header
+                if row
+            )
+        try:
+            replace_sheet_index(spreadsheet_id, entries)
+        except Exception as e:
+            logging.warning(f"Could not rebuild sheet row index: {e}")
+
+        for entry_note_id, entry_message_id, row_idx, name in entries:
+            if (note_id and entry_note_id == note_id) or (message_id and entry_message_id == message_id):
+                return name, worksheets[name], row_idx
+        return None
+
+    def _index_appended_rows(self, spreadsheet_id: str, shard: str, rows: list, first_row: int):
+        """Record row numbers of freshly appended rows. Best-effort."""
+        try:
+            save_row_numbers(spreadsheet_id, [
+                (row[0], row[1], first_row + offset)
+                for offset, row in enumerate(rows)
+            ], worksheet=shard)
+        except Exception as e:
+            logging.warning(f"Could not index appended rows: {e}")
+
+    @staticmethod
+    def _first_appended_row(response: dict) -> Optional[int]:
+        """First row number from an append response ("Sheet1!A12:K14" -> 12)."""
+        try:
+            updated_range = response['updates']['updatedRange']
+            return int(re.match(r'[A-Z]+(\d+)', updated_range.rsplit('!', 1)[-1]).group(1))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            return None
+
     def _save_note_sync(self, spreadsheet_id: str, note_data: Dict[str, Any]) -> str:
-        """Synchronous implementation of save_note."""
+        """Synchronous implementation of save_note (bypasses the append queue)."""
+        record_id, row = build_note_row(note_data)
+        self._append_rows_sync(spreadsheet_id, [row])
+        return record_id
+
+    def _append_rows_sync(self, spreadsheet_id: str, rows: list):
+        """Append rows to the newest shard in a single API call, rotating first if it is full."""
+        self._begin_operation('save_note')
         try:
-            sh = self.gc.open_by_key(spreadsheet_id)
-            worksheet = sh.sheet1  # Write to the first sheet
-            
-            self._ensure_headers_sync(spreadsheet_id)
-            
-            # Generate ID
-            msg_id = note_data.get('message_id')
-            record_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{msg_id}"
-            created_at = datetime.now().isoformat()
-            
-            content = note_data.get('content', '')
-            # Formula Injection Protection
-            if content and content.startswith(('=', '+', '-', '@')):
-                content = "'" + content
-            
-            tags_str = ", ".join(note_data.get('tags', []))
-            reply_to = note_data.get('reply_to_message_id', '')
-            message_type = note_data.get('message_type', 'general')
-            source_chat_id = note_data.get('source_chat_id', '')
-            source_chat_link = note_data.get('source_chat_link', '')
-            telegram_username = note_data.get('telegram_username', '')
-            status = ''
-            
-            # Row: id | telegram_message_id | date_created | content | tags | reply_to_message_id | message_type | source_chat_id | source_chat_link | telegram_username | status
-            row = [
-                record_id,
-                str(msg_id),
-                created_at,
-                content,
-                tags_str,
-                str(reply_to) if reply_to else '',
-                message_type,
-                str(source_chat_id) if source_chat_id else '',
-                source_chat_link,
-                telegram_username,
-                status
-            ]
+            self._ensure_headers_sync(spreadsheet_id, operation='save_note')
+
+            shard, worksheet = self._active_shard(spreadsheet_id, len(rows), 'save_note')
             
-            worksheet.append_row(row, table_range='A1')
-            return record_id
+            response = self._api_call('save_note', worksheet.append_rows, rows, table_range='A1')
+
+            first_row = self._first_appended_row(response)
+            if first_row is None:
+                self._snapshots.invalidate(spreadsheet_id, shard)
+            else:
+                self._shard_rows[(spreadsheet_id, shard)] = first_row + len(rows) - 1
+                self._index_appended_rows(spreadsheet_id, shard, rows, first_row)
+                self._snapshots.patch(spreadsheet_id, lambda snap: snap.with_appended(first_row, rows), shard)
             
-        except Exception as e:
-            # In a real app, we should log this properly
-            print(f"Error saving to Google Sheets: {e}")
-            raise e
+        except Exception:
+            logging.exception(f"Error appending {len(rows)} rows to {spreadsheet_id}")
+            self._invalidate_handle(spreadsheet_id)
+            raise
+
+    def _ensure_headers_sync(self, spreadsheet_id: str, operation: str = 'ensure_headers'):
+        # Headers only need checking once per process (memo is reset with the handle)
+        if spreadsheet_id in self._headers_verified:
+            return
 
-    def _ensure_headers_sync(self, spreadsheet_id: str):
         try:
-            sh = self.gc.open_by_key(spreadsheet_id)
-            worksheet = sh.sheet1
+            worksheet = self._get_worksheet(spreadsheet_id, operation)
             
-            # Check if A1 is empty
-            if not worksheet.acell('A1').value:
-                headers = [
-                    'ID', 
-                    'Telegram Message ID', 
-                    'Created At', 
-                    'Content', 
-                    'Tags', 
-                    'Reply To Message ID',
-                    'Message Type',
-                    'Source Chat ID',
-                    'Source Chat Link',
-                    'Telegram Username',
-                    'Status'
-                ]
-                worksheet.update('A1:K1', [headers])
+            # Single read of the header row (empty list if A1 is empty)
+            headers = self._api_call(operation, worksheet.row_values, 1)
+            if not headers or not headers[0]:
+                self._api_call(operation, worksheet.update, range_name='A1:K1', values=[NOTE_HEADERS])
             else:
                 # Check if we need to add Status column (Column K, index 11)
-                # Simple check: get header row
-                headers = worksheet.row_values(1)
                 if len(headers) < 11:
-                    worksheet.update_cell(1, 11, 'Status')
+                    self._api_call(operation, worksheet.update_cell, 1, 11, 'Status')
+
+            self._headers_verified.add(spreadsheet_id)
                     
         except Exception as e:
             print(f"Error ensuring headers: {e}")
             # We don't raise here to not block registration if something minor fails
 
+    # ==================== Shard rotation ====================
+
+    def _active_shard(self, spreadsheet_id: str, incoming: int, operation: str) -> tuple:
+        """
+        Shard new rows go to: the newest one, unless adding `incoming` rows would take
+        it past ROTATE_AT_ROWS or it is a monthly shard of a past month. Then a new
+        shard for the current month is created.
+
+        Returns:
+            (shard name, worksheet)
+        """
+        sh, shards = self._open_spreadsheet(spreadsheet_id, operation)
+        shard, worksheet = shards[-1]
+
+        period = datetime.now().strftime('%Y-%m')
+        # Unknown until the first append or full read of the shard in this process
+        used_rows = self._shard_rows.get((spreadsheet_id, shard), 0)
+        month_over = shard != '' and not shard.startswith(f"{SHARD_TITLE_PREFIX}{period}")
+        if used_rows + incoming <= ROTATE_AT_ROWS and not month_over:
+            return shard, worksheet
+
+        return self._create_shard(spreadsheet_id, sh, shards, period, operation)
+
+    def _create_shard(self, spreadsheet_id: str, sh, shards: list, period: str, operation: str) -> tuple:
+        """Add a "Notes YYYY-MM" worksheet (numbered if the month already has one) with headers."""
+        existing = {name for name, _ in shards}
+        title = f"{SHARD_TITLE_PREFIX}{period}"
+        n = 1
+        while title in existing:
+            n += 1
+            title = f"{SHARD_TITLE_PREFIX}{period} ({n})"
+
+        try:
+            worksheet = self._api_call(operation, sh.add_worksheet, title=title, rows=1000, cols=NOTE_COLUMNS)
+        except gspread.exceptions.APIError as e:
+            # Most likely created meanwhile by the other process: reopen and use the newest shard
+            logging.warning(f"Could not add worksheet {title!r} to {spreadsheet_id}: {e}")
+            return self._get_shards(spreadsheet_id, operation, refresh=True)[-1]
+
+        self._api_call(operation, worksheet.update, range_name='A1:K1', values=[NOTE_HEADERS])
+        shards.append((title, worksheet))
+        self._shard_rows[(spreadsheet_id, title)] = 1
+        logging.info(f"Rotated {spreadsheet_id} to new worksheet {title!r}")
+        return title, worksheet
+
+    # ==================== Snapshot cache ====================
+
+    async def get_note_shards(self, spreadsheet_id: str) -> list:
+        """Shard names of a spreadsheet, newest first ('' = the first worksheet)."""
+        try:
+            shards = await self._scheduler.run(spreadsheet_id, self._get_shards, spreadsheet_id, 'get_note_shards')
+        except Exception as e:
+            # The snapshot read reports the error (and returns an empty snapshot)
+            logging.error(f"Error listing worksheets: {e}")
+            return ['']
+        return [name for name, _ in reversed(shards)]
+
+    async def get_notes_snapshot(self, spreadsheet_id: str) -> NotesSnapshot:
+        """
+        Read-through snapshot of all notes in a spreadsheet, across every shard.
+        Each shard is cached on its own; the combined view is rebuilt only when
+        one of them changes.
+        """
+        shards = await self.get_note_shards(spreadsheet_id)
+        if len(shards) == 1:
+            return await self.get_shard_snapshot(spreadsheet_id, shards[0])
+
+        parts = [await self.get_shard_snapshot(spreadsheet_id, shard) for shard in reversed(shards)]
+        versions = tuple(part.version for part in parts)
+        cached = self._combined_snapshots.get(spreadsheet_id)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+
+        snapshot = NotesSnapshot(spreadsheet_id, [row for part in parts for row in part.rows])
+        # Shards keep their parsed notes, so the combined view doesn't parse again
+        snapshot._notes = [note for part in parts for note in part.notes]
+        self._combined_snapshots.set(spreadsheet_id, (versions, snapshot))
+        return snapshot
+
+    async def get_shard_snapshot(self, spreadsheet_id: str, shard: str) -> NotesSnapshot:
+        """
+        Read-through snapshot of one shard of a spreadsheet.
+        Served from memory while fresh; concurrent misses share one download.
+        """
+        snapshot = self._snapshots.get(spreadsheet_id, shard)
+        if snapshot is not None:
+            return snapshot
+
+        key = (spreadsheet_id, shard)
+        lock = self._snapshot_locks.get(key) or asyncio.Lock()
+        self._snapshot_locks.set(key, lock)
+        async with lock:
+            # Another request may have loaded it while we waited
+            snapshot = self._snapshots.get(spreadsheet_id, shard)
+            if snapshot is not None:
+                return snapshot
+
+            await self.flush_pending(spreadsheet_id)
+            stale = self._snapshots.peek(spreadsheet_id, shard)
+            try:
+                snapshot = None
+                if stale is not None and time.monotonic() - stale.full_synced_at < FULL_RESYNC_INTERVAL:
+                    snapshot = await self._scheduler.run(spreadsheet_id, self._tail_sync_sync, stale)
+                if snapshot is None:
+                    rows = await self._scheduler.run(spreadsheet_id, self._fetch_shard_rows_sync, spreadsheet_id, shard)
+                    snapshot = NotesSnapshot(spreadsheet_id, rows, worksheet=shard)
+            except Exception as e:
+                logging.error(f"Error fetching notes: {e}")
+                self._invalidate_handle(spreadsheet_id)
+                return NotesSnapshot(spreadsheet_id, [], worksheet=shard)
+
+            self._snapshots.put(snapshot)
+            return snapshot
+
+    def _tail_sync_sync(self, snapshot: NotesSnapshot) -> Optional[NotesSnapshot]:
+        """
+        Bring an expired snapshot up to date by reading only rows appended since.
+
+        The read starts at the last known row, whose checksum must still match:
+        if it changed or disappeared, rows were edited or deleted elsewhere and
+        None is returned so the caller falls back to a full download.
+        """
+        if not snapshot.rows:
+            return None
+
+        self._begin_operation('tail_sync')
+        worksheet = self._get_shard(snapshot.spreadsheet_id, snapshot.worksheet, 'tail_sync')
+        if worksheet is None:
+            return None
+
+        anchor_row = len(snapshot.rows) + 1  # Sheet row of the last cached note
+        values = self._api_call('tail_sync', worksheet.get, f'A{anchor_row}:K')
+        rows = [self._normalize_row(row) for row in values]
+
+        if not rows or self._row_checksum(rows[0]) != self._row_checksum(snapshot.rows[-1]):
+            logging.info(f"Sheet {snapshot.spreadsheet_id} changed before row {anchor_row}, full resync")
+            return None
+
+        new_rows = rows[1:]
+        if not new_rows:
+            return snapshot.refreshed()
+        return snapshot.with_tail(new_rows)
+
+    @staticmethod
+    def _normalize_row(row: list) -> list:
+        """Pad/trim a row to the note columns (ranged reads drop trailing empty cells)."""
+        row = list(row[:NOTE_COLUMNS])
+        if len(row) < NOTE_COLUMNS:
+            row.extend([''] * (NOTE_COLUMNS - len(row)))
+        return row
+
+    @staticmethod
+    def _row_checksum(row: list) -> int:
+        return zlib.crc32('\x1f'.join(str(cell) for cell in row[:NOTE_COLUMNS]).encode('utf-8'))
+
+    def _patch_snapshot_row(self, spreadsheet_id: str, shard: str, row_number: int, cells: dict, note_id: str = None):
+        """Apply an in-process edit to the cached snapshot (dropped if it no longer lines up)."""
+        def patch(snap: NotesSnapshot):
+            expected = note_id
+            if expected is None:
+                idx = row_number - 2
+                expected = snap.rows[idx][0] if 0 <= idx < len(snap.rows) and snap.rows[idx] else None
+            return snap.with_cells(row_number, expected, cells) if expected else None
+
+        self._snapshots.patch(spreadsheet_id, patch, shard)
+
+    def _fetch_rows_sync(self, spreadsheet_id: str) -> list:
+        """Download the note rows of every shard, oldest first (excluding headers). Raises on API errors."""
+        rows = []
+        for shard, _ in self._get_shards(spreadsheet_id, 'get_all_notes'):
+            rows.extend(self._fetch_shard_rows_sync(spreadsheet_id, shard))
+        return rows
+
+    def _fetch_shard_rows_sync(self, spreadsheet_id: str, shard: str) -> list:
+        """Download all note rows of one shard (excluding header row). Raises on API errors."""
+        self._begin_operation('get_all_notes')
+        worksheet = self._get_shard(spreadsheet_id, shard, 'get_all_notes')
+        if worksheet is None:
+            raise ValueError(f"Worksheet {shard!r} not found in spreadsheet {spreadsheet_id}")
+        
+        if shard == '':
+            self._ensure_headers_sync(spreadsheet_id, operation='get_all_notes')
+        
+        # Get all values
+        all_values = self._api_call('get_all_notes', worksheet.get_all_values)
+        self._shard_rows[(spreadsheet_id, shard)] = max(len(all_values), 1)
+        
+        # Return all rows except header (row 0)
+        return [self._normalize_row(row) for row in all_values[1:]]
+
+    def read_row_range(self, spreadsheet_id: str, first_row: int, row_count: int, shard: str = '') -> list:
+        """
+        Read up to `row_count` note rows of a shard starting at sheet row `first_row` (blocking, for scripts).
+        Sheets drops trailing blank rows, so a short (or empty) result does not
+        mean the shard ends there. Raises on API errors.
+        """
+        self._begin_operation('read_row_range')
+        worksheet = self._get_shard(spreadsheet_id, shard, 'read_row_range')
+        if worksheet is None:
+            raise ValueError(f"Worksheet {shard!r} not found in spreadsheet {spreadsheet_id}")
+        last_row = first_row + row_count - 1
+        values = self._api_call('read_row_range', worksheet.get, f'A{first_row}:K{last_row}')
+        return [self._normalize_row(row) for row in values]
+
+    def shard_row_count(self, spreadsheet_id: str, shard: str = '') -> int:
+        """
+        Grid row count of a shard, header included (blocking, for scripts).
+        Reopens the spreadsheet so the count is current; it includes blank rows.
+        """
+        self._begin_operation('shard_row_count')
+        shards = dict(self._get_shards(spreadsheet_id, 'shard_row_count', refresh=True))
+        if shard not in shards:
+            raise ValueError(f"Worksheet {shard!r} not found in spreadsheet {spreadsheet_id}")
+        return shards[shard].row_count
+
     def _get_all_notes_sync(self, spreadsheet_id: str) -> list:
         """Get all notes from a spreadsheet (excluding header row)."""
         try:
-            sh = self.gc.open_by_key(spreadsheet_id)
-            worksheet = sh.sheet1
-            
-            self._ensure_headers_sync(spreadsheet_id)
-            
-            # Get all values
-            all_values = worksheet.get_all_values()
-            
-            # Return all rows except header (row 0)
-            return all_values[1:] if len(all_values) > 1 else []
-            
+            return self._fetch_rows_sync(spreadsheet_id)
         except Exception as e:
             logging.error(f"Error fetching notes: {e}")
+            self._invalidate_handle(spreadsheet_id)
             return []
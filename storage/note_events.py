@@ -0,0 +1,123 @@
+"""
+NoteEventBus - live note changes for the webapp.
+
+Every write to the `notes` table sends a Postgres NOTIFY on
+NOTE_EVENTS_CHANNEL from inside its transaction (see storage/notes_db.py), so
+events reach the API process no matter which process wrote the note and only
+once the write is committed. The bus receives them through the process's
+PgListener and hands each event to the subscribers of its spreadsheet (one
+asyncio queue per open event stream).
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set
+
+from .notes_db import NOTE_EVENTS_CHANNEL, NOTE_CREATED, NOTE_UPDATED, get_note_row
+from .parsed_note import parse_rows
+from .pg_listener import PgListener
+
+# Events buffered per subscriber; a client that falls further behind is told to reload
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Sent instead of missed events (subscriber queue overflowed, or LISTEN reconnected)
+RESYNC = 'resync'
+
+
+class Subscription:
+    """One open event stream of a spreadsheet."""
+
+    __slots__ = ('spreadsheet_id', 'queue')
+
+    def __init__(self, spreadsheet_id: str):
+        self.spreadsheet_id = spreadsheet_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    async def get(self) -> Dict[str, Any]:
+        return await self.queue.get()
+
+
+class NoteEventBus:
+    """Fans note events from Postgres out to per-spreadsheet subscribers."""
+
+    def __init__(self, listener: PgListener):
+        """
+        Args:
+            listener: The process's PgListener (started by the caller)
+        """
+        self.logger = logging.getLogger(__name__)
+        # Only touched from the event loop
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        listener.subscribe(NOTE_EVENTS_CHANNEL, self._dispatch, on_connect=self._reconnected)
+
+    def start(self):
+        """Bind to the running event loop that serves the streams. Call before the listener starts."""
+        self._loop = asyncio.get_running_loop()
+
+    def subscribe(self, spreadsheet_id: str) -> Subscription:
+        subscription = Subscription(spreadsheet_id)
+        self._subscribers.setdefault(spreadsheet_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.spreadsheet_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.spreadsheet_id]
+
+    # ==================== Listener thread ====================
+
+    def _reconnected(self):
+        # Events sent while the connection was down are lost: open streams must reload
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._resync_all)
+
+    def _dispatch(self, payload: str):
+        """Turn a NOTIFY payload into a client event and pass it to the event loop."""
+        try:
+            event = json.loads(payload)
+            spreadsheet_id = event.pop('spreadsheet_id')
+        except (ValueError, KeyError) as e:
+            self.logger.warning(f"Malformed note event {payload[:200]!r}: {e}")
+            return
+
+        # Unlocked read: at worst an event for a stream opened this instant is dropped
+        if self._loop is None or spreadsheet_id not in self._subscribers:
+            return
+
+        if event['type'] in (NOTE_CREATED, NOTE_UPDATED):
+            row = event.pop('row', None)
+            if row is None:
+                # Left out of the payload because the note is too long for NOTIFY
+                row = get_note_row(spreadsheet_id, event['note_id'])
+            notes = parse_rows([row]) if row else []
+            if not notes:
+                return
+            event['note'] = notes[0].to_dict()
+
+        self._loop.call_soon_threadsafe(self._deliver, spreadsheet_id, event)
+
+    # ==================== Event loop ====================
+
+    def _deliver(self, spreadsheet_id: str, event: Dict[str, Any]):
+        for subscription in self._subscribers.get(spreadsheet_id, ()):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The client missed events: drop the backlog and have it reload the notes
+                self._resync(subscription)
+
+    def _resync_all(self):
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                self._resync(subscription)
+
+    @staticmethod
+    def _resync(subscription: Subscription):
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait({'type': RESYNC})
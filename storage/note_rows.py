@@ -0,0 +1,61 @@
+"""
+Note rows - the sheet row of a new note, shared by every storage backend.
+
+Column order (A..K): id | telegram_message_id | date_created | content | tags |
+reply_to_message_id | message_type | source_chat_id | source_chat_link |
+telegram_username | status
+"""
+
+from datetime import datetime
+from typing import Any, Dict
+
+
+def escape_formula(content: str) -> str:
+    """Formula Injection Protection: keep user text from being evaluated by Sheets."""
+    if content and content.startswith(('=', '+', '-', '@')):
+        return "'" + content
+    return content
+
+
+def build_note_id(message_id: Any, part: int = 0, now: datetime = None) -> str:
+    """
+    Note ID: save time to the second plus the Telegram message ID.
+
+    One message can produce several notes within the same second (a media
+    forward with a caption is saved as the caption and a [Media] note), so
+    every note after the first gets its position as a suffix.
+    """
+    now = now or datetime.now()
+    note_id = f"{now.strftime('%Y%m%d%H%M%S')}_{message_id}"
+    return f"{note_id}_{part + 1}" if part else note_id
+
+
+def build_note_row(note_data: Dict[str, Any]) -> tuple[str, list]:
+    """
+    Sheet row for a new note. Returns (note_id, row).
+
+    Args:
+        note_data: message_id, content, tags, reply_to_message_id, message_type,
+            source_chat_id, source_chat_link, telegram_username, and `part`
+            (position among the notes saved from one message, 0 = first)
+    """
+    now = datetime.now()
+    msg_id = note_data.get('message_id')
+    note_id = build_note_id(msg_id, note_data.get('part', 0), now)
+
+    reply_to = note_data.get('reply_to_message_id', '')
+    source_chat_id = note_data.get('source_chat_id', '')
+    row = [
+        note_id,
+        str(msg_id),
+        now.isoformat(),
+        escape_formula(note_data.get('content', '')),
+        ", ".join(note_data.get('tags', [])),
+        str(reply_to) if reply_to else '',
+        note_data.get('message_type', 'general'),
+        str(source_chat_id) if source_chat_id else '',
+        note_data.get('source_chat_link', ''),
+        note_data.get('telegram_username', ''),
+        '',  # status
+    ]
+    return note_id, row
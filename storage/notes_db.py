@@ -0,0 +1,574 @@
+"""
+Notes storage: SQLAlchemy models + CRUD for the `notes` table, the primary copy
+of every user's notes. Google Sheets is kept as an export target: rows written
+here are marked with a pending sheet_state and pushed to the sheet by the
+background sync job (see storage/postgres_storage.py).
+"""
+
+from sqlalchemy import (
+    Column, Integer, BigInteger, Float, String, Text, DateTime, Index,
+    func, case, tuple_, literal, select, update
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime
+import json
+
+from storage.db import Base, SessionLocal
+from storage.parsed_note import parse_timestamp
+
+# sheet_state values
+SHEET_SYNCED = 'synced'
+SHEET_PENDING_INSERT = 'pending_insert'
+SHEET_PENDING_UPDATE = 'pending_update'
+
+# Sheet column order (A..K), shared with GoogleSheetsStorage rows
+NOTE_FIELDS = [
+    'note_id',
+    'telegram_message_id',
+    'created_at',
+    'content',
+    'tags',
+    'reply_to_message_id',
+    'message_type',
+    'source_chat_id',
+    'source_chat_link',
+    'telegram_username',
+    'status',
+]
+
+# NOTIFY channel of note changes (see storage/note_events.py)
+NOTE_EVENTS_CHANNEL = 'note_events'
+# Event types
+NOTE_CREATED = 'note_created'
+NOTE_UPDATED = 'note_updated'
+STATUS_CHANGED = 'status_changed'
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+class NoteRecord(Base):
+    """One note, mirroring a row of the user's spreadsheet."""
+    __tablename__ = 'notes'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    spreadsheet_id = Column(String, nullable=False)
+    note_id = Column(String, nullable=False)                 # Column A
+    telegram_message_id = Column(String, nullable=True)      # Column B
+    created_at = Column(String, nullable=False)              # ISO 8601, as written to the sheet
+    created_ts = Column(Float, nullable=True)                # created_at in epoch seconds (feed order)
+    content = Column(Text, default='')
+    tags = Column(Text, default='')                          # "#tag1, #tag2"
+    reply_to_message_id = Column(String, default='')
+    message_type = Column(String(32), default='general')
+    source_chat_id = Column(String, default='')
+    source_chat_link = Column(Text, default='')
+    telegram_username = Column(String, default='')
+    status = Column(String(16), default='')
+    revision = Column(BigInteger, nullable=False)            # NotesRevision value of the last write
+    sheet_state = Column(String(16), default=SHEET_PENDING_INSERT, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Not unique: sheets have caption + [Media] pairs saved under one ID
+        Index('idx_notes_spreadsheet_note', 'spreadsheet_id', 'note_id'),
+        Index('idx_notes_spreadsheet_created', 'spreadsheet_id', 'created_at'),
+        Index('idx_notes_spreadsheet_message', 'spreadsheet_id', 'telegram_message_id'),
+        Index('idx_notes_spreadsheet_revision', 'spreadsheet_id', 'revision'),
+        Index('idx_notes_sheet_pending', 'sheet_state', postgresql_where=(sheet_state != SHEET_SYNCED)),
+    )
+
+
+class NotesRevision(Base):
+    """
+    Change counter per spreadsheet. Every write to a spreadsheet's notes bumps
+    it in the same transaction and stamps the note with the new value. The
+    row lock is held until commit, so writers of one spreadsheet commit in
+    revision order and `revision > since` never skips a late commit.
+    """
+    __tablename__ = 'notes_revisions'
+
+    spreadsheet_id = Column(String, primary_key=True)
+    revision = Column(BigInteger, nullable=False, default=0)
+
+
+class NotesImport(Base):
+    """Spreadsheets whose existing rows were imported into `notes`."""
+    __tablename__ = 'notes_imports'
+
+    spreadsheet_id = Column(String, primary_key=True)
+    rows_imported = Column(Integer, default=0)
+    imported_at = Column(DateTime, default=datetime.utcnow)
+
+
+def _row_to_values(spreadsheet_id: str, row: list) -> dict:
+    values = {field: (row[i] if i < len(row) else '') or '' for i, field in enumerate(NOTE_FIELDS)}
+    values['spreadsheet_id'] = spreadsheet_id
+    values['created_ts'] = parse_timestamp(values['created_at'])
+    return values
+
+
+def _record_to_row(r) -> list:
+    return [getattr(r, field) or '' for field in NOTE_FIELDS]
+
+
+def _next_revision(session, spreadsheet_id: str) -> int:
+    """Bump the spreadsheet's revision; locks its counter row until the session commits."""
+    return session.execute(
+        pg_insert(NotesRevision)
+        .values(spreadsheet_id=spreadsheet_id, revision=1)
+        .on_conflict_do_update(
+            index_elements=['spreadsheet_id'],
+            set_={'revision': NotesRevision.revision + 1}
+        )
+        .returning(NotesRevision.revision)
+    ).scalar_one()
+
+
+def _current_revision(session, spreadsheet_id: str) -> int:
+    result = session.query(NotesRevision.revision).filter(
+        NotesRevision.spreadsheet_id == spreadsheet_id
+    ).scalar()
+    return result or 0
+
+
+def _notify_note_event(session, spreadsheet_id: str, event_type: str, note_id: str, revision: int, **fields):
+    """
+    Queue a note event on NOTE_EVENTS_CHANNEL. Postgres delivers it when the
+    session commits, and drops it on rollback.
+
+    Large fields (the row of a long note) are left out when the payload would
+    exceed NOTIFY_PAYLOAD_LIMIT; listeners load the note themselves then.
+    """
+    event = {
+        'spreadsheet_id': spreadsheet_id,
+        'type': event_type,
+        'note_id': note_id,
+        'revision': revision,
+        **fields,
+    }
+    payload = json.dumps(event, ensure_ascii=False)
+    if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT:
+        event.pop('row', None)
+        payload = json.dumps(event, ensure_ascii=False)
+    session.execute(select(func.pg_notify(NOTE_EVENTS_CHANNEL, payload)))
+
+
+# ---------------------------------------------------------------------------
+# Writes
+# ---------------------------------------------------------------------------
+
+def insert_note(spreadsheet_id: str, row: list) -> None:
+    """Insert a new note (sheet row format). It is queued for the sheet."""
+    session = SessionLocal()
+    try:
+        values = _row_to_values(spreadsheet_id, row)
+        values['sheet_state'] = SHEET_PENDING_INSERT
+        values['updated_at'] = datetime.utcnow()
+        revision = values['revision'] = _next_revision(session, spreadsheet_id)
+        session.execute(pg_insert(NoteRecord).values(**values))
+        _notify_note_event(
+            session, spreadsheet_id, NOTE_CREATED, values['note_id'], revision,
+            row=[values[field] for field in NOTE_FIELDS]
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _pending_update_state():
+    # A note not yet appended to the sheet stays pending_insert (the insert carries the latest values)
+    return case(
+        (NoteRecord.sheet_state == SHEET_PENDING_INSERT, SHEET_PENDING_INSERT),
+        else_=SHEET_PENDING_UPDATE
+    )
+
+
+def update_note_content(spreadsheet_id: str, message_id: str, content: str, tags: str) -> bool:
+    """Update content and tags of the (first) note saved from a Telegram message."""
+    session = SessionLocal()
+    try:
+        note = (
+            session.query(NoteRecord.id)
+            .filter(
+                NoteRecord.spreadsheet_id == spreadsheet_id,
+                NoteRecord.telegram_message_id == message_id
+            )
+            .order_by(NoteRecord.id)
+            .first()
+        )
+        if not note:
+            return False
+
+        record = session.execute(
+            update(NoteRecord)
+            .where(NoteRecord.id == note.id)
+            .values({
+                NoteRecord.content: content,
+                NoteRecord.tags: tags,
+                NoteRecord.revision: _next_revision(session, spreadsheet_id),
+                NoteRecord.sheet_state: _pending_update_state(),
+                NoteRecord.updated_at: datetime.utcnow(),
+            })
+            .returning(*NoteRecord.__table__.c)
+        ).one()
+        _notify_note_event(
+            session, spreadsheet_id, NOTE_UPDATED, record.note_id, record.revision,
+            row=_record_to_row(record)
+        )
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def update_note_status(spreadsheet_id: str, note_id: str, status: str) -> bool:
+    """Update a note's status by note_id (the first note if the ID repeats, as in the sheet)."""
+    session = SessionLocal()
+    try:
+        note = (
+            session.query(NoteRecord.id)
+            .filter(
+                NoteRecord.spreadsheet_id == spreadsheet_id,
+                NoteRecord.note_id == note_id
+            )
+            .order_by(NoteRecord.id)
+            .first()
+        )
+        if not note:
+            return False
+
+        revision = session.execute(
+            update(NoteRecord)
+            .where(NoteRecord.id == note.id)
+            .values({
+                NoteRecord.status: status,
+                NoteRecord.revision: _next_revision(session, spreadsheet_id),
+                NoteRecord.sheet_state: _pending_update_state(),
+                NoteRecord.updated_at: datetime.utcnow(),
+            })
+            .returning(NoteRecord.revision)
+        ).scalar_one()
+        _notify_note_event(session, spreadsheet_id, STATUS_CHANGED, note_id, revision, status=status)
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def get_notes_revision(spreadsheet_id: str) -> int:
+    """
+    Current revision of a spreadsheet's notes (0 if it has none). Every note
+    with a revision up to it is committed, so it is safe to pass to
+    get_note_changes later.
+    """
+    session = SessionLocal()
+    try:
+        return _current_revision(session, spreadsheet_id)
+    finally:
+        session.close()
+
+
+def get_note_page(
+    spreadsheet_id: str,
+    limit: int = None,
+    after: tuple = None,
+    statuses: list = None
+) -> list[list]:
+    """
+    Notes in feed order (focus first, then newest first, ties by note_id) as sheet-format rows.
+    Served by idx_notes_spreadsheet_feed_ts (created in init_db).
+
+    Args:
+        limit: Max rows (None = all)
+        after: (is_focus, created_ts, note_id) of the last note of the previous page (see feed_key)
+        statuses: Only notes with one of these statuses (None = any)
+    """
+    session = SessionLocal()
+    try:
+        is_focus = NoteRecord.status == 'focus'
+        query = session.query(NoteRecord).filter(NoteRecord.spreadsheet_id == spreadsheet_id)
+        if statuses is not None:
+            query = query.filter(NoteRecord.status.in_(list(statuses)))
+        if after is not None:
+            focus, created_ts, note_id = after
+            query = query.filter(
+                tuple_(is_focus, NoteRecord.created_ts, NoteRecord.note_id)
+                < tuple_(literal(bool(focus)), literal(float(created_ts)), literal(note_id))
+            )
+        query = query.order_by(is_focus.desc(), NoteRecord.created_ts.desc(), NoteRecord.note_id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return [_record_to_row(r) for r in query.all()]
+    finally:
+        session.close()
+
+
+def get_note_row(spreadsheet_id: str, note_id: str) -> list | None:
+    """One note as a sheet-format row (the first if the ID repeats), or None."""
+    session = SessionLocal()
+    try:
+        record = session.query(NoteRecord).filter(
+            NoteRecord.spreadsheet_id == spreadsheet_id,
+            NoteRecord.note_id == note_id
+        ).order_by(NoteRecord.id).first()
+        return _record_to_row(record) if record else None
+    finally:
+        session.close()
+
+
+def get_note_changes(spreadsheet_id: str, since: int) -> list[list]:
+    """
+    Notes created or changed after a revision, as sheet-format rows.
+    Served by idx_notes_spreadsheet_revision.
+    """
+    session = SessionLocal()
+    try:
+        results = (
+            session.query(NoteRecord)
+            .filter(
+                NoteRecord.spreadsheet_id == spreadsheet_id,
+                NoteRecord.revision > since
+            )
+            .order_by(NoteRecord.revision)
+            .all()
+        )
+        return [_record_to_row(r) for r in results]
+    finally:
+        session.close()
+
+
+def get_note_rows(spreadsheet_id: str) -> tuple[list[list], int]:
+    """
+    All notes of a spreadsheet as sheet-format rows, oldest first.
+
+    Returns:
+        (rows, revision)
+    """
+    session = SessionLocal()
+    try:
+        # Read before the rows: a write committed in between is then both in the
+        # rows and in the next delta, never in neither
+        revision = _current_revision(session, spreadsheet_id)
+        results = (
+            session.query(NoteRecord)
+            .filter(NoteRecord.spreadsheet_id == spreadsheet_id)
+            .order_by(NoteRecord.created_ts, NoteRecord.id)
+            .all()
+        )
+        rows = [_record_to_row(r) for r in results]
+        return rows, revision
+    finally:
+        session.close()
+
+
+def fill_created_ts(batch_size: int = 1000) -> int:
+    """
+    Set created_ts on notes stored before the column existed (called by init_db).
+    Returns the number of notes updated.
+    """
+    session = SessionLocal()
+    try:
+        filled = 0
+        while True:
+            results = (
+                session.query(NoteRecord.id, NoteRecord.created_at)
+                .filter(NoteRecord.created_ts.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not results:
+                return filled
+            session.execute(
+                update(NoteRecord),
+                [{'id': r.id, 'created_ts': parse_timestamp(r.created_at)} for r in results]
+            )
+            session.commit()
+            filled += len(results)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ---------------------------------------------------------------------------
+# Sheet import / sync
+# ---------------------------------------------------------------------------
+
+def is_imported(spreadsheet_id: str) -> bool:
+    session = SessionLocal()
+    try:
+        return session.query(NotesImport.spreadsheet_id).filter(
+            NotesImport.spreadsheet_id == spreadsheet_id
+        ).first() is not None
+    finally:
+        session.close()
+
+
+def import_sheet_rows(spreadsheet_id: str, rows: list[list]) -> int:
+    """
+    Import existing sheet rows (already in the sheet, so marked synced).
+
+    Every row is imported, including rows sharing a note ID. Notes already in
+    the table (saved before the import and synced since) win: the n-th sheet
+    row with an ID is skipped if the table has at least n notes with it.
+    Only one process imports a spreadsheet. Returns the number of rows inserted.
+    """
+    session = SessionLocal()
+    try:
+        # The counter row lock serializes this with every other write to the spreadsheet
+        revision = _next_revision(session, spreadsheet_id)
+        claimed = session.execute(
+            pg_insert(NotesImport)
+            .values(spreadsheet_id=spreadsheet_id, rows_imported=0, imported_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=['spreadsheet_id'])
+            .returning(NotesImport.spreadsheet_id)
+        ).scalar_one_or_none()
+        if claimed is None:
+            session.rollback()
+            return 0  # Imported by another process meanwhile
+
+        stored = dict(
+            session.query(NoteRecord.note_id, func.count())
+            .filter(NoteRecord.spreadsheet_id == spreadsheet_id)
+            .group_by(NoteRecord.note_id)
+            .all()
+        )
+        seen: dict[str, int] = {}
+        values = []
+        for row in rows:
+            if not row or not row[0]:
+                continue
+            seen[row[0]] = seen.get(row[0], 0) + 1
+            if seen[row[0]] <= stored.get(row[0], 0):
+                continue
+            v = _row_to_values(spreadsheet_id, row)
+            v['sheet_state'] = SHEET_SYNCED
+            v['revision'] = revision
+            values.append(v)
+
+        for i in range(0, len(values), 1000):
+            session.execute(pg_insert(NoteRecord).values(values[i:i + 1000]))
+
+        session.query(NotesImport).filter(NotesImport.spreadsheet_id == spreadsheet_id).update(
+            {NotesImport.rows_imported: len(values)}, synchronize_session=False
+        )
+        session.commit()
+        return len(values)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_pending_sheet_sync(limit: int = 200) -> list[dict]:
+    """Notes whose latest state has not reached the sheet yet, oldest first."""
+    session = SessionLocal()
+    try:
+        results = (
+            session.query(NoteRecord)
+            .filter(NoteRecord.sheet_state != SHEET_SYNCED)
+            .order_by(NoteRecord.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                'id': r.id,
+                'spreadsheet_id': r.spreadsheet_id,
+                'revision': r.revision,
+                'sheet_state': r.sheet_state,
+                'row': _record_to_row(r),
+            }
+            for r in results
+        ]
+    finally:
+        session.close()
+
+
+def mark_sheet_synced(entries: list[tuple[int, int]]) -> None:
+    """
+    Mark notes as synced. Skips notes changed again since they were read
+    (revision moved on), so the newer change is pushed on the next pass.
+
+    Args:
+        entries: [(id, revision), ...]
+    """
+    if not entries:
+        return
+
+    session = SessionLocal()
+    try:
+        for note_pk, revision in entries:
+            session.query(NoteRecord).filter(
+                NoteRecord.id == note_pk,
+                NoteRecord.revision == revision
+            ).update({NoteRecord.sheet_state: SHEET_SYNCED}, synchronize_session=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def mark_sheet_appended(entries: list[tuple[int, int]]) -> None:
+    """
+    Record that notes were appended to the sheet. Unlike mark_sheet_synced
+    this always applies: a note edited since it was read is now in the sheet
+    with older values, so it becomes pending_update rather than being
+    appended again.
+
+    Args:
+        entries: [(id, revision), ...]
+    """
+    if not entries:
+        return
+
+    session = SessionLocal()
+    try:
+        for note_pk, revision in entries:
+            session.query(NoteRecord).filter(NoteRecord.id == note_pk).update(
+                {
+                    NoteRecord.sheet_state: case(
+                        (NoteRecord.revision == revision, SHEET_SYNCED),
+                        else_=SHEET_PENDING_UPDATE
+                    )
+                },
+                synchronize_session=False
+            )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def set_sheet_state(note_pk: int, sheet_state: str) -> None:
+    """Force the sheet state of a note (e.g. re-append a row missing from the sheet)."""
+    session = SessionLocal()
+    try:
+        session.query(NoteRecord).filter(NoteRecord.id == note_pk).update(
+            {NoteRecord.sheet_state: sheet_state}, synchronize_session=False
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,337 @@
+"""
+Notes snapshots: the parsed-once view of a user's spreadsheet that every read
+path shares (webapp notes list, related notes, reply chains).
+
+A snapshot is never mutated after creation. Writes made in this process build
+a patched copy with a new version, so readers holding the old snapshot keep a
+consistent view.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Callable, Collection, Dict, List, Optional
+
+from .parsed_note import ParsedNote, feed_key, parse_rows
+from .reply_index import ReplyIndex
+
+# Process-wide version counter: every new or patched snapshot gets a fresh number
+_versions = itertools.count(1)
+# Distinguishes version numbers of this process from those of earlier runs
+_process_epoch = format(time.time_ns(), 'x')
+
+# Rough per-row / per-cell overhead of Python lists and str objects (bytes)
+_ROW_OVERHEAD = 120
+_CELL_OVERHEAD = 50
+
+
+def _estimate_size(rows: List[list]) -> int:
+    """Approximate memory footprint of sheet rows."""
+    return sum(
+        _ROW_OVERHEAD + sum(_CELL_OVERHEAD + len(cell) for cell in row)
+        for row in rows
+    )
+
+
+class NotesSnapshot:
+    """Rows of a spreadsheet or of one of its shards (header excluded) at a given version."""
+
+    def __init__(
+        self,
+        spreadsheet_id: str,
+        rows: List[list],
+        fetched_at: Optional[float] = None,
+        size_bytes: Optional[int] = None,
+        full_synced_at: Optional[float] = None,
+        version: Optional[int] = None,
+        worksheet: str = ''
+    ):
+        self.spreadsheet_id = spreadsheet_id
+        # Shard the rows come from ('' = the first worksheet)
+        self.worksheet = worksheet
+        self.rows = rows
+        self.version = version if version is not None else next(_versions)
+        # Last time the snapshot was checked against the sheet (drives the TTL)
+        self.fetched_at = fetched_at if fetched_at is not None else time.monotonic()
+        # Last time the whole sheet was downloaded (tail syncs don't see mid-sheet edits)
+        self.full_synced_at = full_synced_at if full_synced_at is not None else self.fetched_at
+        self.size_bytes = size_bytes if size_bytes is not None else _estimate_size(rows)
+        # Parsed on first access, then shared by every reader of this snapshot
+        self._notes: Optional[List[ParsedNote]] = None
+        # Notes in feed order, sorted on first paged read
+        self._feed: Optional[List[ParsedNote]] = None
+        # Lookup structures over `notes`, built on first use
+        self._by_id: Optional[Dict[str, ParsedNote]] = None
+        self._tag_index: Optional[Dict[str, List[int]]] = None
+        self._reply_index: Optional[ReplyIndex] = None
+
+    @property
+    def revision(self) -> str:
+        """Opaque token for conditional requests; changes with every new or patched snapshot."""
+        return f"{_process_epoch}-{self.version}"
+
+    @property
+    def key(self) -> tuple:
+        return (self.spreadsheet_id, self.worksheet)
+
+    @property
+    def notes(self) -> List[ParsedNote]:
+        """Rows parsed into ParsedNote objects, in sheet order."""
+        if self._notes is None:
+            self._notes = parse_rows(self.rows)
+        return self._notes
+
+    @property
+    def feed(self) -> List[ParsedNote]:
+        """Notes in feed order: focus first, then newest first (see feed_key)."""
+        if self._feed is None:
+            self._feed = sorted(self.notes, key=feed_key, reverse=True)
+        return self._feed
+
+    @property
+    def by_id(self) -> Dict[str, ParsedNote]:
+        """Notes by note ID (the first row wins if an ID repeats)."""
+        if self._by_id is None:
+            by_id: Dict[str, ParsedNote] = {}
+            for note in self.notes:
+                by_id.setdefault(note.id, note)
+            self._by_id = by_id
+        return self._by_id
+
+    @property
+    def tag_index(self) -> Dict[str, List[int]]:
+        """Inverted tag index: tag -> positions in `notes` of the notes carrying it, ascending."""
+        if self._tag_index is None:
+            index: Dict[str, List[int]] = {}
+            for position, note in enumerate(self.notes):
+                for tag in note.tag_set:
+                    index.setdefault(tag, []).append(position)
+            self._tag_index = index
+        return self._tag_index
+
+    @property
+    def reply_index(self) -> ReplyIndex:
+        """Reply structure of `notes` (parents, replies, subtree sizes)."""
+        if self._reply_index is None:
+            self._reply_index = ReplyIndex(self.notes)
+        return self._reply_index
+
+    def page(
+        self,
+        limit: Optional[int] = None,
+        after: Optional[tuple] = None,
+        statuses: Optional[Collection[str]] = None
+    ) -> List[ParsedNote]:
+        """
+        A page of the feed.
+
+        Args:
+            limit: Max notes to return (None = all)
+            after: feed_key of the last note of the previous page
+            statuses: Only notes with one of these statuses (None = any)
+        """
+        feed = self.feed
+        start = 0
+        if after is not None:
+            # Feed is sorted descending: find the first note whose key is below `after`
+            lo, hi = 0, len(feed)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if feed_key(feed[mid]) < after:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            start = lo
+
+        notes = islice(feed, start, None)
+        if statuses is not None:
+            notes = (note for note in notes if note.status in statuses)
+        return list(islice(notes, limit))
+
+    def _derive(
+        self,
+        rows: List[list],
+        size_bytes: int,
+        fetched_at: Optional[float] = None,
+        notes: Optional[List[ParsedNote]] = None
+    ) -> "NotesSnapshot":
+        snapshot = NotesSnapshot(
+            self.spreadsheet_id,
+            rows,
+            fetched_at if fetched_at is not None else self.fetched_at,
+            size_bytes,
+            self.full_synced_at,
+            worksheet=self.worksheet
+        )
+        snapshot._notes = notes
+        return snapshot
+
+    def _notes_with_tail(self, new_rows: List[list]) -> Optional[List[ParsedNote]]:
+        # Reuse parsed notes of the old rows, parse only the new ones
+        if self._notes is None:
+            return None
+        return self._notes + parse_rows(new_rows)
+
+    def with_tail(self, new_rows: List[list]) -> "NotesSnapshot":
+        """Copy with rows found by a tail sync appended; counts as freshly fetched."""
+        return self._derive(
+            self.rows + new_rows,
+            self.size_bytes + _estimate_size(new_rows),
+            fetched_at=time.monotonic(),
+            notes=self._notes_with_tail(new_rows)
+        )
+
+    def refreshed(self) -> "NotesSnapshot":
+        """Same rows and version, confirmed up to date just now."""
+        snapshot = NotesSnapshot(
+            self.spreadsheet_id,
+            self.rows,
+            time.monotonic(),
+            self.size_bytes,
+            self.full_synced_at,
+            version=self.version,
+            worksheet=self.worksheet
+        )
+        snapshot._notes = self._notes
+        snapshot._feed = self._feed
+        snapshot._by_id = self._by_id
+        snapshot._tag_index = self._tag_index
+        snapshot._reply_index = self._reply_index
+        return snapshot
+
+    def with_appended(self, first_row: int, new_rows: List[list]) -> Optional["NotesSnapshot"]:
+        """
+        Copy with rows appended at the end of the sheet.
+
+        Args:
+            first_row: 1-based sheet row the first new row landed in
+            new_rows: Appended rows
+
+        Returns:
+            Patched snapshot, or None if rows were appended elsewhere since it was fetched
+        """
+        if first_row - 2 != len(self.rows):
+            return None
+        return self._derive(
+            self.rows + [list(r) for r in new_rows],
+            self.size_bytes + _estimate_size(new_rows),
+            notes=self._notes_with_tail(new_rows)
+        )
+
+    def with_cells(self, row_number: int, expected_note_id: str, cells: dict) -> Optional["NotesSnapshot"]:
+        """
+        Copy with some cells of one sheet row replaced.
+
+        Args:
+            row_number: 1-based sheet row (row 2 is rows[0])
+            expected_note_id: Note ID that must be in column A of that row
+            cells: {column_index (0-based): value}
+
+        Returns:
+            Patched snapshot, or None if the row does not match (snapshot is out of date)
+        """
+        idx = row_number - 2
+        if idx < 0 or idx >= len(self.rows) or not self.rows[idx] or self.rows[idx][0] != expected_note_id:
+            return None
+
+        row = list(self.rows[idx])
+        for col, value in cells.items():
+            while len(row) <= col:
+                row.append('')
+            row[col] = value
+
+        rows = list(self.rows)
+        old_row, rows[idx] = rows[idx], row
+        size_bytes = self.size_bytes + _estimate_size([row]) - _estimate_size([old_row])
+
+        notes = None
+        # Parsed notes line up with rows when no row was skipped as incomplete
+        if self._notes is not None and len(self._notes) == len(self.rows):
+            notes = list(self._notes)
+            notes[idx] = ParsedNote(row)
+        return self._derive(rows, size_bytes, notes=notes)
+
+
+class SnapshotCache:
+    """
+    Per-spreadsheet (and per-shard) snapshot cache with a TTL and a total memory cap.
+    Least recently used snapshots are evicted once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[tuple, NotesSnapshot]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, spreadsheet_id: str, worksheet: str = '') -> Optional[NotesSnapshot]:
+        """Fresh snapshot for a spreadsheet shard, or None if missing or expired."""
+        key = (spreadsheet_id, worksheet)
+        with self._lock:
+            snapshot = self._data.get(key)
+            if snapshot is None:
+                return None
+            if time.monotonic() - snapshot.fetched_at > self.ttl:
+                return None
+            self._data.move_to_end(key)
+            return snapshot
+
+    def peek(self, spreadsheet_id: str, worksheet: str = '') -> Optional[NotesSnapshot]:
+        """Cached snapshot even if expired (starting point for a tail sync)."""
+        with self._lock:
+            return self._data.get((spreadsheet_id, worksheet))
+
+    def put(self, snapshot: NotesSnapshot) -> None:
+        with self._lock:
+            self._store(snapshot)
+
+    def patch(
+        self,
+        spreadsheet_id: str,
+        fn: Callable[[NotesSnapshot], Optional[NotesSnapshot]],
+        worksheet: str = ''
+    ) -> None:
+        """
+        Replace the cached snapshot with fn(snapshot).
+        If fn returns None the snapshot can't be patched and is dropped instead.
+        """
+        key = (spreadsheet_id, worksheet)
+        with self._lock:
+            snapshot = self._data.get(key)
+            if snapshot is None:
+                return
+            patched = fn(snapshot)
+            if patched is None:
+                self._remove(key)
+            else:
+                self._store(patched)
+
+    def invalidate(self, spreadsheet_id: str, worksheet: Optional[str] = None) -> None:
+        """Drop one shard's snapshot, or every shard of the spreadsheet if worksheet is None."""
+        with self._lock:
+            if worksheet is not None:
+                self._remove((spreadsheet_id, worksheet))
+                return
+            for key in [k for k in self._data if k[0] == spreadsheet_id]:
+                self._remove(key)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _store(self, snapshot: NotesSnapshot):
+        self._remove(snapshot.key)
+        self._data[snapshot.key] = snapshot
+        self._total_bytes += snapshot.size_bytes
+        # Evict least recently used, but always keep the snapshot just stored
+        while self._total_bytes > self.max_bytes and len(self._data) > 1:
+            _, evicted = self._data.popitem(last=False)
+            self._total_bytes -= evicted.size_bytes
+
+    def _remove(self, key: tuple):
+        snapshot = self._data.pop(key, None)
+        if snapshot is not None:
+            self._total_bytes -= snapshot.size_bytes
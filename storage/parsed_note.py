@@ -0,0 +1,154 @@
+"""
+ParsedNote - compact, parsed form of a sheet row.
+
+Rows are parsed once per snapshot (see NotesSnapshot.notes) and shared by
+NoteService and RelationService: tags are pre-split into a frozenset and the
+ISO timestamp is pre-converted to epoch seconds for sorting.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Fields of the API representation (schemas.Note), in output order
+NOTE_FIELDS = (
+    'id',
+    'telegram_message_id',
+    'created_at',
+    'content',
+    'tags',
+    'reply_to_message_id',
+    'message_type',
+    'source_chat_id',
+    'source_chat_link',
+    'telegram_username',
+    'status',
+)
+# Extra field clients can ask for instead of the full content
+CONTENT_PREVIEW_FIELD = 'content_preview'
+CONTENT_PREVIEW_CHARS = 140
+
+
+def split_tags(tags_str: str) -> List[str]:
+    """
+    Split a tags cell ("#tag1, #tag2") into individual tags.
+
+    Args:
+        tags_str: Comma-separated tags string
+
+    Returns:
+        List of non-empty, stripped tags
+    """
+    if not tags_str:
+        return []
+    return [tag for tag in (t.strip() for t in tags_str.split(',')) if tag]
+
+
+def parse_timestamp(timestamp_str: str) -> float:
+    """ISO 8601 timestamp to Unix timestamp, or 0.0 if it can't be parsed."""
+    try:
+        return datetime.fromisoformat(timestamp_str).timestamp()
+    except (ValueError, TypeError):
+        logger.warning(f"Failed to parse timestamp: {timestamp_str}")
+        return 0.0
+
+
+class ParsedNote:
+    """One note. Read-only by convention: instances are shared between requests."""
+
+    __slots__ = (
+        'id',
+        'telegram_message_id',
+        'created_at',
+        'content',
+        'tags',
+        'reply_to_message_id',
+        'message_type',
+        'source_chat_id',
+        'source_chat_link',
+        'telegram_username',
+        'status',
+        'tag_set',
+        'created_ts',
+    )
+
+    def __init__(self, row: list):
+        self.id = row[0]
+        self.telegram_message_id = row[1]
+        self.created_at = row[2]
+        self.content = row[3]
+        self.tags = row[4]
+        self.reply_to_message_id = row[5] or None
+        self.message_type = row[6]
+        self.source_chat_id = row[7] or None
+        self.source_chat_link = row[8] or None
+        self.telegram_username = row[9] if len(row) > 9 and row[9] else None
+        self.status = row[10] if len(row) > 10 else ''
+        self.tag_set: FrozenSet[str] = frozenset(split_tags(self.tags))
+        self.created_ts = parse_timestamp(self.created_at)
+
+    @property
+    def content_preview(self) -> str:
+        """First CONTENT_PREVIEW_CHARS characters of the content."""
+        if len(self.content) <= CONTENT_PREVIEW_CHARS:
+            return self.content
+        return self.content[:CONTENT_PREVIEW_CHARS].rstrip() + '…'
+
+    def to_dict(self, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        API representation (the fields of schemas.Note).
+
+        Args:
+            fields: Only these fields, in this order (NOTE_FIELDS or CONTENT_PREVIEW_FIELD)
+        """
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
+        return {
+            'id': self.id,
+            'telegram_message_id': self.telegram_message_id,
+            'created_at': self.created_at,
+            'content': self.content,
+            'tags': self.tags,
+            'reply_to_message_id': self.reply_to_message_id,
+            'message_type': self.message_type,
+            'source_chat_id': self.source_chat_id,
+            'source_chat_link': self.source_chat_link,
+            'telegram_username': self.telegram_username,
+            'status': self.status,
+        }
+
+
+def parse_fields(value: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Parse a `fields=` projection ("id,created_at,content_preview").
+
+    Returns:
+        Tuple of field names, or None for all fields
+
+    Raises:
+        ValueError: On unknown field names
+    """
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in NOTE_FIELDS and f != CONTENT_PREVIEW_FIELD]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+
+def feed_key(note: ParsedNote) -> Tuple[bool, float, str]:
+    """
+    Sort key of the notes feed: focus first, then newest first, ties by note ID.
+    Uses the parsed timestamp: ISO strings with different offsets or precision
+    don't sort chronologically as text.
+    The feed is ordered by this key descending; cursors are keys of the last note served.
+    """
+    return (note.status == 'focus', note.created_ts, note.id)
+
+
+def parse_rows(rows: List[list]) -> List[ParsedNote]:
+    """Parse sheet rows, skipping incomplete ones (fewer than 9 columns)."""
+    return [ParsedNote(row) for row in rows if len(row) >= 9]
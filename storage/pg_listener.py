@@ -0,0 +1,87 @@
+"""
+PgListener - one Postgres LISTEN connection per process, shared by everything
+that reacts to NOTIFY (live note events, cache invalidation).
+
+The connection runs in a background thread. Handlers are called on that
+thread with the payload of each notification on their channel. Notifications
+sent while the connection was down are lost, so `on_connect` handlers run on
+every (re)connect to let subscribers drop whatever they may have missed.
+"""
+
+import logging
+import select
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .db import engine
+
+# How often the listener thread wakes up to check for shutdown (seconds)
+LISTEN_POLL_INTERVAL = 5.0
+# Pause before reconnecting after the connection failed (seconds)
+LISTEN_RETRY_DELAY = 5.0
+
+
+class PgListener:
+    """Dispatches NOTIFY payloads to handlers by channel."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._on_connect: List[Callable[[], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def subscribe(self, channel: str, handler: Callable[[str], None], on_connect: Callable[[], None] = None):
+        """
+        Call `handler(payload)` for every notification on `channel`. Subscribe before start().
+
+        Args:
+            on_connect: Called after every (re)connect, before new notifications arrive
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+        if on_connect is not None:
+            self._on_connect.append(on_connect)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, name='pg-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the listener thread (it exits within LISTEN_POLL_INTERVAL)."""
+        self._stopping.set()
+        self._thread = None
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                with engine.connect() as conn:
+                    conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                    for channel in self._handlers:
+                        conn.exec_driver_sql(f"LISTEN {channel}")
+                    raw = conn.connection.dbapi_connection
+                    self.logger.info(f"Listening on {', '.join(self._handlers)}")
+
+                    for on_connect in self._on_connect:
+                        on_connect()
+
+                    while not self._stopping.is_set():
+                        if select.select([raw], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                            continue
+                        raw.poll()
+                        while raw.notifies:
+                            notify = raw.notifies.pop(0)
+                            self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                self.logger.error(f"LISTEN connection failed, reconnecting: {e}")
+                self._stopping.wait(LISTEN_RETRY_DELAY)
+
+    def _dispatch(self, channel: str, payload: str):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                # One bad payload or handler must not take the connection down
+                self.logger.error(f"NOTIFY handler for {channel} failed: {e}")
@@ -0,0 +1,258 @@
+"""
+PostgresNoteStorage - the `notes` table as the primary note store.
+
+Every write lands in Postgres first and reads are served from it, so the bot
+and the webapp API no longer wait on Google. The user's spreadsheet becomes an
+export target: a background job pushes pending rows to it in batches.
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any
+
+from .base import BaseStorage
+from .cache import TTLCache
+from .google_sheets import GoogleSheetsStorage
+from .note_rows import build_note_row, escape_formula
+from .notes_snapshot import NotesSnapshot, SnapshotCache
+from .parsed_note import parse_rows
+from .notes_db import (
+    SHEET_PENDING_INSERT,
+    insert_note,
+    update_note_content,
+    update_note_status,
+    get_notes_revision,
+    get_note_rows,
+    get_note_page,
+    get_note_changes,
+    is_imported,
+    import_sheet_rows,
+    get_pending_sheet_sync,
+    mark_sheet_appended,
+    mark_sheet_synced,
+    set_sheet_state,
+)
+
+# How often the sheet sync job looks for pending notes (seconds)
+SHEET_SYNC_INTERVAL = 5
+# Max notes pushed per sync pass
+SHEET_SYNC_BATCH = 200
+# Import locks are only needed while a spreadsheet's first requests race; idle ones expire (seconds)
+IMPORT_LOCK_TTL = 600
+IMPORT_LOCKS_MAX_SIZE = 1024
+
+
+class PostgresNoteStorage(BaseStorage):
+    """Notes in Postgres, exported to the user's Google Sheet in the background."""
+
+    def __init__(self, sheets: GoogleSheetsStorage):
+        """
+        Args:
+            sheets: GoogleSheetsStorage used for access checks, the initial import and export
+        """
+        self.sheets = sheets
+        self.logger = logging.getLogger(__name__)
+
+        # Snapshots are revalidated against the DB revision on every read, the TTL only bounds memory
+        self._snapshots = SnapshotCache(ttl=3600)
+        self._imported = set()
+        self._import_locks = TTLCache(maxsize=IMPORT_LOCKS_MAX_SIZE, ttl=IMPORT_LOCK_TTL)
+
+        self._sync_task = None
+        self._sync_wakeup = None
+        self._sync_stopping = False
+
+    # ==================== Spreadsheet access (delegated) ====================
+
+    def get_service_account_email(self) -> str:
+        return self.sheets.get_service_account_email()
+
+    async def check_access(self, spreadsheet_id: str) -> tuple[bool, str]:
+        return await self.sheets.check_access(spreadsheet_id)
+
+    async def ensure_headers(self, spreadsheet_id: str):
+        await self.sheets.ensure_headers(spreadsheet_id)
+
+    # ==================== Writes ====================
+
+    async def save_note(self, spreadsheet_id: str, note_data: Dict[str, Any]) -> str:
+        """Save a note to Postgres and queue it for the sheet. Returns the note ID."""
+        record_id, row = build_note_row(note_data)
+        await asyncio.to_thread(insert_note, spreadsheet_id, row)
+        self._wake_sheet_sync()
+        return record_id
+
+    async def update_note(self, spreadsheet_id: str, message_id: int, updated_content: str, updated_tags: list) -> bool:
+        """Update content and tags of a note by Telegram message_id."""
+        await self._ensure_imported(spreadsheet_id)
+        updated = await asyncio.to_thread(
+            update_note_content,
+            spreadsheet_id,
+            str(message_id),
+            escape_formula(updated_content),
+            ", ".join(updated_tags)
+        )
+        if updated:
+            self._wake_sheet_sync()
+        else:
+            self.logger.warning(f"Message {message_id} not found in notes of {spreadsheet_id}")
+        return updated
+
+    async def update_note_status(self, spreadsheet_id: str, note_id: str, new_status: str) -> bool:
+        """Update a note's status by note_id."""
+        await self._ensure_imported(spreadsheet_id)
+        updated = await asyncio.to_thread(update_note_status, spreadsheet_id, note_id, new_status)
+        if updated:
+            self._wake_sheet_sync()
+        return updated
+
+    # ==================== Reads ====================
+
+    async def get_notes_snapshot(self, spreadsheet_id: str) -> NotesSnapshot:
+        """
+        All notes of a spreadsheet. The cached snapshot is reused while the
+        spreadsheet's revision in the DB (one primary key lookup) is unchanged.
+        """
+        await self._ensure_imported(spreadsheet_id)
+
+        revision = await asyncio.to_thread(get_notes_revision, spreadsheet_id)
+        cached = self._snapshots.peek(spreadsheet_id)
+        if cached is not None and cached.version == revision:
+            return cached
+
+        rows, revision = await asyncio.to_thread(get_note_rows, spreadsheet_id)
+        snapshot = NotesSnapshot(spreadsheet_id, rows, version=revision)
+        self._snapshots.put(snapshot)
+        return snapshot
+
+    async def get_notes_revision(self, spreadsheet_id: str) -> str:
+        """The spreadsheet's revision counter in the DB (advances in commit order, survives restarts)."""
+        await self._ensure_imported(spreadsheet_id)
+        return str(await asyncio.to_thread(get_notes_revision, spreadsheet_id))
+
+    async def get_notes_page(self, spreadsheet_id: str, limit: int = None, after: tuple = None, statuses=None) -> list:
+        """A page of the notes feed, filtered, ordered and limited in SQL."""
+        await self._ensure_imported(spreadsheet_id)
+        rows = await asyncio.to_thread(get_note_page, spreadsheet_id, limit, after, statuses)
+        return parse_rows(rows)
+
+    async def get_note_changes(self, spreadsheet_id: str, since: str):
+        """Notes whose revision is above `since` (None if it is not a revision of this store)."""
+        try:
+            since_revision = int(since)
+        except ValueError:
+            return None
+        await self._ensure_imported(spreadsheet_id)
+        rows = await asyncio.to_thread(get_note_changes, spreadsheet_id, since_revision)
+        return parse_rows(rows)
+
+    async def _ensure_imported(self, spreadsheet_id: str):
+        """Copy the existing sheet rows into the notes table the first time a spreadsheet is used."""
+        if spreadsheet_id in self._imported:
+            return
+
+        lock = self._import_locks.get(spreadsheet_id) or asyncio.Lock()
+        self._import_locks.set(spreadsheet_id, lock)
+        async with lock:
+            if spreadsheet_id in self._imported:
+                return
+
+            if not await asyncio.to_thread(is_imported, spreadsheet_id):
+                # Raises on Sheets errors, so a failed read is never recorded as an empty import
+                rows = await self.sheets.fetch_rows(spreadsheet_id)
+                inserted = await asyncio.to_thread(import_sheet_rows, spreadsheet_id, rows)
+                self.logger.info(f"Imported {inserted} notes from sheet {spreadsheet_id}")
+
+            self._imported.add(spreadsheet_id)
+
+    # ==================== Sheet export ====================
+
+    def start_sheet_sync(self):
+        """
+        Start the background job that pushes pending notes to Google Sheets.
+        Must be called from a running event loop; run it in one process only.
+        """
+        if self._sync_task is None:
+            self._sync_wakeup = asyncio.Event()
+            self._sync_task = asyncio.create_task(self._sheet_sync_loop())
+
+    def _wake_sheet_sync(self):
+        if self._sync_wakeup is not None:
+            self._sync_wakeup.set()
+
+    async def _sheet_sync_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._sync_wakeup.wait(), timeout=SHEET_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._sync_wakeup.clear()
+            # A stop requested during a pass still gets one more pass for the writes it raced with
+            final_pass = self._sync_stopping
+
+            try:
+                await self.sync_to_sheets()
+            except Exception as e:
+                self.logger.error(f"Sheet sync failed: {e}")
+
+            if final_pass:
+                break
+
+    async def sync_to_sheets(self) -> int:
+        """
+        Push one batch of pending notes to their spreadsheets.
+        New notes go out as one append per spreadsheet, edits as one batch_update per note.
+
+        Returns:
+            Number of notes marked as synced
+        """
+        pending = await asyncio.to_thread(get_pending_sheet_sync, SHEET_SYNC_BATCH)
+
+        by_sheet: Dict[str, list] = {}
+        for entry in pending:
+            by_sheet.setdefault(entry['spreadsheet_id'], []).append(entry)
+
+        synced_total = 0
+        for spreadsheet_id, entries in by_sheet.items():
+            synced = []
+            appended = []
+            try:
+                inserts = [e for e in entries if e['sheet_state'] == SHEET_PENDING_INSERT]
+
+                for e in entries:
+                    if e['sheet_state'] == SHEET_PENDING_INSERT:
+                        continue
+                    row = e['row']
+                    found = await self.sheets.write_note_fields(spreadsheet_id, row[0], row[3], row[4], row[10])
+                    if found:
+                        synced.append((e['id'], e['revision']))
+                    else:
+                        # Row was removed from the sheet by hand: append it again
+                        await asyncio.to_thread(set_sheet_state, e['id'], SHEET_PENDING_INSERT)
+                        inserts.append(e)
+
+                if inserts:
+                    await self.sheets.append_rows(spreadsheet_id, [e['row'] for e in inserts])
+                    appended.extend((e['id'], e['revision']) for e in inserts)
+            except Exception as e:
+                self.logger.error(f"Sheet sync failed for {spreadsheet_id}: {e}")
+            finally:
+                # Mark what reached the sheet even if a later write failed, so it is not appended twice
+                await asyncio.to_thread(mark_sheet_synced, synced)
+                await asyncio.to_thread(mark_sheet_appended, appended)
+                synced_total += len(synced) + len(appended)
+
+        if synced_total:
+            self.logger.info(f"Synced {synced_total} notes to Google Sheets")
+        return synced_total
+
+    async def close(self):
+        """Stop the sync job after a last pass over pending notes, then drain the Sheets queues."""
+        if self._sync_task is not None:
+            # Not cancelled: the loop finishes the pass in progress and runs one more before exiting
+            self._sync_stopping = True
+            self._wake_sheet_sync()
+            await self._sync_task
+            self._sync_task = None
+
+        await self.sheets.close()
@@ -0,0 +1,114 @@
+"""
+ReplyIndex - reply structure of a snapshot's notes.
+
+Built once per snapshot (see NotesSnapshot.reply_index): message ID -> note and
+parent message ID -> replies, pre-sorted newest first. Reply chains are
+walked iteratively over these dicts, so a request costs the size of the
+thread rather than a scan of every note per node, and deep threads can't hit
+the recursion limit. Subtree sizes are memoized.
+
+Entries are positions in the snapshot's `notes` list.
+"""
+
+from typing import Dict, List, Optional
+
+from .parsed_note import ParsedNote
+
+
+class ReplyIndex:
+    """Parent/child lookups over a list of notes. Read-only once built."""
+
+    def __init__(self, notes: List[ParsedNote]):
+        self.notes = notes
+        # Telegram message ID -> position of the first note saved from it
+        self._by_message_id: Dict[str, int] = {}
+        # Replied-to message ID -> positions of the replies, newest first (ties in sheet order)
+        self._children: Dict[str, List[int]] = {}
+        # Message ID -> number of notes in the tree below (and including) its note
+        self._sizes: Dict[str, int] = {}
+
+        for position, note in enumerate(notes):
+            if note.telegram_message_id:
+                self._by_message_id.setdefault(note.telegram_message_id, position)
+            if note.reply_to_message_id:
+                self._children.setdefault(str(note.reply_to_message_id), []).append(position)
+        for positions in self._children.values():
+            positions.sort(key=lambda p: -notes[p].created_ts)
+
+    def by_message_id(self, message_id: str) -> Optional[ParsedNote]:
+        """Note saved from a Telegram message, or None."""
+        position = self._by_message_id.get(message_id) if message_id else None
+        return self.notes[position] if position is not None else None
+
+    def parent(self, note: ParsedNote) -> Optional[ParsedNote]:
+        """Note this note replies to, or None."""
+        return self.by_message_id(note.reply_to_message_id)
+
+    def ancestors(self, note: ParsedNote) -> List[ParsedNote]:
+        """Path up to the root: [parent, grandparent, ...]."""
+        ancestors = []
+        seen = {id(note)}
+        parent = self.parent(note)
+        while parent is not None and id(parent) not in seen:
+            ancestors.append(parent)
+            seen.add(id(parent))
+            parent = self.parent(parent)
+        return ancestors
+
+    def root(self, note: ParsedNote) -> ParsedNote:
+        ancestors = self.ancestors(note)
+        return ancestors[-1] if ancestors else note
+
+    def _child_positions(self, note: ParsedNote) -> List[int]:
+        if not note.telegram_message_id:
+            return []
+        return self._children.get(str(note.telegram_message_id), [])
+
+    def replies(self, note: ParsedNote) -> List[ParsedNote]:
+        """Direct replies, newest first."""
+        return [self.notes[p] for p in self._child_positions(note)]
+
+    def siblings(self, note: ParsedNote) -> List[ParsedNote]:
+        """Other replies to the same parent, newest first (none for a root note)."""
+        if not note.reply_to_message_id:
+            return []
+        positions = self._children.get(str(note.reply_to_message_id), [])
+        return [self.notes[p] for p in positions if self.notes[p].id != note.id]
+
+    def walk(self, note: ParsedNote) -> List[tuple]:
+        """Depth-first walk from `note`: [(node, index of its parent in the walk)], note first."""
+        walk = [(note, -1)]
+        seen = {id(note)}
+        stack = [(p, 0) for p in reversed(self._child_positions(note))]
+        while stack:
+            position, parent = stack.pop()
+            child = self.notes[position]
+            if id(child) in seen:
+                continue  # Reply cycle in hand-edited data
+            seen.add(id(child))
+            walk.append((child, parent))
+            index = len(walk) - 1
+            stack.extend((p, index) for p in reversed(self._child_positions(child)))
+        return walk
+
+    def descendants(self, note: ParsedNote) -> List[ParsedNote]:
+        """Whole tree below the note in depth-first order, each level newest first."""
+        return [node for node, _ in self.walk(note)[1:]]
+
+    def subtree_size(self, note: ParsedNote) -> int:
+        """Notes in the tree starting at `note`, itself included."""
+        key = note.telegram_message_id
+        if not key:
+            return 1
+        size = self._sizes.get(key)
+        if size is None:
+            # Bottom-up over the walk, so every node below is memoized on the way
+            walk = self.walk(note)
+            sizes = [1] * len(walk)
+            for i in range(len(walk) - 1, 0, -1):
+                sizes[walk[i][1]] += sizes[i]
+            for (node, _), node_size in zip(walk, sizes):
+                if node.telegram_message_id:
+                    self._sizes.setdefault(node.telegram_message_id, node_size)
+            size = self._sizes[key]
+        return size
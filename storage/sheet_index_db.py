@@ -0,0 +1,147 @@
+"""
+Sheet row index: remembers which worksheet and row of a user's spreadsheet holds each note,
+so edits and status changes can address the row directly instead of scanning
+the whole sheet. The index is a hint — callers verify the row and rebuild the
+index from the sheet when it turns out to be stale.
+"""
+
+from sqlalchemy import Column, Integer, String, DateTime, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime
+from typing import Optional
+
+from storage.db import Base, SessionLocal
+
+
+class SheetRow(Base):
+    """Maps a note (by note_id and Telegram message ID) to its worksheet and row number."""
+    __tablename__ = 'sheet_row_index'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    spreadsheet_id = Column(String, nullable=False)
+    note_id = Column(String, nullable=False)               # Column A
+    telegram_message_id = Column(String, nullable=True)    # Column B
+    row_number = Column(Integer, nullable=False)           # 1-based, header is row 1
+    worksheet = Column(String, nullable=False, default='', server_default='')  # Shard title, '' = first sheet
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('spreadsheet_id', 'note_id', name='uq_sheet_row_note'),
+        Index('idx_sheet_row_message', 'spreadsheet_id', 'telegram_message_id'),
+    )
+
+
+def save_row_numbers(spreadsheet_id: str, entries: list[tuple[str, str, int]], worksheet: str = '') -> None:
+    """
+    Upsert row numbers for notes. A note ID given twice keeps its last row,
+    as it would across separate calls (Postgres rejects an upsert that
+    touches the same row twice).
+
+    Args:
+        spreadsheet_id: Google Sheets spreadsheet ID
+        entries: [(note_id, telegram_message_id, row_number), ...]
+        worksheet: Shard the rows are in ('' = first sheet)
+    """
+    if not entries:
+        return
+
+    by_note_id = {note_id: (message_id, row_number) for note_id, message_id, row_number in entries}
+
+    session = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        stmt = pg_insert(SheetRow).values([
+            {
+                'spreadsheet_id': spreadsheet_id,
+                'note_id': note_id,
+                'telegram_message_id': message_id,
+                'row_number': row_number,
+                'worksheet': worksheet,
+                'updated_at': now,
+            }
+            for note_id, (message_id, row_number) in by_note_id.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            constraint='uq_sheet_row_note',
+            set_={
+                'telegram_message_id': stmt.excluded.telegram_message_id,
+                'row_number': stmt.excluded.row_number,
+                'worksheet': stmt.excluded.worksheet,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        session.execute(stmt)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def replace_sheet_index(spreadsheet_id: str, entries: list[tuple[str, str, int, str]]) -> None:
+    """
+    Drop the index for a spreadsheet and rebuild it from a fresh column scan.
+
+    Args:
+        entries: [(note_id, telegram_message_id, row_number, worksheet), ...] in sheet order
+    """
+    session = SessionLocal()
+    try:
+        session.query(SheetRow).filter(SheetRow.spreadsheet_id == spreadsheet_id).delete()
+        # Duplicate note IDs (manual copies) keep their first row, like worksheet.find did
+        seen = set()
+        rows = []
+        for note_id, message_id, row_number, worksheet in entries:
+            if not note_id or note_id in seen:
+                continue
+            seen.add(note_id)
+            rows.append({
+                'spreadsheet_id': spreadsheet_id,
+                'note_id': note_id,
+                'telegram_message_id': message_id,
+                'row_number': row_number,
+                'worksheet': worksheet,
+            })
+        if rows:
+            session.bulk_insert_mappings(SheetRow, rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def find_row_by_note_id(spreadsheet_id: str, note_id: str) -> Optional[tuple[str, int]]:
+    """Indexed (worksheet, row_number) for a note ID, or None."""
+    session = SessionLocal()
+    try:
+        entry = session.query(SheetRow.worksheet, SheetRow.row_number).filter(
+            SheetRow.spreadsheet_id == spreadsheet_id,
+            SheetRow.note_id == note_id
+        ).first()
+        return (entry.worksheet, entry.row_number) if entry else None
+    finally:
+        session.close()
+
+
+def find_row_by_message_id(spreadsheet_id: str, message_id: str) -> Optional[tuple[str, str, int]]:
+    """
+    Indexed (note_id, worksheet, row_number) for a Telegram message ID, or None.
+    A message can produce several rows (caption + forwarded media); the first row wins.
+    """
+    session = SessionLocal()
+    try:
+        entry = (
+            session.query(SheetRow.note_id, SheetRow.worksheet, SheetRow.row_number)
+            .filter(
+                SheetRow.spreadsheet_id == spreadsheet_id,
+                SheetRow.telegram_message_id == message_id
+            )
+            .order_by(SheetRow.id)
+            .first()
+        )
+        return (entry.note_id, entry.worksheet, entry.row_number) if entry else None
+    finally:
+        session.close()
@@ -0,0 +1,286 @@
+"""
+SheetsScheduler - runs blocking gspread work on a bounded thread pool while
+staying inside Google's Sheets API quotas.
+
+- Jobs (one storage operation each) get a worker slot by priority, so
+  interactive reads are not stuck behind background writes.
+- Every API call inside a job takes a token from the service account's
+  read or write bucket and from the spreadsheet's bucket first.
+- 429 and 5xx responses are retried with full-jitter exponential backoff.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import gspread
+
+from .cache import TTLCache
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Worker threads for gspread calls; background jobs may use at most
+# BACKGROUND_MAX_WORKERS of them so interactive jobs always find a free one
+SHEETS_MAX_WORKERS = 8
+BACKGROUND_MAX_WORKERS = 4
+
+# Google allows 60 read and 60 write requests per minute per user (the service
+# account). Both the bot and the API process use the account, so stay below it.
+ACCOUNT_READS_PER_MINUTE = 50
+ACCOUNT_WRITES_PER_MINUTE = 50
+# Fair share for one spreadsheet, so a single busy sheet can't drain the account quota
+SPREADSHEET_REQUESTS_PER_MINUTE = 30
+# Burst size of each bucket
+BUCKET_CAPACITY = 10
+# Tokens background calls leave untouched for interactive ones
+BACKGROUND_TOKEN_RESERVE = 2
+# Spreadsheet buckets idle this long are dropped (seconds); a bucket is full again
+# after BUCKET_CAPACITY / rate (20s), so a fresh one behaves the same
+SPREADSHEET_BUCKET_IDLE_TTL = 300
+SPREADSHEET_BUCKETS_MAX_SIZE = 10000
+
+# Retries on 429 / 5xx: delay is uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 32.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Calls that change the sheet; the rest count against the read quota
+WRITE_CALLS = {'append_row', 'append_rows', 'update', 'batch_update', 'update_cell', 'update_cells', 'add_worksheet'}
+# Calls that must not be repeated after the server may have applied them
+NON_IDEMPOTENT_CALLS = {'append_row', 'append_rows', 'add_worksheet'}
+
+
+class TokenBucket:
+    """Classic token bucket. Not thread-safe: the scheduler guards it with its lock."""
+
+    def __init__(self, rate_per_minute: float, capacity: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float, reserve: float = 0) -> float:
+        """Seconds until a token is available above `reserve` (0 if available now)."""
+        self._refill(now)
+        missing = 1 + reserve - self.tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _WaitStats:
+    """Count / total / max of wait times in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'avg_seconds': round(self.total / self.count, 4) if self.count else 0.0,
+            'max_seconds': round(self.max, 4),
+        }
+
+
+class SheetsScheduler:
+    """Bounded, quota-aware executor for Google Sheets jobs."""
+
+    def __init__(self, max_workers: int = SHEETS_MAX_WORKERS, background_max_workers: int = BACKGROUND_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.background_max_workers = min(background_max_workers, max_workers)
+        self.logger = logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+
+        # Worker slots (event loop side)
+        self._waiting: list = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._running = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+
+        # Quota buckets (worker thread side)
+        self._lock = threading.Lock()
+        self._account_buckets = {
+            'read': TokenBucket(ACCOUNT_READS_PER_MINUTE, BUCKET_CAPACITY),
+            'write': TokenBucket(ACCOUNT_WRITES_PER_MINUTE, BUCKET_CAPACITY),
+        }
+        self._spreadsheet_buckets = TTLCache(maxsize=SPREADSHEET_BUCKETS_MAX_SIZE, ttl=SPREADSHEET_BUCKET_IDLE_TTL)
+        # Job context of the current worker thread (spreadsheet_id, priority)
+        self._context = threading.local()
+
+        # Metrics
+        self._slot_waits = {PRIORITY_INTERACTIVE: _WaitStats(), PRIORITY_BACKGROUND: _WaitStats()}
+        self._quota_waits = _WaitStats()
+        self._retries: Dict[int, int] = {}
+
+    # ==================== Jobs ====================
+
+    async def run(self, spreadsheet_id: Optional[str], fn: Callable, *args, priority: int = PRIORITY_INTERACTIVE):
+        """
+        Run a blocking function on the Sheets pool once a worker slot is free.
+
+        Args:
+            spreadsheet_id: Spreadsheet the job works on (selects its quota bucket), or None
+            fn: Blocking function making gspread calls through `call`
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+        """
+        started = time.monotonic()
+        await self._acquire_slot(priority)
+        self._slot_waits[priority].add(time.monotonic() - started)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._run_job, spreadsheet_id, priority, fn, args)
+        finally:
+            self._release_slot(priority)
+
+    def _run_job(self, spreadsheet_id: Optional[str], priority: int, fn: Callable, args: tuple):
+        self._context.spreadsheet_id = spreadsheet_id
+        self._context.priority = priority
+        try:
+            return fn(*args)
+        finally:
+            self._context.spreadsheet_id = None
+            self._context.priority = PRIORITY_INTERACTIVE
+
+    def _can_start(self, priority: int) -> bool:
+        if sum(self._running.values()) >= self.max_workers:
+            return False
+        return priority == PRIORITY_INTERACTIVE or self._running[PRIORITY_BACKGROUND] < self.background_max_workers
+
+    async def _acquire_slot(self, priority: int):
+        # Don't overtake waiting jobs of the same or higher priority
+        if self._can_start(priority) and not any(p <= priority for p, _, _ in self._waiting):
+            self._running[priority] += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiting, entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just before the cancel: hand it back
+                self._release_slot(priority)
+            elif entry in self._waiting:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+            raise
+
+    def _release_slot(self, priority: int):
+        self._running[priority] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting jobs, highest priority (then oldest) first."""
+        for entry in sorted(self._waiting):
+            priority, _, future = entry
+            if not self._can_start(priority):
+                continue
+            self._waiting.remove(entry)
+            if future.done():
+                continue
+            self._running[priority] += 1
+            future.set_result(None)
+        heapq.heapify(self._waiting)
+
+    # ==================== API calls ====================
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Make one Sheets API call from inside a job: wait for quota, then
+        retry 429 / 5xx with jittered backoff.
+        """
+        name = getattr(fn, '__name__', '')
+        kind = 'write' if name in WRITE_CALLS else 'read'
+
+        attempt = 0
+        while True:
+            self._throttle(kind)
+            try:
+                return fn(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status not in RETRYABLE_STATUSES or attempt >= MAX_RETRIES:
+                    raise
+                # An append that failed with 5xx may still have landed; only a 429 proves it didn't
+                if status != 429 and name in NON_IDEMPOTENT_CALLS:
+                    raise
+
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                attempt += 1
+                with self._lock:
+                    self._retries[status] = self._retries.get(status, 0) + 1
+                self.logger.warning(f"Sheets API {status} on {name or 'call'}, retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _throttle(self, kind: str):
+        """Block until the account and spreadsheet buckets both have a token, then take them."""
+        spreadsheet_id = getattr(self._context, 'spreadsheet_id', None)
+        priority = getattr(self._context, 'priority', PRIORITY_INTERACTIVE)
+        reserve = BACKGROUND_TOKEN_RESERVE if priority == PRIORITY_BACKGROUND else 0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                buckets = [self._account_buckets[kind]]
+                if spreadsheet_id:
+                    bucket = self._spreadsheet_buckets.get(spreadsheet_id)
+                    if bucket is None:
+                        bucket = TokenBucket(SPREADSHEET_REQUESTS_PER_MINUTE, BUCKET_CAPACITY)
+                    # Set on every call, so only idle buckets expire
+                    self._spreadsheet_buckets.set(spreadsheet_id, bucket)
+                    buckets.append(bucket)
+
+                now = time.monotonic()
+                wait = max(b.wait_time(now, reserve) for b in buckets)
+                if wait == 0:
+                    for b in buckets:
+                        b.take()
+                    self._quota_waits.add(waited)
+                    return
+
+            time.sleep(wait)
+            waited += wait
+
+    # ==================== Metrics ====================
+
+    def get_metrics(self) -> Dict[str, object]:
+        """
+        Queue depth and wait times since startup.
+
+        Example: {'queue_depth': {'interactive': 0, 'background': 3}, 'running': {...},
+                  'slot_wait': {'interactive': {'count': 10, 'avg_seconds': 0.01, 'max_seconds': 0.2}, ...},
+                  'quota_wait': {...}, 'retries': {429: 2}}
+        """
+        names = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BACKGROUND: 'background'}
+        depth = {name: 0 for name in names.values()}
+        for priority, _, _ in list(self._waiting):
+            depth[names[priority]] += 1
+
+        with self._lock:
+            return {
+                'queue_depth': depth,
+                'running': {names[p]: n for p, n in self._running.items()},
+                'slot_wait': {names[p]: stats.as_dict() for p, stats in self._slot_waits.items()},
+                'quota_wait': self._quota_waits.as_dict(),
+                'retries': dict(self._retries),
+            }
@@ -14,9 +14,15 @@ export const api = {
         return this.tg.initDataUnsafe?.user?.id || urlUserId || 'demo';
     },
 
-    async fetchNotes(userId) {
+    // With `since` (revision of an earlier response) the server may answer with only the changes.
+    // `limit`, `cursor` (next_cursor of the previous page) and `status` ("new,focus") page the feed.
+    async fetchNotes(userId, { since = null, limit = null, cursor = null, status = null } = {}) {
         try {
-            const response = await fetch(`/api/notes?user_id=${userId}`);
+            let query = '';
+            for (const [name, value] of Object.entries({ since, limit, cursor, status })) {
+                if (value) query += `&${name}=${encodeURIComponent(value)}`;
+            }
+            const response = await fetch(`/api/notes?user_id=${userId}${query}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -27,6 +33,21 @@ export const api = {
         }
     },
 
+    // Live note changes (Server-Sent Events); EventSource reconnects by itself.
+    // Events sent while it was disconnected are lost, so every reconnect is reported as a resync.
+    subscribeEvents(userId, onEvent) {
+        const source = new EventSource(`/api/notes/events?user_id=${userId}`);
+        for (const type of ['note_created', 'note_updated', 'status_changed', 'resync']) {
+            source.addEventListener(type, (e) => onEvent(JSON.parse(e.data)));
+        }
+        let opened = false;
+        source.addEventListener('open', () => {
+            if (opened) onEvent({ type: 'resync' });
+            opened = true;
+        });
+        return source;
+    },
+
     async updateStatus(noteId, newStatus, userId) {
         if (userId === 'demo') return;
 
@@ -43,9 +64,10 @@ export const api = {
         }
     },
 
-    async fetchRelatedNotes(noteId, userId) {
+    // mode: 'tags' (common tags) or 'semantic' (embedding similarity, falls back to tags)
+    async fetchRelatedNotes(noteId, userId, mode = 'tags') {
         try {
-            const response = await fetch(`/api/notes/${noteId}/related?user_id=${userId}`);
+            const response = await fetch(`/api/notes/${noteId}/related?user_id=${userId}&mode=${mode}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -57,6 +79,20 @@ export const api = {
         }
     },
 
+    // Related notes + reply stats for several notes in one request
+    async fetchRelations(noteIds, userId) {
+        const response = await fetch('/api/notes/relations', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, note_ids: noteIds })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        return data.relations || {};
+    },
+
     async fetchReplyChain(noteId, userId) {
         try {
             const response = await fetch(`/api/notes/${noteId}/replies?user_id=${userId}`);
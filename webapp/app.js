@@ -3,22 +3,172 @@ import { api } from './api.js';
 import { state } from './state.js';
 import { ui } from './ui.js';
 import { gestures } from './gestures.js';
+import { noteCache } from './note_cache.js';
+
+// Prefetched relations: note id -> { related, reply_stats }
+const relationsCache = new Map();
+// Cards before/after the current one whose relations are prefetched
+const PREFETCH_BEHIND = 1;
+const PREFETCH_AHEAD = 2;
+
+// Revision of the notes in state. Only taken from /api/notes responses: live
+// events can arrive out of step with a fetch, so their revision may skip changes
+let notesRevision = null;
+// Live events received while a fetch is in flight, applied on top of its result
+let eventBacklog = null;
+let cacheSaveTimer = null;
+// Live events within this window are written to the note cache together (ms)
+const CACHE_SAVE_DELAY = 2000;
+// Without a cached copy, the first card is shown from one page of the default view
+// (statuses of the 'all' mode) before every note is downloaded
+const FIRST_PAGE_SIZE = 50;
+const FIRST_PAGE_STATUS = 'new,focus';
+// Page size while downloading every note (the server's maximum)
+const FULL_PAGE_SIZE = 500;
 
 // Initialize app
 async function init() {
     api.init();
-    await loadNotes();
+    // Subscribe before fetching, so no change falls between the fetch and the stream
+    connectEvents();
     setupEventListeners();
     setupGestures();
+    await loadNotes();
     ui.render();
+    prefetchRelations();
+}
+
+// Keep notes current with changes pushed by the server
+function connectEvents() {
+    const userId = api.getUserId();
+    if (userId === 'demo') return;
+
+    api.subscribeEvents(userId, async (event) => {
+        if (eventBacklog !== null) {
+            eventBacklog.push(event);
+            return;
+        }
+        if (event.type === 'resync') {
+            // Missed events: fetch what changed since our revision
+            try {
+                await syncNotes(userId, { notes: state.allNotes, revision: notesRevision });
+            } catch (error) {
+                console.error('Error reloading notes:', error);
+                return;
+            }
+        } else {
+            const changed = state.applyNoteEvent(event);
+            scheduleCacheSave(userId);
+            if (!changed) return;
+        }
+        relationsCache.clear();  // Related notes may have changed with the note
+        ui.render();
+    });
+}
+
+// Fetch notes, only the changes if we have a cached copy, and cache the result.
+// Events that arrive meanwhile are applied afterwards, in order (they are newer
+// than or as new as the response); a resync among them fetches the delta again.
+async function syncNotes(userId, cached) {
+    eventBacklog = [];
+    let backlog;
+    try {
+        let notes, revision;
+        if (cached?.revision) {
+            const data = await api.fetchNotes(userId, { since: cached.revision });
+            notes = data.delta ? noteCache.merge(cached.notes, data) : (data.notes || []);
+            revision = data.revision;
+        } else {
+            ({ notes, revision } = await fetchAllNotes(userId));
+        }
+        setNotesKeepingCurrent(notes);
+        notesRevision = revision;
+        noteCache.save(userId, notes, notesRevision);
+    } finally {
+        backlog = eventBacklog;
+        eventBacklog = null;
+    }
+
+    if (backlog.some(event => event.type === 'resync')) {
+        return syncNotes(userId, { notes: state.allNotes, revision: notesRevision });
+    }
+    if (backlog.length > 0) {
+        backlog.forEach(event => state.applyNoteEvent(event));
+        relationsCache.clear();
+        scheduleCacheSave(userId);
+    }
+}
+
+// Every note, a page at a time. The revision is the first page's: changes made
+// while paging are newer, so the next delta sync fetches them again.
+async function fetchAllNotes(userId) {
+    let data = await api.fetchNotes(userId, { limit: FULL_PAGE_SIZE });
+    const revision = data.revision;
+    let notes = data.notes || [];
+    while (data.next_cursor) {
+        data = await api.fetchNotes(userId, { limit: FULL_PAGE_SIZE, cursor: data.next_cursor });
+        // A note whose status changed mid-way can come twice
+        notes = noteCache.merge(notes, data);
+    }
+    return { notes, revision };
+}
+
+// Replace the notes without moving away from the card on screen
+function setNotesKeepingCurrent(notes) {
+    const current = state.filteredNotes[state.currentIndex];
+    state.setNotes(notes);
+    const index = current ? state.filteredNotes.findIndex(n => n.id === current.id) : -1;
+    state.currentIndex = index >= 0 ? index : 0;
+}
+
+function scheduleCacheSave(userId) {
+    clearTimeout(cacheSaveTimer);
+    cacheSaveTimer = setTimeout(() => noteCache.save(userId, state.allNotes, notesRevision), CACHE_SAVE_DELAY);
+}
+
+// Fetch relations of the current card and its neighbours in one request
+async function prefetchRelations() {
+    const userId = api.getUserId();
+    const notes = state.filteredNotes;
+    if (userId === 'demo' || notes.length === 0) return;
+
+    const ids = [];
+    for (let offset = -PREFETCH_BEHIND; offset <= PREFETCH_AHEAD; offset++) {
+        const note = notes[(state.currentIndex + offset + notes.length) % notes.length];
+        if (note && !relationsCache.has(note.id) && !ids.includes(note.id)) {
+            ids.push(note.id);
+        }
+    }
+    if (ids.length === 0) return;
+
+    try {
+        const relations = await api.fetchRelations(ids, userId);
+        for (const [noteId, entry] of Object.entries(relations)) {
+            relationsCache.set(noteId, entry);
+        }
+    } catch (error) {
+        // Prefetch is an optimization: related mode falls back to its own request
+        console.error('Error prefetching relations:', error);
+    }
 }
 
 // Load notes from API
 async function loadNotes() {
     try {
         const userId = api.getUserId();
-        const data = await api.fetchNotes(userId);
-        state.setNotes(data.notes || []);
+        if (userId === 'demo') {
+            const data = await api.fetchNotes(userId);
+            state.setNotes(data.notes || []);
+            return;
+        }
+        const cached = await noteCache.load(userId);
+        if (!cached) {
+            // First open: show a page right away, then download the rest for the cache
+            const page = await api.fetchNotes(userId, { limit: FIRST_PAGE_SIZE, status: FIRST_PAGE_STATUS });
+            state.setNotes(page.notes || []);
+            ui.render();
+        }
+        await syncNotes(userId, cached);
     } catch (error) {
         console.log('Loading demo data due to error:', error);
         loadDemoData();
@@ -257,6 +407,7 @@ async function handleToggleFocus() {
     if (!note) return;
 
     const newStatus = state.toggleFocus();
+    relationsCache.clear();  // Cached related notes carry the old status
     ui.render();
     api.haptic('medium');
 
@@ -273,6 +424,7 @@ async function handleDone() {
     if (!note) return;
 
     state.markDone();
+    relationsCache.clear();
     ui.render();
     api.haptic('medium');
 
@@ -290,6 +442,7 @@ function handlePrev() {
     state.currentIndex = (state.currentIndex - 1 + state.filteredNotes.length) % state.filteredNotes.length;
     ui.render();
     api.haptic('light');
+    prefetchRelations();
 }
 
 // Handle next
@@ -297,6 +450,7 @@ function handleNext() {
     state.nextNote();
     ui.render();
     api.haptic('light');
+    prefetchRelations();
 }
 
 // Handle open channel - open link without closing app
@@ -334,6 +488,15 @@ async function handleEnterRelated() {
     // Enter related mode
     state.enterRelatedMode();
 
+    // Prefetched: no loading state, no request
+    const cached = relationsCache.get(note.id);
+    if (cached) {
+        state.setRelatedNotes(cached.related, note.id);
+        ui.render();
+        api.haptic('medium');
+        return;
+    }
+
     // Show loading state
     ui.renderHeader();
     ui.renderLoadingState('Вычисляем связи...');
@@ -419,10 +582,8 @@ async function handleReplyUp() {
     const note = state.getCurrentNote();
     if (!note || !note.reply_to_message_id) return;
 
-    // Find parent in chain (use string comparison)
-    const parentIndex = state.replyChain.findIndex(n =>
-        String(n.telegram_message_id) === String(note.reply_to_message_id)
-    );
+    // Find parent in chain
+    const parentIndex = state.replyParentIndex(note);
 
     if (parentIndex >= 0) {
         // Remember current note as selected branch for the parent
@@ -442,9 +603,7 @@ async function handleReplyDown() {
     if (!note) return;
 
     // Find all children
-    const children = state.replyChain.filter(n =>
-        String(n.reply_to_message_id) === String(note.telegram_message_id)
-    );
+    const children = state.replyChildrenOf(note);
 
     if (children.length === 0) return;
 
@@ -455,7 +614,7 @@ async function handleReplyDown() {
         if (tracked) targetChild = tracked;
     }
 
-    const childIndex = state.replyChain.findIndex(n => n.id === targetChild.id);
+    const childIndex = state.replyChain.indexOf(targetChild);
     if (childIndex >= 0) {
         state.replyIndex = childIndex;
         state.currentBranchChildId = null;  // Reset for next level
@@ -475,9 +634,7 @@ async function handleReplyBranch() {
     console.log('handleReplyBranch called, note:', note.id);
 
     // Find all children of current note in the full chain
-    const children = state.replyChain.filter(n =>
-        String(n.reply_to_message_id) === String(note.telegram_message_id)
-    );
+    const children = state.replyChildrenOf(note);
 
     console.log('Children found:', children.length, children.map(c => c.id));
 
@@ -513,22 +670,14 @@ function calculateReplyStats(note) {
 
     // Count ancestors (up)
     let up = 0;
-    let current = note;
-    while (current.reply_to_message_id) {
-        const parent = state.replyChain.find(n =>
-            String(n.telegram_message_id) === String(current.reply_to_message_id)
-        );
-        if (parent) {
-            up++;
-            current = parent;
-        } else break;
+    let parentIndex = state.replyParentIndex(note);
+    while (parentIndex >= 0 && up < state.replyChain.length) {
+        up++;
+        parentIndex = state.replyParentIndex(state.replyChain[parentIndex]);
     }
 
     // Count direct children (down) - also used for branches
-    const children = state.replyChain.filter(n =>
-        String(n.reply_to_message_id) === String(note.telegram_message_id)
-    );
-    const down = children.length;
+    const down = state.replyChildrenOf(note).length;
 
     console.log('calculateReplyStats for', note.id, ':', { up, down, branches: down });
 
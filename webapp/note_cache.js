@@ -0,0 +1,52 @@
+// note_cache.js - Notes kept in IndexedDB between opens, so a reopen only fetches changes
+const DB_NAME = 'ayda_notes';
+const STORE = 'notes';
+
+function openDb() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(DB_NAME, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(STORE);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function run(mode, action) {
+    return openDb().then(db => new Promise((resolve, reject) => {
+        const tx = db.transaction(STORE, mode);
+        const request = action(tx.objectStore(STORE));
+        tx.oncomplete = () => { db.close(); resolve(request.result); };
+        tx.onerror = () => { db.close(); reject(tx.error); };
+    }));
+}
+
+export const noteCache = {
+    // { notes, revision } saved for this user, or null
+    async load(userId) {
+        if (!window.indexedDB) return null;
+        try {
+            return (await run('readonly', store => store.get(String(userId)))) || null;
+        } catch (error) {
+            console.error('Error reading note cache:', error);
+            return null;
+        }
+    },
+
+    async save(userId, notes, revision) {
+        if (!window.indexedDB || !revision) return;
+        try {
+            await run('readwrite', store => store.put({ notes, revision }, String(userId)));
+        } catch (error) {
+            // The cache only saves bandwidth; the next open loads everything again
+            console.error('Error writing note cache:', error);
+        }
+    },
+
+    // Merge a delta response (delta=true) into cached notes
+    merge(notes, data) {
+        const byId = new Map(notes.map(n => [n.id, n]));
+        for (const id of data.removed || []) byId.delete(id);
+        for (const note of data.notes) byId.set(note.id, note);
+        return Array.from(byId.values());
+    }
+};
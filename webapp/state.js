@@ -31,6 +31,8 @@ export const state = {
     replyBranches: [],          // Available branches at current level
     replyBranchIndex: 0,        // Current branch index
     replyStats: null,           // { up, down, branches, total }
+    replyByMessageId: new Map(),  // telegram_message_id -> index in replyChain
+    replyChildren: new Map(),     // replied-to message id -> replies, in chain order
 
     // Set notes from API
     setNotes(notes) {
@@ -57,6 +59,39 @@ export const state = {
         }
     },
 
+    // Apply a live change (note_created / note_updated / status_changed).
+    // Returns false if nothing changed. The card on screen stays on screen.
+    applyNoteEvent(event) {
+        const note = this.allNotes.find(n => n.id === event.note_id);
+
+        if (event.type === 'status_changed') {
+            // Our own status changes come back as events too
+            if (!note || note.status === event.status) return false;
+            note.status = event.status;
+        } else if (note) {
+            Object.assign(note, event.note);
+        } else if (event.type === 'note_created') {
+            this.allNotes.push(event.note);
+        } else {
+            return false;
+        }
+
+        this.refilterKeepingCurrent();
+        return true;
+    },
+
+    // Re-run the filters without moving away from the current card
+    refilterKeepingCurrent() {
+        const current = this.filteredNotes[this.currentIndex];
+        this.applyFilters();
+        const index = current ? this.filteredNotes.indexOf(current) : -1;
+        if (index >= 0) {
+            this.currentIndex = index;
+        } else if (this.currentIndex >= this.filteredNotes.length) {
+            this.currentIndex = Math.max(0, this.filteredNotes.length - 1);
+        }
+    },
+
     // Mode switching
     setMode(newMode) {
         this.previousMode = this.mode;
@@ -288,6 +323,22 @@ export const state = {
 
     setReplyChain(chain, currentIndex, stats, branches = []) {
         this.replyChain = chain;
+        // Index the chain once, so navigation doesn't rescan it on every gesture
+        this.replyByMessageId = new Map();
+        this.replyChildren = new Map();
+        chain.forEach((note, index) => {
+            const messageId = String(note.telegram_message_id);
+            if (!this.replyByMessageId.has(messageId)) {
+                this.replyByMessageId.set(messageId, index);
+            }
+            if (note.reply_to_message_id) {
+                const parentId = String(note.reply_to_message_id);
+                if (!this.replyChildren.has(parentId)) {
+                    this.replyChildren.set(parentId, []);
+                }
+                this.replyChildren.get(parentId).push(note);
+            }
+        });
         this.replyIndex = currentIndex;
         this.replyStats = stats;
         this.replyBranches = branches;
@@ -295,10 +346,29 @@ export const state = {
         this.currentBranchChildId = null;  // Reset branch tracking
     },
 
+    // Index in replyChain of the note this one replies to (-1 if not in the chain)
+    replyParentIndex(note) {
+        if (!note.reply_to_message_id) return -1;
+        const index = this.replyByMessageId.get(String(note.reply_to_message_id));
+        return index === undefined ? -1 : index;
+    },
+
+    // Direct replies to a note, in chain order
+    replyChildrenOf(note) {
+        return this.replyChildren.get(String(note.telegram_message_id)) || [];
+    },
+
+    // Replies to the same parent, the note itself included
+    replySiblingsOf(note) {
+        return this.replyChildren.get(String(note.reply_to_message_id)) || [];
+    },
+
     exitReplyRelatedMode() {
         const originalNoteId = this.parentNoteId;
         this.mode = this.previousMode;
         this.replyChain = [];
+        this.replyByMessageId = new Map();
+        this.replyChildren = new Map();
         this.replyIndex = 0;
         this.replyStats = null;
         this.replyBranches = [];
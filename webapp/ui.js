@@ -70,9 +70,7 @@ export const ui = {
             if (currentNote) {
                 // Case 1: current note has multiple children and we're selecting which one
                 if (replyStats && replyStats.down > 1) {
-                    const children = replyChain.filter(n =>
-                        String(n.reply_to_message_id) === String(currentNote.telegram_message_id)
-                    );
+                    const children = state.replyChildrenOf(currentNote);
                     if (children.length > 1) {
                         let selectedIdx = 0;
                         if (currentBranchChildId) {
@@ -85,9 +83,7 @@ export const ui = {
 
                 // Case 2: current note has siblings (we ARE on a branch)
                 if (!branchInfo && currentNote.reply_to_message_id) {
-                    const siblings = replyChain.filter(n =>
-                        String(n.reply_to_message_id) === String(currentNote.reply_to_message_id)
-                    );
+                    const siblings = state.replySiblingsOf(currentNote);
                     if (siblings.length > 1) {
                         const myIdx = siblings.findIndex(s => s.id === currentNote.id);
                         if (myIdx >= 0) {